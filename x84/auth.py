@@ -0,0 +1,167 @@
+"""
+Password verification by a pool of worker processes for x/84.
+
+Password digests, such as bcrypt, are deliberately expensive.  When
+verified by the threads of ssh negotiation, they hold the global
+interpreter lock of the engine, and a burst of attempted logins stalls
+every connected session.  Instead, passwords are verified by a fixed-size
+pool of processes.
+
+The following options of section ``[ssh]`` are available:
+
+- ``auth_workers``: number of worker processes.
+- ``auth_per_ip``: maximum verifications pending for any ip address.
+- ``auth_queue_size``: maximum verifications pending for all ip addresses.
+- ``auth_timeout``: seconds a verification may be pending before it fails.
+"""
+
+# std imports
+import multiprocessing
+import threading
+import logging
+import signal
+
+
+def _init_worker():
+    """ Worker processes ignore ^C, they are terminated by the engine. """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _check_password(password, try_pass, digestpw, pass_ucase):
+    """
+    Return whether ``try_pass`` matches, as a worker process.
+
+    A failed verification returns False rather than raising, so that the
+    callback of :meth:`AuthPool.verify` is always called.
+    """
+    from x84.bbs.userbase import check_password
+    try:
+        return check_password(password, try_pass, digestpw, pass_ucase)
+    # pylint: disable=W0703
+    #         Catching too general exception
+    except Exception as err:
+        logging.getLogger(__name__).error(
+            'password verification failed: {0}'.format(err))
+        return False
+
+
+class AuthPool(object):
+
+    """
+    Fixed-size pool of processes verifying passwords.
+
+    Each ip address may have at most ``per_ip`` verifications pending, and
+    all ip addresses at most ``max_pending``.  A verification rejected by
+    these limits, or not completed within ``timeout`` seconds, fails and is
+    recorded as an attempted login by :mod:`x84.fail2ban`.  Passwords of
+    an ip address banned by :mod:`x84.fail2ban` are not verified.
+    """
+
+    #: default number of worker processes.
+    NUM_WORKERS = 2
+
+    #: default maximum number of verifications pending for an ip address.
+    PER_IP = 2
+
+    #: default maximum number of verifications pending.
+    MAX_PENDING = 32
+
+    #: default seconds a verification may be pending.
+    TIMEOUT = 10
+
+    def __init__(self, num_workers=None, per_ip=None, max_pending=None,
+                 timeout=None):
+        """ Class initializer. """
+        from x84.fail2ban import get_fail2ban_function
+        self.log = logging.getLogger(__name__)
+        self.num_workers = num_workers or self.NUM_WORKERS
+        self.per_ip = per_ip or self.PER_IP
+        self.max_pending = max_pending or self.MAX_PENDING
+        self.timeout = timeout or self.TIMEOUT
+        self.check_ban = get_fail2ban_function()
+        self.lock = threading.Lock()
+        # ip address => number of verifications pending.
+        self.pending = {}
+        self.pool = None
+
+    def start(self):
+        """
+        Start worker processes, if not yet started.
+
+        Processes are forked, and so should be started by the main thread,
+        before any other threads are started.
+        """
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.num_workers,
+                                             initializer=_init_worker)
+
+    def verify(self, address, password, try_pass):
+        """
+        Return whether ``try_pass`` matches encrypted ``password``.
+
+        :param str address: ip address of the client.
+        :param tuple password: encrypted password as tuple (salt, hash).
+        :param unicode try_pass: password given in plain-text.
+        :rtype: bool
+        """
+        from x84.bbs.userbase import get_digestpw
+        from x84.bbs.ini import get_ini
+        from x84.fail2ban import is_banned
+
+        if is_banned(address):
+            self.log.debug('password of banned ip {0} not verified.'
+                           .format(address))
+            return False
+
+        with self.lock:
+            num_pending = self.pending.get(address, 0)
+            reject = (num_pending >= self.per_ip or
+                      sum(self.pending.values()) >= self.max_pending)
+            if not reject:
+                self.pending[address] = num_pending + 1
+
+        if reject:
+            self.log.warn('password verification rejected for {0}, '
+                          '{1} pending.'.format(address, num_pending))
+            self.check_ban(address)
+            return False
+
+        try:
+            self.start()
+            pass_ucase = get_ini('system', 'pass_ucase', getter='getboolean')
+            result = self.pool.apply_async(
+                _check_password,
+                (password, try_pass, get_digestpw(), pass_ucase))
+            return result.get(self.timeout)
+        except multiprocessing.TimeoutError:
+            self.log.warn('password verification timed out for {0}.'
+                          .format(address))
+            self.check_ban(address)
+            return False
+        finally:
+            self.release(address)
+
+    def release(self, address):
+        """ Complete a pending verification of ``address``. """
+        with self.lock:
+            self.pending[address] -= 1
+            if not self.pending[address]:
+                del self.pending[address]
+
+#: Singleton pool of the engine process, see :func:`get_auth_pool`.
+AUTH_POOL = None
+
+
+def get_auth_pool():
+    """ Return singleton :class:`AuthPool`, sized by ini configuration. """
+    # pylint: disable=W0603
+    #         Using the global statement
+    global AUTH_POOL
+    if AUTH_POOL is None:
+        from x84.bbs.ini import get_ini
+        AUTH_POOL = AuthPool(
+            num_workers=get_ini('ssh', 'auth_workers', getter='getint'),
+            per_ip=get_ini('ssh', 'auth_per_ip', getter='getint'),
+            max_pending=get_ini('ssh', 'auth_queue_size', getter='getint'),
+            timeout=get_ini('ssh', 'auth_timeout', getter='getint'))
+    return AUTH_POOL
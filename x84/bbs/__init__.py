@@ -12,7 +12,13 @@ from x84.bbs.editor import LineEditor, ScrollingEditor
 from x84.bbs.exception import Disconnected, Goto
 from x84.bbs.ini import get_ini
 from x84.bbs.lightbar import Lightbar
-from x84.bbs.msgbase import list_msgs, get_msg, list_tags, Msg, list_privmsgs
+from x84.bbs.msgbase import (list_msgs, get_msg, list_tags, count_tags, Msg,
+                             list_privmsgs, get_subscription,
+                             set_subscription, list_unread, count_unread,
+                             list_subscribed, count_subscribed, mark_read,
+                             discard_unread, get_readmarks,
+                             discard_search, get_thread, discard_thread,
+                             get_msg_header, get_msg_headers, delete_msg)
 from x84.bbs.output import (echo, timeago, encode_pipe, decode_pipe,
                             syncterm_setfont, showart, ropen,
                             from_cp437,  # deprecated in v2.0
@@ -34,4 +40,8 @@ __all__ = ('list_users', 'get_user', 'find_user', 'User', 'Group', 'list_msgs',
            'Selector', 'Disconnected', 'Goto', 'Lightbar', 'from_cp437', 'DBProxy', 'Pager', 'Door',
            'DOSDoor', 'goto', 'disconnect', 'getsession', 'getterminal', 'getch', 'gosub', 'ropen',
            'showart', 'Dropfile', 'encode_pipe', 'decode_pipe', 'syncterm_setfont', 'get_ini',
-           'Script', 'list_privmsgs')
+           'Script', 'list_privmsgs', 'count_tags', 'get_subscription',
+           'set_subscription', 'list_unread', 'count_unread',
+           'list_subscribed', 'count_subscribed', 'mark_read',
+           'discard_unread', 'get_readmarks', 'discard_search', 'get_thread',
+           'discard_thread', 'get_msg_header', 'get_msg_headers', 'delete_msg')
@@ -1,6 +1,10 @@
 """ Database proxy helper for x/84. """
 # std imports
+import collections
+import contextlib
 import logging
+import pickle
+import time
 
 # local
 from x84.bbs.ini import get_ini
@@ -9,9 +13,94 @@ from x84.db import (
     get_database,
     get_db_func,
     get_db_lock,
+    get_invalidations,
+    record_invalidations,
+    is_engine,
     log_db_cmd,
 )
 
+#: default maximum number of entries of session-local cache.
+CACHE_SIZE = 512
+
+#: default maximum total bytes of pickled values of session-local cache,
+#: a value greater than a quarter of which is not cached.
+CACHE_BYTES = 4 * 1024 * 1024
+
+#: read methods served by cache entries of a single key.
+CACHE_KEY_METHODS = ('__getitem__', 'get', '__contains__', 'has_key')
+
+#: read methods served by cache entries of an entire table.  Methods
+#: ``values()`` and ``items()`` are not cached, their results are as
+#: large as the table.
+CACHE_TABLE_METHODS = ('keys', '__len__')
+
+#: Session-local LRU cache of pickled database values, keyed by
+#: ``(schema, table, key, method)``: where ``key`` is ``None`` for
+#: entries of :data:`CACHE_TABLE_METHODS`, and ``method`` ``None``
+#: for entries of :data:`CACHE_KEY_METHODS`, which are stored as a
+#: tuple of ``(found, value)``.
+CACHE = collections.OrderedDict()
+
+#: incremented for each invalidation received, so that a value read
+#: from the database is not cached when it may have since been modified.
+CACHE_GENERATION = [0]
+
+#: total bytes of pickled values of :data:`CACHE`.
+CACHE_USED = [0]
+
+#: number of locks held by the session, by database schema, see
+#: :meth:`DBProxy.acquire`.  Reads of a schema while any of its locks
+#: are held bypass the session-local cache.
+LOCKS_HELD = collections.defaultdict(int)
+
+
+_ITER_KWARGS_DOC = """
+
+Optional keyword arguments ``key_range``, ``where`` and ``batch_size``
+filter rows by the database, and retrieve them in pages, see
+:meth:`x84.db.PooledSqliteDict.page`.  For example, to iterate over
+public messages of index 100 and greater::
+
+    DBProxy(MSGDB).itervalues(key_range=(100, None),
+                              where=[('tags', 'contains', u'public')])
+"""
+
+
+def _cache_key(key):
+    """ Return database ``key`` as unicode, as it is compared by sqlite. """
+    if isinstance(key, bytes):
+        return key.decode('utf8', 'replace')
+    if not isinstance(key, unicode):
+        return unicode(key)
+    return key
+
+
+def invalidate_cache(invalidations):
+    """
+    Discard cached values of the given keys.
+
+    :param list invalidations: sequence of ``(schema, table, key)``, where
+        ``key`` of ``None`` discards all values of ``table``.  These are
+        received by sessions as event ``db-invalidate``.
+    """
+    CACHE_GENERATION[0] += 1
+    for schema, table, key in invalidations:
+        if key is None:
+            for cache_key in [_key for _key in CACHE
+                              if _key[:2] == (schema, table)]:
+                _cache_discard(cache_key)
+            continue
+        _cache_discard((schema, table, _cache_key(key), None))
+        for method in CACHE_TABLE_METHODS:
+            _cache_discard((schema, table, None, method))
+
+
+def _cache_discard(cache_key):
+    """ Discard cached value of ``cache_key``, if any. """
+    blob = CACHE.pop(cache_key, None)
+    if blob is not None:
+        CACHE_USED[0] -= len(blob)
+
 
 class DBProxy(object):
 
@@ -24,7 +113,8 @@ class DBProxy(object):
     transfer.
     """
 
-    def __init__(self, schema, table='unnamed', use_session=True):
+    def __init__(self, schema, table='unnamed', use_session=True,
+                 use_cache=True):
         """
         Class initializer.
 
@@ -35,6 +125,10 @@ class DBProxy(object):
                                  :class:`x84.bbs.session.Session` instance),
                                  or returned directly (such as used by the main
                                  thread engine components.)
+        :param bool use_cache: Whether reads by a session may be returned by
+                               the session-local cache, invalidated by the
+                               engine as other sessions write.  Disabled when
+                               ini option ``[session] db_cache_size`` is 0.
         """
         self.log = logging.getLogger(__name__)
         self.schema = schema
@@ -44,19 +138,60 @@ class DBProxy(object):
         from x84.bbs.session import getsession
         self._session = use_session and getsession()
 
-    def proxy_iter_session(self, method, *args):
-        """ Proxy for iterable-return method calls over session IPC pipe. """
+        self._cache_size = self._cache_bytes = 0
+        if self._session and use_cache:
+            self._cache_size = (
+                get_ini('session', 'db_cache_size', getter='getint')
+                if get_ini('session', 'db_cache_size') else CACHE_SIZE)
+            self._cache_bytes = (
+                get_ini('session', 'db_cache_bytes', getter='getint')
+                if get_ini('session', 'db_cache_bytes') else CACHE_BYTES)
+
+    def proxy_pages(self, method, key_range=None, where=None,
+                    batch_size=None):
+        """
+        Proxy for iterable dictionary method calls, retrieved in pages.
+
+        Rows are retrieved ``batch_size`` at a time, and only those matching
+        ``key_range`` and ``where`` are returned, see
+        :meth:`x84.db.PooledSqliteDict.page`.  When used by a session, the
+        next page is requested before the rows of the current page are
+        yielded, so that only a single page request is outstanding.
+        """
+        batch_size = batch_size or (
+            get_ini('session', 'db_batch_size', getter='getint')
+            if get_ini('session', 'db_batch_size') else None)
+        after = 0
+        if not self._session:
+            while after is not None:
+                after, rows = self.proxy_method_direct(
+                    'page', method, after, batch_size, key_range, where)
+                for row in rows:
+                    yield row
+            return
+
         event = 'db={0}'.format(self.schema)
         self._session.flush_event(event)
-        self._session.send_event(event, (self.table, method, args))
-        data = self._session.read_event(event)
-        assert data == (None, 'StartIteration'), (
-            'iterable proxy used on non-iterable, {0!r}'.format(data))
-        data = self._session.read_event(event)
-        while data != (None, StopIteration):
-            yield data
-            data = self._session.read_event(event)
-        self._session.flush_event(event)
+        request = lambda after: self._session.send_event(event, (
+            self.table, 'page',
+            (method, after, batch_size, key_range, where)))
+        request(after)
+        pending = True
+        try:
+            while after is not None:
+                after, rows = self._session.read_event(event)
+                pending = False
+                if after is not None:
+                    # prefetch next page
+                    request(after)
+                    pending = True
+                for row in rows:
+                    yield row
+        finally:
+            if pending:
+                # iteration was abandoned, discard the prefetched page,
+                # so that it is not mistaken as a reply to a later request.
+                self._session.read_event(event)
 
     def proxy_method_direct(self, method, *args):
         """ Proxy for direct dictionary method calls. """
@@ -69,42 +204,370 @@ class DBProxy(object):
             return func(*args)
         finally:
             dictdb.close()
+            record_invalidations(self.schema, self.table, method, args)
 
-    def proxy_iter(self, method, *args):
-        """ Proxy for iterable dictionary method calls. """
-        if self._session:
-            return self.proxy_iter_session(method, *args)
+    def proxy_iter(self, method, **kwargs):
+        """
+        Proxy for iterable dictionary method calls.
 
-        return self.proxy_method_direct(method, *args)
+        Keyword arguments ``key_range``, ``where``, and ``batch_size`` are
+        those of :meth:`proxy_pages`.
+        """
+        return self.proxy_pages(method, **kwargs)
 
     def proxy_method(self, method, *args):
         """ Proxy for dictionary method calls. """
         if self._session:
+            if self._cache_size:
+                return self.proxy_method_cached(method, *args)
             return self.proxy_method_session(method, *args)
 
         return self.proxy_method_direct(method, *args)
 
+    def proxy_method_cached(self, method, *args):
+        """
+        Proxy for dictionary method calls using session-local cache.
+
+        Writes discard any cached values of the keys modified, reads of
+        :data:`CACHE_KEY_METHODS` and :data:`CACHE_TABLE_METHODS` are
+        returned from cache when found, after receiving any pending
+        ``db-invalidate`` events from the engine.  While a lock of this
+        database is held, reads are always made by the database.
+        """
+        if not LOCKS_HELD[self.schema]:
+            if method in CACHE_KEY_METHODS:
+                return self._cached_key(method, *args)
+            elif method in CACHE_TABLE_METHODS:
+                return self._cached_table(method)
+
+        invalidate_cache(get_invalidations(
+            self.schema, self.table, method, args))
+        return self.proxy_method_session(method, *args)
+
+    def _cache_get(self, cache_key):
+        """ Return cached value of ``cache_key``, raises KeyError. """
+        self._session.buffer_pending_events()
+        blob = CACHE[cache_key]
+        # the most recently used entry is moved to the end.
+        del CACHE[cache_key]
+        CACHE[cache_key] = blob
+        return pickle.loads(blob)
+
+    def _cache_set(self, cache_key, value, generation):
+        """ Store ``value`` as ``cache_key``, unless invalidated since. """
+        if generation == CACHE_GENERATION[0]:
+            blob = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            if len(blob) > self._cache_bytes / 4:
+                return
+            _cache_discard(cache_key)
+            CACHE[cache_key] = blob
+            CACHE_USED[0] += len(blob)
+            while (len(CACHE) > self._cache_size or
+                   CACHE_USED[0] > self._cache_bytes):
+                CACHE_USED[0] -= len(CACHE.popitem(last=False)[1])
+
+    def _cached_key(self, method, key, default=None):
+        """ Return result of read ``method`` of a single ``key``. """
+        cache_key = (self.schema, self.table, _cache_key(key), None)
+        try:
+            found, value = self._cache_get(cache_key)
+        except KeyError:
+            generation = CACHE_GENERATION[0]
+            try:
+                found, value = True, self.proxy_method_session(
+                    '__getitem__', key)
+            except KeyError:
+                found, value = False, None
+            self._cache_set(cache_key, (found, value), generation)
+        if method in ('__contains__', 'has_key'):
+            return found
+        elif found:
+            return value
+        elif method == 'get':
+            return default
+        raise KeyError(key)
+
+    def _cached_table(self, method):
+        """ Return result of read ``method`` of the entire table. """
+        cache_key = (self.schema, self.table, None, method)
+        try:
+            return self._cache_get(cache_key)
+        except KeyError:
+            generation = CACHE_GENERATION[0]
+            value = self.proxy_method_session(method)
+            self._cache_set(cache_key, value, generation)
+            return value
+
     def proxy_method_session(self, method, *args):
         """ Proxy for dictionary method calls over IPC pipe. """
         event = 'db-{0}'.format(self.schema)
         self._session.send_event(event, (self.table, method, args))
         return self._session.read_event(event)
 
-    def acquire(self):
-        """ Acquire system-wide lock on database. """
-        lock = get_db_lock(schema=self.schema, table=self.table)
-        if self._tap_db:
-            self.log.debug('lock acquire schema=%s, table=%s',
-                           self.schema, self.table)
-        lock.acquire()
+    def transaction(self):
+        """
+        Return a :class:`DBTransaction` of this database.
+
+        Operations of the returned context manager are collected, and
+        executed as a single database transaction, in a single request
+        when used by a session, on exit of the context manager.
+        """
+        return DBTransaction(self)
+
+    def execute_transaction(self, operations):
+        """
+        Execute a sequence of operations in a single transaction.
+
+        :param list operations: sequence of ``(table, method, args)``.
+        :rtype: list
+        :returns: return value of each operation, in order.
+        """
+        return self.proxy_method('transaction', operations)
+
+    def next_index(self, count=1):
+        """
+        Return next integer index of this table, allocated atomically.
+
+        :param int count: allocate a block of this many indices, the
+                          first of which is returned.
+        """
+        return self.proxy_method('next_index', count)
+
+    def get_many(self, keys):
+        """ Return dict of values of any ``keys`` found, in bulk. """
+        return self.proxy_method('get_many', list(keys))
+
+    def items_range(self, start, stop):
+        """ Return list of ``(key, value)`` of keys ``start <= key < stop``. """
+        return self.proxy_method('items_range', start, stop)
+
+    def set_add(self, key, member):
+        """ Add ``member`` to set value of ``key``, created if not found. """
+        return self.proxy_method('set_add', key, member)
+
+    def set_discard(self, key, member):
+        """ Remove ``member`` from set value of ``key``, if found. """
+        return self.proxy_method('set_discard', key, member)
+
+    def set_membership(self, member, keys):
+        """ Make ``member`` found only in set values of given ``keys``. """
+        return self.proxy_method('set_membership', member, keys)
+
+    def call_method(self, key, method, args=(), default=None):
+        """
+        Call ``method`` of the value of ``key``, which is then stored.
+
+        :param default: value of ``key`` when not found.
+        :returns: return value of ``method``.
+        """
+        return self.proxy_method('call_method', key, method, args, default)
+
+    def dict_set(self, key, subkey, value):
+        """ Set ``subkey`` of dict value of ``key``, created if not found. """
+        return self.proxy_method('dict_set', key, subkey, value)
+
+    def dict_del(self, key, subkey):
+        """ Delete ``subkey`` of dict value of ``key``, returns bool. """
+        return self.proxy_method('dict_del', key, subkey)
+
+    def field_get(self, key, field, default=None):
+        """ Return value of ``field`` of ``key``, or ``default``. """
+        return self.proxy_method('field_get', key, field, default)
+
+    def field_get_many(self, key, fields=None):
+        """
+        Return dict of values of any ``fields`` of ``key`` found.
+
+        :param list fields: return only these fields, or all fields of
+                            ``key`` when ``None``.
+        :rtype: dict
+        """
+        return self.proxy_method('field_get_many', key,
+                                 None if fields is None else list(fields))
+
+    def field_set(self, key, field, value):
+        """ Set value of ``field`` of ``key``. """
+        return self.proxy_method('field_set', key, field, value)
+
+    def field_del(self, key, field):
+        """ Delete ``field`` of ``key``, if found, returns bool. """
+        return self.proxy_method('field_del', key, field)
+
+    def index_add(self, key, member):
+        """ Add ``member`` to index of ``key``. """
+        return self.proxy_method('index_add', key, member)
+
+    def index_discard(self, key, member):
+        """ Remove ``member`` from index of ``key``, if found. """
+        return self.proxy_method('index_discard', key, member)
+
+    def index_update(self, key, members):
+        """ Add all ``members`` to index of ``key``. """
+        return self.proxy_method('index_update', key, members)
+
+    def index_difference_update(self, key, members, prefix=False):
+        """
+        Remove all ``members`` from index of ``key``, if found.
+
+        :param bool prefix: remove from index of all keys beginning with
+                            ``key``.
+        """
+        return self.proxy_method('index_difference_update', key, members,
+                                 prefix)
+
+    def index_clear(self, key):
+        """ Remove all members from index of ``key``. """
+        return self.proxy_method('index_clear', key)
+
+    def index_membership(self, member, keys):
+        """ Make ``member`` found only in index of given ``keys``. """
+        return self.proxy_method('index_membership', member, keys)
 
-    def release(self):
-        """ Release system-wide lock on database. """
-        lock = get_db_lock(schema=self.schema, table=self.table)
+    def index_members(self, keys=None, match_all=False, exclude=None):
+        """
+        Return set of members found in index of ``keys``.
+
+        :param list keys: return members of any of these keys, or all
+                          members when ``None``.
+        :param bool match_all: return only members of all ``keys``, their
+                               intersection, rather than their union.
+        :param list exclude: omit members of any of these keys.
+        :rtype: set
+        """
+        return self.proxy_method('index_members', keys, match_all, exclude)
+
+    def index_count(self, keys):
+        """ Return number of distinct members found in index of ``keys``. """
+        return self.proxy_method('index_count', keys)
+
+    def index_counts(self, keys=None):
+        """ Return dict of number of members of each key of index. """
+        return self.proxy_method('index_counts', keys)
+
+    def index_search(self, keys, within=None, limit=None, offset=0):
+        """
+        Return members found in index of any ``keys``, ranked.
+
+        :param list keys: keys of index, such as words of a search query.
+        :param list within: only members also found in any of these keys.
+        :param int limit: maximum number of members returned.
+        :param int offset: number of ranked members skipped, for paging.
+        :rtype: list
+        :returns: list of ``(member, number of keys found)``, ranked by
+                  the number of keys found, then by greatest member.
+        """
+        return self.proxy_method('index_search', keys, within, limit, offset)
+
+    def index_keys(self):
+        """ Return list of keys of index having any members. """
+        return self.proxy_method('index_keys')
+
+    def create_index_table(self):
+        """
+        Create index table of this table, moving set values to it.
+
+        See :meth:`x84.db.PooledSqliteDict.create_index_table`.
+        """
+        return self.proxy_method('create_index_table')
+
+    def create_field_table(self):
+        """
+        Create field table of this table, moving dict values to it.
+
+        See :meth:`x84.db.PooledSqliteDict.create_field_table`.
+        """
+        return self.proxy_method('create_field_table')
+
+    def vacuum(self):
+        """ Rebuild database file, releasing free pages to the filesystem. """
+        return self.proxy_method('vacuum')
+
+    def _lock_event(self, key=None):
+        """ Return engine lock event name of this table, or its ``key``. """
+        event = u'lock-db/{0}/{1}'.format(self.schema, self.table)
+        if key is not None:
+            event = u'{0}/{1}'.format(event, _cache_key(key))
+        return event
+
+    def acquire(self, key=None, timeout=None, stale=None):
+        """
+        Acquire system-wide lock on database table, or only ``key``.
+
+        Sessions, and threads of the engine process, acquire the lock from
+        the engine, waiting in turn for any other that holds it.  Locks of
+        the table and of its keys are independent of one another.  Other
+        processes, such as command line tools, acquire a lock local to
+        their process, and must hold :func:`x84.db.lock_datapath`.
+
+        :param key: lock only this key of the table.
+        :param float timeout: maximum seconds to wait, ``None`` waits
+                              indefinitely.
+        :param float stale: acquire the lock anyway, when held by another
+                            session for longer than this many seconds.
+        :rtype: bool
+        :returns: whether the lock was acquired.
+        """
+        if self._tap_db:
+            self.log.debug('lock acquire schema=%s, table=%s, key=%r',
+                           self.schema, self.table, key)
+        if self._session:
+            event = self._lock_event(key)
+            self._session.send_event(event, ('wait', stale))
+            acquired = self._session.read_event(event, timeout) is True
+            if not acquired:
+                # timed out, withdraw request: the reply is False, unless
+                # the lock was granted in the meantime.
+                self._session.send_event(event, ('cancel', None))
+                acquired = self._session.read_event(event)
+            if acquired:
+                LOCKS_HELD[self.schema] += 1
+            return acquired
+
+        if is_engine():
+            from x84.engine import acquire_thread_lock
+            return acquire_thread_lock(self._lock_event(key), timeout, stale)
+
+        lock = get_db_lock(schema=self.schema, table=self.table, key=key)
+        if timeout is None:
+            return lock.acquire()
+        stime = time.time()
+        while not lock.acquire(False):
+            if time.time() - stime >= timeout:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def release(self, key=None):
+        """ Release system-wide lock on database table, or only ``key``. """
         if self._tap_db:
-            self.log.debug('lock release schema=%s, table=%s',
-                           self.schema, self.table)
-        lock.release()
+            self.log.debug('lock release schema=%s, table=%s, key=%r',
+                           self.schema, self.table, key)
+        if self._session:
+            LOCKS_HELD[self.schema] = max(0, LOCKS_HELD[self.schema] - 1)
+            self._session.send_event(self._lock_event(key), ('release', None))
+        elif is_engine():
+            from x84.engine import release_thread_lock
+            release_thread_lock(self._lock_event(key))
+        else:
+            get_db_lock(schema=self.schema, table=self.table,
+                        key=key).release()
+
+    @contextlib.contextmanager
+    def locked(self, key=None, timeout=None):
+        """
+        Context manager holding lock on database table, or only ``key``.
+
+        :raises x84.bbs.exception.DatabaseBusy: lock not acquired within
+                                                ``timeout``.
+        """
+        from x84.bbs.exception import DatabaseBusy
+        if not self.acquire(key=key, timeout=timeout):
+            raise DatabaseBusy('lock {0} not acquired within {1}s'
+                               .format(self._lock_event(key), timeout))
+        try:
+            yield self
+        finally:
+            self.release(key=key)
 
     def __enter__(self):
         self.acquire()
@@ -159,17 +622,17 @@ class DBProxy(object):
         return self.proxy_method('items')
     items.__doc__ = dict.items.__doc__
 
-    def iteritems(self):
-        return self.proxy_iter('iteritems')
-    iteritems.__doc__ = dict.iteritems.__doc__
+    def iteritems(self, **kwargs):
+        return self.proxy_iter('iteritems', **kwargs)
+    iteritems.__doc__ = dict.iteritems.__doc__ + _ITER_KWARGS_DOC
 
-    def iterkeys(self):
-        return self.proxy_iter('iterkeys')
-    iterkeys.__doc__ = dict.iterkeys.__doc__
+    def iterkeys(self, **kwargs):
+        return self.proxy_iter('iterkeys', **kwargs)
+    iterkeys.__doc__ = dict.iterkeys.__doc__ + _ITER_KWARGS_DOC
 
-    def itervalues(self):
-        return self.proxy_iter('itervalues')
-    itervalues.__doc__ = dict.itervalues.__doc__
+    def itervalues(self, **kwargs):
+        return self.proxy_iter('itervalues', **kwargs)
+    itervalues.__doc__ = dict.itervalues.__doc__ + _ITER_KWARGS_DOC
 
     def keys(self):
         return self.proxy_method('keys')
@@ -188,3 +651,135 @@ class DBProxy(object):
         # @jquast: should sqlitedict have a .copy() method? "no."
         return dict(self.proxy_method('items'))
     copy.__doc__ = dict.copy.__doc__
+
+
+class DBTransaction(object):
+
+    """
+    Collect database operations, executed as a single transaction.
+
+    Returned by :meth:`DBProxy.transaction`, operations are recorded
+    and executed atomically on exit of the context manager, without
+    exception, in a single IPC request. Their return values are then
+    available as attribute ``results``, in order::
+
+        with DBProxy(USERDB).transaction() as txn:
+            txn[handle] = user
+            txn.table('attrs').field_set(handle, 'location', location)
+
+    As the return values are not available until exit, read-modify-write
+    operations should use the atomic methods, such as :meth:`set_add` or
+    :meth:`dict_set`.
+    """
+
+    def __init__(self, proxy, table=None, operations=None):
+        """ Class initializer. """
+        self.proxy = proxy
+        self._table = table or proxy.table
+        self.operations = operations if operations is not None else []
+        self.results = None
+
+    def table(self, table):
+        """ Return a view of this transaction, operating on ``table``. """
+        return DBTransaction(self.proxy, table, self.operations)
+
+    def _record(self, method, *args):
+        """ Record operation ``method`` with ``args``. """
+        self.operations.append((self._table, method, args))
+
+    def execute(self):
+        """ Execute operations recorded, returning their results. """
+        self.results = []
+        if self.operations:
+            self.results = self.proxy.execute_transaction(self.operations)
+        del self.operations[:]
+        return self.results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if exc_type is None:
+            self.execute()
+
+    # pylint: disable=C0111
+    #        Missing docstring
+    def __setitem__(self, key, value):
+        self._record('__setitem__', key, value)
+    __setitem__.__doc__ = dict.__setitem__.__doc__
+
+    def __delitem__(self, key):
+        self._record('__delitem__', key)
+    __delitem__.__doc__ = dict.__delitem__.__doc__
+
+    def get(self, key, default=None):
+        self._record('get', key, default)
+    get.__doc__ = dict.get.__doc__
+
+    def has_key(self, key):
+        self._record('has_key', key)
+    has_key.__doc__ = dict.has_key.__doc__
+
+    def setdefault(self, key, value):
+        self._record('setdefault', key, value)
+    setdefault.__doc__ = dict.setdefault.__doc__
+
+    def update(self, *args):
+        self._record('update', *args)
+    update.__doc__ = dict.update.__doc__
+
+    def set_add(self, key, member):
+        self._record('set_add', key, member)
+    set_add.__doc__ = DBProxy.set_add.__doc__
+
+    def set_discard(self, key, member):
+        self._record('set_discard', key, member)
+    set_discard.__doc__ = DBProxy.set_discard.__doc__
+
+    def set_membership(self, member, keys):
+        self._record('set_membership', member, keys)
+    set_membership.__doc__ = DBProxy.set_membership.__doc__
+
+    def call_method(self, key, method, args=(), default=None):
+        self._record('call_method', key, method, args, default)
+    call_method.__doc__ = DBProxy.call_method.__doc__
+
+    def dict_set(self, key, subkey, value):
+        self._record('dict_set', key, subkey, value)
+    dict_set.__doc__ = DBProxy.dict_set.__doc__
+
+    def dict_del(self, key, subkey):
+        self._record('dict_del', key, subkey)
+    dict_del.__doc__ = DBProxy.dict_del.__doc__
+
+    def field_set(self, key, field, value):
+        self._record('field_set', key, field, value)
+    field_set.__doc__ = DBProxy.field_set.__doc__
+
+    def field_del(self, key, field):
+        self._record('field_del', key, field)
+    field_del.__doc__ = DBProxy.field_del.__doc__
+
+    def index_add(self, key, member):
+        self._record('index_add', key, member)
+    index_add.__doc__ = DBProxy.index_add.__doc__
+
+    def index_discard(self, key, member):
+        self._record('index_discard', key, member)
+    index_discard.__doc__ = DBProxy.index_discard.__doc__
+
+    def index_membership(self, member, keys):
+        self._record('index_membership', member, keys)
+    index_membership.__doc__ = DBProxy.index_membership.__doc__
+
+    def index_update(self, key, members):
+        self._record('index_update', key, members)
+    index_update.__doc__ = DBProxy.index_update.__doc__
+
+    def index_difference_update(self, key, members, prefix=False):
+        self._record('index_difference_update', key, members, prefix)
+    index_difference_update.__doc__ = DBProxy.index_difference_update.__doc__
+
+    def index_clear(self, key):
+        self._record('index_clear', key)
+    index_clear.__doc__ = DBProxy.index_clear.__doc__
@@ -11,6 +11,13 @@ class Disconnected(Exception):
     pass
 
 
+class DatabaseBusy(Exception):
+
+    """ Thrown when a database command is rejected by a full queue. """
+
+    pass
+
+
 class Goto(Exception):
 
     """ Thrown to change script without returning. """
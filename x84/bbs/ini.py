@@ -148,6 +148,11 @@ def init_bbs_ini():
     cfg_bbs.set('system', 'pass_ucase', 'no')
     # default encoding for the showart function on UTF-8 capable terminals
     cfg_bbs.set('system', 'art_utf8_codec', 'cp437')
+    # database commands are executed by a pool of threads
+    cfg_bbs.set('system', 'db_workers', '4')
+    cfg_bbs.set('system', 'db_queue_size', '1024')
+    # database values of at least this many bytes are compressed
+    cfg_bbs.set('system', 'db_compress_threshold', '512')
 
     cfg_bbs.add_section('telnet')
     cfg_bbs.set('telnet', 'enabled', 'yes')
@@ -167,6 +172,10 @@ def init_bbs_ini():
     cfg_bbs.set('ssh', 'hostkey', os.path.expanduser(
         os.path.join('~', '.x84', 'ssh_host_rsa_key')))
     cfg_bbs.set('ssh', 'hostkeybits', '2048')
+    cfg_bbs.set('ssh', 'auth_workers', '2')
+    cfg_bbs.set('ssh', 'auth_per_ip', '2')
+    cfg_bbs.set('ssh', 'auth_queue_size', '32')
+    cfg_bbs.set('ssh', 'auth_timeout', '10')
 
     cfg_bbs.add_section('sftp')
     cfg_bbs.set('sftp', 'enabled', 'no')
@@ -219,6 +228,13 @@ def init_bbs_ini():
     cfg_bbs.set('session', 'tap_events', 'no')
     cfg_bbs.set('session', 'tap_db', 'no')
     cfg_bbs.set('session', 'default_encoding', 'utf8')
+    cfg_bbs.set('session', 'output_buffer_size', '8192')
+    cfg_bbs.set('session', 'output_flush_delay', '0.01')
+    cfg_bbs.set('session', 'encode_output', 'yes')
+    cfg_bbs.set('session', 'db_cache_size', '512')
+    cfg_bbs.set('session', 'db_cache_bytes', '4194304')
+    cfg_bbs.set('session', 'db_batch_size', '256')
+    cfg_bbs.set('session', 'user_flush_interval', '30')
 
     cfg_bbs.add_section('irc')
     cfg_bbs.set('irc', 'server', 'efnet.portlane.se')
@@ -256,6 +272,14 @@ def init_bbs_ini():
     # those of the groups specified may.
     cfg_bbs.set('msg', 'moderated_tags', 'no')
     cfg_bbs.set('msg', 'tag_moderators', 'sysop, moderator')
+    # message base maintenance: messages of tags given a retention policy
+    # of 'tag:days' are archived and deleted, for example,
+    # 'x84net:90, public:365'.  Maintenance is performed by the engine
+    # at intervals of seconds given, such as '86400' (daily), when non-zero.
+    cfg_bbs.set('msg', 'maintenance_interval', '0')
+    cfg_bbs.set('msg', 'retention', '')
+    cfg_bbs.set('msg', 'archive_path', os.path.join(
+        cfg_bbs.get('system', 'datapath'), 'archive'))
 
     return cfg_bbs
 
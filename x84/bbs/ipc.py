@@ -1,9 +1,19 @@
 """ Session IPC package for x/84. """
 # std imports
+from telnetlib import IAC
+import threading
 import logging
+import time
 
 # local
 from x84.bbs.session import getsession
+from x84.bbs.ini import get_ini
+
+#: Leading byte of raw, pre-encoded output frames sent using
+#: ``Connection.send_bytes()``.  A pickled ``(event, data)`` tuple
+#: never begins with a NUL byte, so that the engine may distinguish
+#: raw output from pickled events as it receives them.
+OUTPUT_BYTES = b'\x00'
 
 
 def make_root_logger(out_queue):
@@ -63,15 +73,58 @@ class IPCStream(object):
     is polled for output in x84.engine.  Only the ``write()`` method of
     this "stream" and ``is_a_tty`` attribute is called or evaluated by
     blessed.Terminal.  The attribute ``is_a_tty`` is mocked as ``True``.
+
+    Output is buffered and coalesced into a single ``output`` event, sent
+    when :meth:`flush` is called (as it is by the session before reading
+    any events), when ``buffer_size`` characters are buffered, or after
+    ``flush_delay`` seconds have elapsed since the first buffered write.
+
+    This stream also stands in for the ``writer`` queue itself: all other
+    events must be sent using :meth:`send`, so that any buffered output is
+    sent before them, and so that they are not interleaved with output
+    sent by the flushing thread.
+
+    Output is encoded by the session process, and IAC bytes escaped when
+    ``escape_iac`` is set (telnet), sent as a raw :data:`OUTPUT_BYTES`
+    frame, so that the engine only copies bytes to the client socket.
+    When ``[session] encode_output`` is disabled, output is instead sent
+    as an ``output`` event of ``(unicode, encoding)``, to be encoded by
+    the engine.
     """
 
-    def __init__(self, writer):
+    #: default number of characters buffered before output is sent.
+    BUFFER_SIZE = 8192
+
+    #: default maximum seconds that output remains buffered.
+    FLUSH_DELAY = 0.01
+
+    def __init__(self, writer, buffer_size=None, flush_delay=None,
+                 escape_iac=False):
         self.writer = writer
         self.is_a_tty = True
+        self.escape_iac = escape_iac
+        self.encode_output = (
+            not get_ini('session', 'encode_output') or
+            get_ini('session', 'encode_output', getter='getboolean'))
+        self.buffer_size = (
+            buffer_size or
+            get_ini('session', 'output_buffer_size', getter='getint') or
+            self.BUFFER_SIZE)
+        self.flush_delay = (
+            flush_delay or
+            get_ini('session', 'output_flush_delay', getter='getfloat') or
+            self.FLUSH_DELAY)
+        self._buffer = []
+        self._buffer_len = 0
+        self._encoding = None
+        self._deadline = None
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._flusher = None
 
     def write(self, ucs, encoding='ascii'):
         """
-        Sends unicode text to Pipe.
+        Buffer unicode text for sending to Pipe.
 
         Default encoding is 'ascii', which is unset only when used
         with blessings, which rarely writes directly to the stream
@@ -84,7 +137,70 @@ class IPCStream(object):
         # function (lambda) as an attribute -- which would fail:
         # PicklingError: Can't pickle <type 'function'>: attribute
         #                lookup __builtin__.function failed
-        self.writer.send(('output', (unicode(ucs), encoding)))
+        ucs = unicode(ucs)
+        with self._lock:
+            if self._buffer and encoding != self._encoding:
+                # output of differing encodings are sent as separate events.
+                self._flush()
+            if not self._buffer:
+                self._encoding = encoding
+                self._deadline = time.time() + self.flush_delay
+                self._start_flusher()
+                self._cond.notify()
+            self._buffer.append(ucs)
+            self._buffer_len += len(ucs)
+            if self._buffer_len >= self.buffer_size:
+                self._flush()
 
     def flush(self):
-        pass
+        """ Send any buffered output to Pipe. """
+        with self._lock:
+            self._flush()
+
+    def send(self, obj):
+        """ Send any buffered output, followed by ``obj``, to Pipe. """
+        with self._lock:
+            self._flush()
+            self.writer.send(obj)
+
+    def _flush(self):
+        """ Send buffered output, caller must hold ``_lock``. """
+        if self._buffer:
+            ucs, encoding = u''.join(self._buffer), self._encoding
+            self._buffer, self._buffer_len = [], 0
+            self._deadline = None
+            if not self.encode_output:
+                self.writer.send(('output', (ucs, encoding)))
+                return
+            data = ucs.encode(encoding, 'replace')
+            if self.escape_iac:
+                # Must be escaped 255 (IAC + IAC) to avoid IAC interpretation.
+                data = data.replace(IAC, 2 * IAC)
+            self.writer.send_bytes(OUTPUT_BYTES + data)
+
+    def _start_flusher(self):
+        """ Start thread that sends output after deadline, if not running. """
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._run_flusher,
+                                             name='ipc-flusher')
+            self._flusher.daemon = True
+            self._flusher.start()
+
+    def _run_flusher(self):
+        """ Send buffered output as its deadline elapses. """
+        with self._lock:
+            while True:
+                if self._deadline is None:
+                    self._cond.wait()
+                    continue
+                remaining = self._deadline - time.time()
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+                try:
+                    self._flush()
+                except (IOError, EOFError):
+                    # the engine has closed our pipe, the session will
+                    # discover so on its own next send or read.
+                    self._buffer, self._buffer_len = [], 0
+                    self._deadline = None
@@ -1,7 +1,12 @@
 """ Messaging database package for x/84. """
 # std imports
 import datetime
+import bisect
+import array
+import fnmatch
+import itertools
 import logging
+import re
 
 # local
 from x84.bbs.dbproxy import DBProxy
@@ -14,6 +19,9 @@ import dateutil.tz
 MSGDB = 'msgbase'
 TAGDB = 'tags'
 PRIVDB = 'privmsg'
+UNREADDB = 'unread'
+SEARCHDB = 'msgsearch'
+THREADDB = 'msgthread'
 
 # TODO(jquast, maze): Use modeling to construct rfc-compliant mail messaging
 # formats.  It would be possible to use standard mbox-formatted mail boxes,
@@ -56,14 +64,50 @@ def get_msg(idx=0):
     return DBProxy(MSGDB)['%d' % int(idx)]
 
 
-def list_msgs(tags=None):
-    """ Return set of indices matching ``tags``, or all by default. """
+def get_msg_headers(indices):
+    """
+    Return list of headers of messages by ``indices``, in bulk.
+
+    Headers are dictionaries of :attr:`Msg.header`, without the message
+    body, for list views.  Any messages not found are omitted.
+
+    :rtype: list
+    """
+    keys = ['%d' % int(idx) for idx in indices]
+    db_header = DBProxy(MSGDB, table='headers')
+    headers = db_header.get_many(keys)
+    missing = [key for key in keys if key not in headers]
+    if missing:
+        # messages saved before headers were stored separately.
+        db_msg = DBProxy(MSGDB)
+        for key, msg in db_msg.get_many(missing).items():
+            headers[key] = msg.header
+        db_header.update([(key, headers[key]) for key in missing
+                          if key in headers])
+    return [headers[key] for key in keys if key in headers]
+
+
+def get_msg_header(idx):
+    """ Return header of message by index ``idx``, raises KeyError. """
+    headers = get_msg_headers([idx])
+    if not headers:
+        raise KeyError(idx)
+    return headers[0]
+
+
+def list_msgs(tags=None, match_all=False, exclude=None):
+    """
+    Return set of indices matching ``tags``, or all by default.
+
+    :param list tags: messages tagged by any of ``tags``.
+    :param bool match_all: only messages tagged by all ``tags``.
+    :param list exclude: omit messages tagged by any of ``exclude``.
+    :rtype: set
+    """
     if tags is not None and 0 != len(tags):
-        msgs = set()
-        db_tag = DBProxy(TAGDB)
-        for tag in (_tag for _tag in tags if _tag in db_tag):
-            msgs.update(db_tag[tag])
-        return msgs
+        return DBProxy(TAGDB).index_members(tags, match_all, exclude)
+    if exclude:
+        return DBProxy(TAGDB).index_members(exclude=exclude)
     return set(int(key) for key in DBProxy(MSGDB).keys())
 
 
@@ -78,7 +122,557 @@ def list_privmsgs(handle=None):
 
 def list_tags():
     """ Return set of available tags. """
-    return [_tag.decode('utf8') for _tag in DBProxy(TAGDB).keys()]
+    return DBProxy(TAGDB).index_keys()
+
+
+def count_tags(tags=None):
+    """ Return dict of number of messages of each tag, or ``tags``. """
+    return DBProxy(TAGDB).index_counts(tags)
+
+
+def _thread_key(idx):
+    """ Return component of thread index key of message ``idx``. """
+    return u'%010d' % (int(idx),)
+
+
+def get_thread_header(header, path):
+    """ Return thread index header of message ``header`` by ``path``. """
+    return dict(header,
+                root=int(path.split(u'/', 1)[0]),
+                depth=path.count(u'/'))
+
+
+def build_thread_index(batch_size=100, rebuild=False):
+    """
+    Build thread index of all messages, as they are saved thereafter.
+
+    The thread index, and the index of replies to each message, are built
+    once, by :func:`x84.dbinit.init_databases`, before any session reads
+    them.
+
+    :param bool rebuild: build the index even when already built, such
+                         as after messages are imported.
+    """
+    if not rebuild and DBProxy(THREADDB, table='meta').get('indexed'):
+        return
+    # first, ancestry of all messages by their parent, only their parent
+    # is held in memory, headers are read by one page at a time.
+    parents = dict((msg.idx, msg.parent)
+                   for msg in DBProxy(MSGDB).itervalues())
+
+    def get_path(idx):
+        ancestry, parent = [idx], parents.get(idx)
+        # walk to root, ignoring any parent of unknown messages or
+        # circular reference.
+        while parent in parents and parent not in ancestry:
+            ancestry.append(parent)
+            parent = parents.get(parent)
+        return u'/'.join(_thread_key(_idx) for _idx in reversed(ancestry))
+
+    db_thread = DBProxy(THREADDB)
+    db_position = DBProxy(THREADDB, table='position')
+    indices = sorted(parents)
+    for pos in range(0, len(indices), batch_size):
+        # index messages by transactions of one page of messages.
+        page = indices[pos:pos + batch_size]
+        prev_paths = db_position.get_many([_thread_key(idx) for idx in page])
+        with db_thread.transaction() as txn:
+            for header in get_msg_headers(page):
+                key, path = _thread_key(header['idx']), get_path(header['idx'])
+                if prev_paths.get(key) not in (None, path):
+                    del txn[prev_paths[key]]
+                txn[path] = get_thread_header(header, path)
+                txn.table('position')[key] = path
+                parent = parents.get(header['idx'])
+                txn.table('children').index_membership(
+                    header['idx'],
+                    [_thread_key(parent)] if parent in parents else ())
+    DBProxy(THREADDB, table='meta')['indexed'] = True
+
+
+def get_thread(idx):
+    """
+    Return headers of all messages of thread of message ``idx``.
+
+    Headers are dictionaries of keys ``idx``, ``parent``, ``root``,
+    ``depth``, ``author``, ``recipient``, ``subject``, ``stime``, and
+    ``tags``, ordered by depth-first traversal of replies, beginning
+    with the root message of the thread.
+
+    :rtype: list
+    """
+    if not DBProxy(THREADDB, table='meta').get('indexed'):
+        # not yet built, see build_thread_index.
+        return []
+    path = DBProxy(THREADDB, table='position').get(_thread_key(idx))
+    if path is None:
+        return []
+    root = path.split(u'/', 1)[0]
+    # keys of the thread are its root, and the root followed by '/', and
+    # sort in order of depth-first traversal.
+    return [header for _key, header in
+            DBProxy(THREADDB).items_range(root, root + u'0')]
+
+
+def get_children(idx):
+    """ Return set of indices of messages replying to message ``idx``. """
+    return DBProxy(THREADDB, table='children').index_members(
+        [_thread_key(idx)])
+
+
+def discard_thread(idx):
+    """ Remove message ``idx`` from thread index. """
+    db_position = DBProxy(THREADDB, table='position')
+    path = db_position.get(_thread_key(idx))
+    if path is not None:
+        with DBProxy(THREADDB).transaction() as txn:
+            del txn[path]
+            del txn.table('position')[_thread_key(idx)]
+
+
+def tokenize(text):
+    """ Return set of lowercase words of ``text``, as indexed for search. """
+    return set(word for word in re.findall(r'\w+', text.lower(), re.UNICODE)
+               if 1 < len(word) <= 64)
+
+
+def get_search_keys(msg):
+    """
+    Return set of search index keys of message ``msg``.
+
+    These are the words of its subject and body, and ``from:author``,
+    ``to:recipient``, and ``tag:name`` of each tag.
+    """
+    keys = tokenize(u' '.join((msg.subject or u'', msg.body or u'')))
+    for prefix, values in ((u'from', [msg.author]),
+                           (u'to', [msg.recipient]),
+                           (u'tag', msg.tags)):
+        keys.update(u'{0}:{1}'.format(prefix, value.lower())
+                    for value in values if value)
+    return keys
+
+
+def build_search_index():
+    """
+    Build search index of all messages, as they are saved thereafter.
+
+    It is built once, by :func:`x84.dbinit.init_databases`, before any
+    session searches it.
+    """
+    if DBProxy(SEARCHDB, table='meta').get('indexed'):
+        return
+    db_search = DBProxy(SEARCHDB)
+    msgs = DBProxy(MSGDB).itervalues()
+    while True:
+        # index messages by transactions of one hundred messages.
+        batch = list(itertools.islice(msgs, 100))
+        if not batch:
+            break
+        with db_search.transaction() as txn:
+            for msg in batch:
+                txn.index_membership(msg.idx, get_search_keys(msg))
+    DBProxy(SEARCHDB, table='meta')['indexed'] = True
+
+
+def search(query, handle=None, limit=None, offset=0):
+    """
+    Return list of message indices matching search ``query``, ranked.
+
+    Messages are ranked by the number of words of ``query`` they
+    contain, then by most recent.  Words of the form ``from:handle``,
+    ``to:handle``, and ``tag:name`` match messages by author, recipient,
+    and tag.
+
+    :param unicode query: words to search for.
+    :param unicode handle: also match private messages of this user,
+                           otherwise only public messages are matched.
+    :param int limit: maximum number of message indices returned.
+    :param int offset: number of ranked messages skipped, for paging.
+    :rtype: list
+    """
+    if not DBProxy(SEARCHDB, table='meta').get('indexed'):
+        # not yet built, see build_search_index.
+        return []
+    keys = set()
+    for word in query.split():
+        prefix, _, value = word.lower().partition(u':')
+        if value and prefix in (u'from', u'to', u'tag'):
+            keys.add(word.lower())
+        else:
+            keys.update(tokenize(word))
+    within = [u'tag:public']
+    if handle:
+        within.extend((u'from:{0}'.format(handle.lower()),
+                       u'to:{0}'.format(handle.lower())))
+    return [idx for idx, _rank in DBProxy(SEARCHDB).index_search(
+        keys, within, limit, offset)]
+
+
+def discard_search(idx):
+    """ Remove message ``idx`` from search index. """
+    DBProxy(SEARCHDB).index_membership(idx, ())
+
+
+class ReadMarks(object):
+
+    """
+    A compact set of message indices read by a user.
+
+    All indices less than ``low`` are read, and any others are held as
+    sorted, non-adjacent ranges of ``[start, stop)``, flattened to an
+    array of their bounds.  As messages are mostly read in order, the
+    ranges are few, and marking the next message read only extends the
+    ``low`` mark, or the last range.
+
+    It supports the set operations used of the previous ``readmsgs``
+    user attribute, a set of every index read: ``idx in marks``, ``marks
+    | indices``, and ``indices - marks``.
+    """
+
+    def __init__(self, indices=()):
+        """ Class initializer. """
+        self.low = 0
+        self.bounds = array.array('l')
+        self.update(indices)
+
+    def __contains__(self, idx):
+        return (idx < self.low or
+                bisect.bisect_right(self.bounds, idx) % 2 == 1)
+
+    def __iter__(self):
+        idx = 0
+        while idx < self.low:
+            yield idx
+            idx += 1
+        for pos in range(0, len(self.bounds), 2):
+            idx = self.bounds[pos]
+            while idx < self.bounds[pos + 1]:
+                yield idx
+                idx += 1
+
+    def __len__(self):
+        return self.low + sum(self.bounds[pos + 1] - self.bounds[pos]
+                              for pos in range(0, len(self.bounds), 2))
+
+    def __or__(self, indices):
+        marks = ReadMarks()
+        marks.low, marks.bounds = self.low, array.array('l', self.bounds)
+        marks.update(indices)
+        return marks
+    __ror__ = __or__
+
+    def __rsub__(self, indices):
+        return set(idx for idx in indices if idx not in self)
+
+    def __repr__(self):
+        return '{0}(low={1}, bounds={2})'.format(
+            self.__class__.__name__, self.low, self.bounds.tolist())
+
+    def add(self, idx):
+        """ Mark message ``idx`` as read. """
+        idx = int(idx)
+        if idx in self:
+            return
+        bounds = self.bounds
+        if idx == self.low:
+            self.low += 1
+            if bounds and bounds[0] == self.low:
+                # join with first range
+                self.low = bounds[1]
+                del bounds[0:2]
+            return
+        pos = bisect.bisect_right(bounds, idx)
+        join_prev = pos > 0 and bounds[pos - 1] == idx
+        join_next = pos < len(bounds) and bounds[pos] == idx + 1
+        if join_prev and join_next:
+            del bounds[pos - 1:pos + 1]
+        elif join_prev:
+            bounds[pos - 1] = idx + 1
+        elif join_next:
+            bounds[pos] = idx
+        else:
+            bounds[pos:pos] = array.array('l', (idx, idx + 1))
+
+    def update(self, indices):
+        """ Mark all message ``indices`` as read. """
+        for idx in sorted(indices):
+            self.add(idx)
+
+
+def _unread_key(handle, tag_pattern=u''):
+    """ Return key of unread index by user ``handle`` and ``tag_pattern``. """
+    # private messages are indexed by an empty tag pattern.
+    return u'\t'.join((handle, tag_pattern))
+
+
+def _pattern_key(tag_pattern):
+    """ Return key of index of public messages matching ``tag_pattern``. """
+    # indexed as the unread messages of no user.
+    return _unread_key(u'', tag_pattern)
+
+
+def _list_pattern_msgs(tag_pattern, all_tags, public):
+    """ Return set of indices of ``public`` messages of ``tag_pattern``. """
+    tag_matches = fnmatch.filter(all_tags, tag_pattern)
+    return (list_msgs(tags=tag_matches) & public) if tag_matches else set()
+
+
+def _decode_handle(handle):
+    """ Return ``handle`` as unicode, as returned by sqlite as bytes. """
+    if isinstance(handle, bytes):
+        return handle.decode('utf8')
+    return handle
+
+
+def build_subscriber_index():
+    """
+    Build index of users subscribed to each tag pattern, and its messages.
+
+    Thereafter, the index is maintained by :func:`set_subscription`, so
+    that a message saved is indexed as unread only for the users of tag
+    patterns matching its tags, and public messages of each tag pattern
+    subscribed are counted by :func:`count_subscribed`.  It is built
+    once, by :func:`x84.dbinit.init_databases`, before any session reads
+    it.
+    """
+    if is_subscriber_indexed():
+        return
+    subscriptions = DBProxy(UNREADDB, table='subscription').items()
+    all_tags = list_tags()
+    public = list_msgs(tags=(u'public',))
+    with DBProxy(UNREADDB).transaction() as txn:
+        for tag_pattern in set(tag_pattern for _, subscription
+                               in subscriptions
+                               for tag_pattern in subscription):
+            txn.index_clear(_pattern_key(tag_pattern))
+            txn.index_update(_pattern_key(tag_pattern), _list_pattern_msgs(
+                tag_pattern, all_tags, public))
+        for handle, subscription in subscriptions:
+            for tag_pattern in subscription:
+                txn.table('subscribers').index_add(
+                    tag_pattern, _decode_handle(handle))
+        txn.table('meta')['subscribers'] = True
+
+
+def is_subscriber_indexed():
+    """ Whether the index of :func:`build_subscriber_index` is built. """
+    return bool(DBProxy(UNREADDB, table='meta').get('subscribers'))
+
+
+def _scan_subscribed(subscription):
+    """ Return dict of indices of public messages of each tag pattern. """
+    all_tags, public = list_tags(), list_msgs(tags=(u'public',))
+    return dict((tag_pattern, _list_pattern_msgs(tag_pattern, all_tags,
+                                                 public))
+                for tag_pattern in subscription)
+
+
+def get_subscription(handle):
+    """ Return list of tag patterns of unread index of ``handle``, or None. """
+    return DBProxy(UNREADDB, table='subscription').get(handle)
+
+
+def set_subscription(handle, subscription, read=None):
+    """
+    Build unread index of user ``handle`` for tag patterns ``subscription``.
+
+    Thereafter, the index is maintained as messages are saved, read,
+    and deleted, so that new messages may be counted without scanning
+    the message base.
+
+    :param list subscription: tag patterns, such as ``[u'public']``.
+    :param ReadMarks read: messages already read by the user, by default,
+                           as returned by :func:`get_readmarks`.
+    """
+    read = read if read is not None else get_readmarks(handle)
+    all_tags = list_tags()
+    public = list_msgs(tags=(u'public',))
+    db_unread = DBProxy(UNREADDB)
+    with db_unread.transaction() as txn:
+        for tag_pattern in get_subscription(handle) or ():
+            txn.index_clear(_unread_key(handle, tag_pattern))
+            txn.table('subscribers').index_discard(tag_pattern, handle)
+        for tag_pattern in subscription:
+            msgs = _list_pattern_msgs(tag_pattern, all_tags, public)
+            txn.index_clear(_unread_key(handle, tag_pattern))
+            txn.index_update(_unread_key(handle, tag_pattern), msgs - read)
+            txn.index_clear(_pattern_key(tag_pattern))
+            txn.index_update(_pattern_key(tag_pattern), msgs)
+            txn.table('subscribers').index_add(tag_pattern, handle)
+        txn.index_clear(_unread_key(handle))
+        txn.index_update(_unread_key(handle),
+                         list_privmsgs(handle) - read)
+        txn.table('subscription')[handle] = list(subscription)
+
+
+def index_unread_msgs(msgs):
+    """
+    Add new messages ``msgs`` to the unread index of users, in bulk.
+
+    As :meth:`Msg.index_unread` of each message, but of a single
+    transaction, such as for messages imported by :mod:`x84.msgbulk`.
+    """
+    subscriptions = dict(
+        (_decode_handle(handle), subscription) for handle, subscription
+        in DBProxy(UNREADDB, table='subscription').items())
+    unread = dict()
+    for msg in msgs:
+        if u'public' not in msg.tags:
+            if (msg.recipient in subscriptions and
+                    msg.recipient != msg.author):
+                unread.setdefault(_unread_key(msg.recipient),
+                                  set()).add(msg.idx)
+            continue
+        for handle, subscription in subscriptions.items():
+            for tag_pattern in subscription:
+                if fnmatch.filter(msg.tags, tag_pattern):
+                    unread.setdefault(_pattern_key(tag_pattern),
+                                      set()).add(msg.idx)
+                    if handle != msg.author:
+                        unread.setdefault(_unread_key(handle, tag_pattern),
+                                          set()).add(msg.idx)
+    with DBProxy(UNREADDB).transaction() as txn:
+        for key, members in unread.items():
+            txn.index_update(key, members)
+
+
+def list_unread(handle, subscription):
+    """ Return set of unread indices of ``handle`` by ``subscription``. """
+    return DBProxy(UNREADDB).index_members(
+        [_unread_key(handle, tag_pattern)
+         for tag_pattern in list(subscription) + [u'']])
+
+
+def count_unread(handle, subscription):
+    """
+    Return dict of number of unread messages of each tag pattern.
+
+    The number of unread private messages is keyed by ``u''``.
+    """
+    counts = DBProxy(UNREADDB).index_counts(
+        [_unread_key(handle, tag_pattern)
+         for tag_pattern in list(subscription) + [u'']])
+    return dict((tag_pattern, counts.get(_unread_key(handle, tag_pattern), 0))
+                for tag_pattern in list(subscription) + [u''])
+
+
+def list_subscribed(subscription):
+    """ Return set of indices of public messages by ``subscription``. """
+    if not is_subscriber_indexed():
+        # not yet built, the message base is scanned.
+        return set().union(*_scan_subscribed(subscription).values())
+    return DBProxy(UNREADDB).index_members(
+        [_pattern_key(tag_pattern) for tag_pattern in subscription])
+
+
+def count_subscribed(subscription):
+    """
+    Return dict of number of public messages of each tag pattern.
+
+    The number of messages of any tag pattern, each counted only once,
+    is keyed by ``None``.
+    """
+    if not is_subscriber_indexed():
+        # not yet built, the message base is scanned.
+        msgs = _scan_subscribed(subscription)
+        result = dict((tag_pattern, len(indices))
+                      for tag_pattern, indices in msgs.items())
+        result[None] = len(set().union(*msgs.values()))
+        return result
+    db_unread = DBProxy(UNREADDB)
+    keys = [_pattern_key(tag_pattern) for tag_pattern in subscription]
+    counts = db_unread.index_counts(keys)
+    result = dict((tag_pattern, counts.get(_pattern_key(tag_pattern), 0))
+                  for tag_pattern in subscription)
+    result[None] = db_unread.index_count(keys)
+    return result
+
+
+def get_readmarks(handle):
+    """ Return :class:`ReadMarks` of messages read by user ``handle``. """
+    return DBProxy(UNREADDB, table='readmarks').get(handle) or ReadMarks()
+
+
+def build_readmarks():
+    """
+    Move ``readmsgs`` user attribute of all users to :class:`ReadMarks`.
+
+    The previous representation, a set of every index read, is moved
+    once, by :func:`x84.dbinit.init_databases`.
+    """
+    db_meta = DBProxy(UNREADDB, table='meta')
+    if db_meta.get('readmarks'):
+        return
+    from x84.bbs.userbase import USERDB
+    db_attrs = DBProxy(USERDB, table='attrs')
+    db_marks = DBProxy(UNREADDB, table='readmarks')
+    for handle in DBProxy(USERDB).keys():
+        handle = _decode_handle(handle)
+        readmsgs = db_attrs.field_get(handle, 'readmsgs')
+        if readmsgs is not None:
+            db_marks.call_method(handle, 'update', (readmsgs,), ReadMarks())
+            db_attrs.field_del(handle, 'readmsgs')
+    db_meta['readmarks'] = True
+
+
+def mark_read(handle, indices):
+    """
+    Mark message ``indices`` as read by user ``handle``.
+
+    Read marks are updated, and the messages removed from the unread index
+    of every tag pattern of the user, by a single database transaction.
+    """
+    indices = list(indices)
+    with DBProxy(UNREADDB).transaction() as txn:
+        txn.table('readmarks').call_method(handle, 'update', (indices,),
+                                           ReadMarks())
+        txn.index_difference_update(_unread_key(handle), indices, True)
+
+
+def discard_unread(idx):
+    """ Remove message ``idx`` from unread index of all users. """
+    DBProxy(UNREADDB).index_membership(idx, ())
+
+
+def delete_msg(idx):
+    """
+    Delete message ``idx`` from the message base and all of its indices.
+
+    Replies to the message are not deleted, they become replies to the
+    parent of the message, if any, and are moved in the thread index.
+
+    :raises KeyError: message not found.
+    """
+    key = '%d' % (int(idx),)
+    db_msg = DBProxy(MSGDB)
+    msg = db_msg[key]
+    DBProxy(TAGDB).index_membership(msg.idx, ())
+    if 'public' not in msg.tags and msg.recipient:
+        DBProxy(PRIVDB).set_discard(msg.recipient, msg.idx)
+    discard_unread(msg.idx)
+    discard_search(msg.idx)
+    discard_thread(msg.idx)
+    with db_msg:
+        replies = db_msg.get_many(
+            ['%d' % (child,) for child in get_children(msg.idx)]).values()
+        for reply in replies:
+            reply.parent = msg.parent
+            # pylint: disable=W0212
+            #         Access to a protected member _store of a client class
+            reply._store(db_msg)
+        # replies become those of the parent, whose record is unmodified.
+        with DBProxy(THREADDB, table='children').transaction() as txn:
+            txn.index_clear(_thread_key(msg.idx))
+            txn.index_membership(msg.idx, ())
+            if msg.parent is not None:
+                txn.index_update(_thread_key(msg.parent),
+                                 [reply.idx for reply in replies])
+        with db_msg.transaction() as txn:
+            del txn[key]
+            if key in DBProxy(MSGDB, table='headers'):
+                del txn.table('headers')[key]
+    for reply in replies:
+        reply.index_thread()
 
 
 class Msg(object):
@@ -98,7 +692,8 @@ class Msg(object):
 
     - ``parent`` points to the message this message directly refers to.
 
-    - ``children`` is a set of indices replied by this message.
+    - ``children`` is a set of indices replied by this message, as held
+      by the thread index, see :func:`get_children`.
     """
 
     # pylint: disable=R0902
@@ -133,10 +728,42 @@ class Msg(object):
         self.subject = subject
         self.body = body
         self.tags = set()
-        self.children = set()
         self.parent = None
         self.idx = None
 
+    @property
+    def children(self):
+        """
+        Set of indices of messages replying to this message.
+
+        :rtype: set
+        """
+        if self.idx is None:
+            return set()
+        return get_children(self.idx)
+
+    @property
+    def header(self):
+        """
+        Message header, all but its body and children.
+
+        :rtype: dict
+        """
+        return {'idx': self.idx,
+                'parent': self.parent,
+                'author': self.author,
+                'recipient': self.recipient,
+                'subject': self.subject,
+                'ctime': self.ctime,
+                'stime': self.stime,
+                'tags': list(self.tags)}
+
+    def _store(self, db_msg):
+        """ Store message record, and its header, to ``db_msg``. """
+        with db_msg.transaction() as txn:
+            txn['%d' % (self.idx,)] = self
+            txn.table('headers')['%d' % (self.idx,)] = self.header
+
     def save(self, send_net=True, ctime=None):
         """
         Save message to database, recording 'tags' db.
@@ -150,57 +777,59 @@ class Msg(object):
         new = self.idx is None or self._stime is None
 
         # persist message record to MSGDB
+        prev = None
         with DBProxy(MSGDB, use_session=use_session) as db_msg:
+            if not new:
+                # previous header, to update the unread index of its tags.
+                headers = get_msg_headers([self.idx])
+                prev = headers[0] if headers else None
             if new:
-                self.idx = max(map(int, db_msg.keys()) or [-1]) + 1
+                self.idx = db_msg.next_index()
                 if ctime is not None:
                     self._ctime = self._stime = ctime
                 else:
                     self._stime = datetime.datetime.now()
                 new = True
-            db_msg['%d' % (self.idx,)] = self
+            self._store(db_msg)
 
         # persist message idx to TAGDB
-        with DBProxy(TAGDB, use_session=use_session) as db_tag:
-            for tag in db_tag.keys():
-                msgs = db_tag[tag]
-                if tag in self.tags and self.idx not in msgs:
-                    msgs.add(self.idx)
-                    db_tag[tag] = msgs
-                    log.debug("msg {self.idx} tagged '{tag}'"
-                              .format(self=self, tag=tag))
-                elif tag not in self.tags and self.idx in msgs:
-                    msgs.remove(self.idx)
-                    db_tag[tag] = msgs
-                    log.info("msg {self.idx} removed tag '{tag}'"
-                             .format(self=self, tag=tag))
-            for tag in [_tag for _tag in self.tags if _tag not in db_tag]:
-                db_tag[tag] = set([self.idx])
-
-        # persist message as child to parent;
-        assert self.parent not in self.children, ('circular reference',
-                                                  self.parent, self.children)
-        if self.parent is not None:
-            try:
-                parent_msg = get_msg(self.parent)
-            except KeyError:
-                log.warn('Child message {0}.parent = {1}: '
-                         'parent does not exist!'.format(self.idx, self.parent))
-            else:
-                if self.idx != parent_msg.idx:
-                    parent_msg.children.add(self.idx)
-                    parent_msg.save()
-                else:
-                    log.error('Parent idx same as message idx; stripping')
-                    self.parent = None
-                    with db_msg:
-                        db_msg['%d' % (self.idx)] = self
+        db_tag = DBProxy(TAGDB, use_session=use_session)
+        db_tag.index_membership(self.idx, self.tags)
+        log.debug("msg {self.idx} tagged {tags}"
+                  .format(self=self, tags=', '.join(self.tags)))
+
+        # persist message as child to parent, by index of replies, the
+        # parent record is not modified.
+        assert self.parent is None or self.parent not in self.children, (
+            'circular reference', self.parent, self.children)
+        if self.parent is not None and self.parent == self.idx:
+            log.error('Parent idx same as message idx; stripping')
+            self.parent = None
+            with db_msg:
+                self._store(db_msg)
+        if self.parent is not None or not new:
+            db_children = DBProxy(THREADDB, table='children',
+                                  use_session=use_session)
+            db_children.index_membership(
+                self.idx, [_thread_key(self.parent)]
+                if self.parent is not None else ())
+
+        # persist message header to THREADDB
+        self.index_thread(use_session=use_session)
+
+        # persist message words to SEARCHDB
+        db_search = DBProxy(SEARCHDB, use_session=use_session)
+        db_search.index_membership(self.idx, get_search_keys(self))
 
         # persist message record to PRIVDB
         if 'public' not in self.tags:
-            with DBProxy(PRIVDB, use_session=use_session) as db_priv:
-                db_priv[self.recipient] = (
-                    db_priv.get(self.recipient, set()) | set([self.idx]))
+            db_priv = DBProxy(PRIVDB, use_session=use_session)
+            db_priv.set_add(self.recipient, self.idx)
+
+        # persist message index to UNREADDB of subscribed users
+        if prev is None or (set(prev['tags']), prev['recipient']) != (
+                set(self.tags), self.recipient):
+            self.index_unread(use_session=use_session, prev=prev)
 
         # if either any of 'server_tags' or 'network_tags' are enabled,
         # then queue for potential delivery.
@@ -220,6 +849,104 @@ class Msg(object):
                                       else 'reply'),
                     self=self))
 
+    def index_thread(self, use_session=True):
+        """
+        Add or update message in thread index.
+
+        Messages are keyed by their ``path``, the indices of each ancestor
+        from the root message of the thread, so that the headers of an
+        entire thread are retrieved by a single range of keys.
+        """
+        if not DBProxy(THREADDB, table='meta',
+                       use_session=use_session).get('indexed'):
+            # this message is indexed when the thread index is built.
+            return
+        db_position = DBProxy(THREADDB, table='position',
+                              use_session=use_session)
+        path = _thread_key(self.idx)
+        if self.parent is not None:
+            parent_path = db_position.get(_thread_key(self.parent))
+            if parent_path is not None:
+                path = u'/'.join((parent_path, path))
+        prev_path = db_position.get(_thread_key(self.idx))
+        db_thread = DBProxy(THREADDB, use_session=use_session)
+        descendants = []
+        if prev_path not in (None, path):
+            # replies are keyed by the path of this message, and are moved
+            # with it, such as when its parent has been deleted.
+            descendants = db_thread.items_range(prev_path + u'/',
+                                                prev_path + u'0')
+        with db_thread.transaction() as txn:
+            if prev_path not in (None, path):
+                del txn[prev_path]
+            txn[path] = get_thread_header(self.header, path)
+            txn.table('position')[_thread_key(self.idx)] = path
+            for prev_key, header in descendants:
+                key = path + prev_key[len(prev_path):]
+                del txn[prev_key]
+                txn[key] = get_thread_header(header, key)
+                txn.table('position')[_thread_key(header['idx'])] = key
+
+    def index_unread(self, use_session=True, prev=None):
+        """
+        Add message to unread index of users by their subscription.
+
+        Public messages are indexed for every tag pattern matching its
+        tags, for only the users subscribed to it, private messages for
+        the recipient.  The author of the message has already read it.
+
+        :param dict prev: header of the message as previously saved, if
+            any.  It is then removed from the index of tag patterns no
+            longer matching, and added to those newly matching, for users
+            that have not yet read it.
+        """
+        db_unread = DBProxy(UNREADDB, use_session=use_session)
+        db_subscribers = DBProxy(UNREADDB, table='subscribers',
+                                 use_session=use_session)
+        all_patterns = db_subscribers.index_keys()
+
+        def get_patterns(tags):
+            if u'public' not in tags:
+                return set()
+            return set(tag_pattern for tag_pattern in all_patterns
+                       if fnmatch.filter(tags, tag_pattern))
+
+        def get_recipient(tags, recipient):
+            return recipient if u'public' not in tags else None
+
+        patterns = get_patterns(self.tags)
+        recipient = get_recipient(self.tags, self.recipient)
+        prev_patterns, prev_recipient = set(), None
+        if prev is not None:
+            prev_patterns = get_patterns(prev['tags'])
+            prev_recipient = get_recipient(prev['tags'], prev['recipient'])
+
+        def is_unread(handle):
+            return handle != self.author and (
+                prev is None or self.idx not in get_readmarks(handle))
+
+        with db_unread.transaction() as txn:
+            for tag_pattern in prev_patterns - patterns:
+                txn.index_discard(_pattern_key(tag_pattern), self.idx)
+                for handle in db_subscribers.index_members([tag_pattern]):
+                    txn.index_discard(
+                        _unread_key(_decode_handle(handle), tag_pattern),
+                        self.idx)
+            for tag_pattern in patterns - prev_patterns:
+                txn.index_add(_pattern_key(tag_pattern), self.idx)
+                for handle in db_subscribers.index_members([tag_pattern]):
+                    handle = _decode_handle(handle)
+                    if is_unread(handle):
+                        txn.index_add(_unread_key(handle, tag_pattern),
+                                      self.idx)
+            if recipient != prev_recipient:
+                if prev_recipient is not None:
+                    txn.index_discard(_unread_key(prev_recipient), self.idx)
+                if (recipient is not None and
+                        get_subscription(recipient) is not None and
+                        is_unread(recipient)):
+                    txn.index_add(_unread_key(recipient), self.idx)
+
     def queue_for_network(self):
         """ Queue message for networks, hosting or sending. """
         log = logging.getLogger(__name__)
@@ -93,7 +93,9 @@ class Session(object):
         :param str sid: session identification string
         :param dict env: transport-negotiated environment variables, should
                          contain at least values for TERM and 'encoding'.
-        :param tuple child_pipes: tuple of ``(writer, reader)``.
+        :param tuple child_pipes: tuple of ``(writer, reader)``, where
+                                  ``writer`` is a buffered
+                                  :class:`x84.bbs.ipc.IPCStream`.
         :param str kind: transport description string (ssh, telnet)
         :param str addrport: transport ip address and port as string
         :param tuple matrix_args: When non-None, a tuple of positional
@@ -136,6 +138,8 @@ class Session(object):
         self._connect_time = time.time()
         self._last_input_time = time.time()
         self._node = None
+        self._user_flush_interval = get_ini(
+            'session', 'user_flush_interval', getter='getfloat')
 
         # create event buffer
         self._buffer = dict()
@@ -209,7 +213,14 @@ class Session(object):
 
     @property
     def user(self):
-        """ :class:`User` instance of this session. """
+        """
+        :class:`User` instance of this session.
+
+        The attributes of the user are cached by the session, see
+        :meth:`x84.bbs.userbase.User.cache_attrs`, and written to the
+        database when a script is started, at ``[session]`` option
+        ``user_flush_interval`` when modified, and when the session ends.
+        """
         return self._user or User()
 
     @user.setter
@@ -217,6 +228,10 @@ class Session(object):
         # pylint: disable=C0111
         #         Missing docstring
         self.log.info("user {!r} -> {!r}".format(self._user, value.handle))
+        if self._user is not None:
+            self._user.flush_attrs()
+        if value.handle != u'anonymous':
+            value.cache_attrs()
         self._user = value
 
     @property
@@ -311,16 +326,12 @@ class Session(object):
         of by their full session-id (such as telnet-92.32.10.132:57331)
         one can simply refer to node #1, etc..
         """
-        if self._node is not None:
-            return self._node
-
-        for node in range(1, 65534):
-            event = 'lock-%s/%d' % ('node', node)
-            self.send_event(event, ('acquire', None))
-            data = self.read_event(event)
-            if data is True:
-                self._node = node
-                return self._node
+        if self._node is None:
+            # the lowest node number not in use is allocated by the engine,
+            # released when this session exits.
+            self.send_event('node-allocate', (u'node', None))
+            self._node = self.read_event('node-allocate')
+        return self._node
 
     def __error_recovery(self):
         """ Recover from general exception in script. """
@@ -446,6 +457,10 @@ class Session(object):
 
         - ``gosub``: Allows one session to send another to a different script,
           this is used by the default board ``chat.py`` for a chat request.
+
+        - ``db-invalidate``: Keys written to the database, whose values are
+          discarded from the session-local cache of
+          :class:`x84.bbs.dbproxy.DBProxy`.
         """
         # exceptions aren't buffered; they are thrown!
         if event == 'exception':
@@ -487,6 +502,14 @@ class Session(object):
                 self.buffer_event('refresh', data)
             return True
 
+        # discard session-local database cache of keys written elsewhere
+        if event == 'db-invalidate':
+            from x84.bbs.dbproxy import invalidate_cache
+            invalidate_cache(data)
+            if self._user is not None:
+                self._user.invalidate_attrs(data)
+            return True
+
         # respond to 'info-req' events by returning pickled session info
         if event == 'info-req':
             self.send_event('route', (
@@ -521,6 +544,22 @@ class Session(object):
 
         return False
 
+    def buffer_pending_events(self):
+        """
+        Receive and buffer all events waiting on the IPC pipe.
+
+        Unlike :meth:`read_events`, this never blocks, and returns nothing.
+        Used to receive any ``db-invalidate`` events before returning
+        a value from a session-local cache.
+        """
+        while self.reader.poll():
+            try:
+                event, data = self.reader.recv()
+            except pickle.UnpicklingError as err:
+                self.log.error(err)
+                disconnect(reason='{0}'.format(err))
+            self.buffer_event(event, data)
+
     def buffer_input(self, data, pushback=False):
         """
         Receive keyboard input ,``data``, into ``input`` buffer.
@@ -561,7 +600,9 @@ class Session(object):
 
         - ``logger``: Data is logging record, used by IPCLogHandler.
 
-        - ``output``: Unicode data to write to client.
+        - ``output``: Unicode data to write to client, only when ini option
+          ``[session] encode_output`` is disabled.  Otherwise, output is
+          sent pre-encoded by :class:`x84.bbs.ipc.IPCStream`.
 
         - ``global``: Broadcast event to other sessions.
 
@@ -569,7 +610,8 @@ class Session(object):
 
         - ``db-<schema>``: Request sqlite dict method result.
 
-        - ``db=<schema>``: Request sqlite dict method result as iterable.
+        - ``db=<schema>``: Request a page of an iterable sqlite dict method
+          result, see :meth:`x84.bbs.dbproxy.DBProxy.proxy_pages`.
 
         - ``lock-<name>``: Fine-grained global bbs locking.
 
@@ -615,6 +657,9 @@ class Session(object):
                   and no matching IPC event is discovered, ``(None, None)`` is
                   returned.
         """
+        # send any buffered output before awaiting a reply or keystroke.
+        self.writer.flush()
+
         event, data = self._pop_event_buffer(events)
         if event:
             return (event, data)
@@ -649,6 +694,9 @@ class Session(object):
                     return (event, data)
                 elif timeout == -1:
                     return (None, None)
+                if self._user is not None:
+                    # write user attributes modified, when due, while idle.
+                    self._user.flush_attrs(interval=self._user_flush_interval)
             waitfor = timeleft(stime)
         return (None, None)
 
@@ -673,6 +721,8 @@ class Session(object):
         """
         self.log.info("runscript {0!r}".format(script.name))
         self._script_stack.append(script)
+        if self._user is not None:
+            self._user.flush_attrs()
 
         # if given a script name such as 'extras.target', adjust the lookup
         # path to be extended by {default_scriptdir}/extras, and adjust
@@ -711,8 +761,12 @@ class Session(object):
         return value
 
     def close(self):
-        """ Close session, currently releases ``node`` lock.. """
-        if self._node is not None:
-            self.send_event(
-                event='lock-node/%d' % (self._node),
-                data=('release', None))
+        """ Close session, writes user attributes. """
+        if self._user is not None:
+            try:
+                self._user.flush_attrs()
+            # pylint: disable=W0703
+            #         Catching too general exception
+            except Exception as err:
+                self.log.exception('user attributes not written: {0}'
+                                   .format(err))
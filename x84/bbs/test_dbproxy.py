@@ -0,0 +1,162 @@
+""" Tests of the database proxy of x/84, :mod:`x84.bbs.dbproxy`. """
+# std imports
+import collections
+
+# 3rd party
+import pytest
+
+# local
+from x84 import db
+from x84.bbs import dbproxy
+
+
+class FakeSession(object):
+
+    """ Session executing database commands as the engine would. """
+
+    def __init__(self):
+        self.requests = []
+        self.events = collections.defaultdict(list)
+        self.pending = []
+
+    def send_event(self, event, data):
+        self.requests.append((event, data))
+        if event.startswith('lock-'):
+            if data[0] == 'wait':
+                self.events[event].append(True)
+        elif event.startswith('db'):
+            db.DBHandler(self, event, data).run()
+
+    def send(self, obj):
+        # replies of :class:`x84.db.DBHandler`.
+        event, data = obj
+        if event == 'exception':
+            raise data
+        self.events[event].append(data)
+
+    def read_event(self, event, timeout=None):
+        return self.events[event].pop(0) if self.events[event] else None
+
+    def flush_event(self, event):
+        flushed, self.events[event] = self.events[event], []
+        return flushed
+
+    def buffer_pending_events(self):
+        # ``db-invalidate`` events received from the engine.
+        while self.pending:
+            dbproxy.invalidate_cache(self.pending.pop(0))
+
+    def count(self, method):
+        """ Return number of database requests of ``method``. """
+        return sum(1 for event, data in self.requests
+                   if event.startswith('db') and data[1] == method)
+
+
+@pytest.fixture
+def session(datapath, monkeypatch):
+    """ Session of the current process, with an empty cache. """
+    import x84.bbs.session
+    session = FakeSession()
+    monkeypatch.setattr(x84.bbs.session, 'SESSION', session)
+    monkeypatch.setattr(dbproxy, 'CACHE', collections.OrderedDict())
+    monkeypatch.setattr(dbproxy, 'CACHE_GENERATION', [0])
+    monkeypatch.setattr(dbproxy, 'CACHE_USED', [0])
+    monkeypatch.setattr(dbproxy, 'LOCKS_HELD', collections.defaultdict(int))
+    return session
+
+
+def write_direct(key, value):
+    """ Write ``key`` of table ``unnamed`` as another session would. """
+    dictdb = db.get_database(db.get_db_filepath('test'), 'unnamed')
+    try:
+        dictdb[key] = value
+    finally:
+        dictdb.close()
+
+
+def test_cache_read(session):
+    """ Values read are returned by cache, until invalidated. """
+    proxy = dbproxy.DBProxy('test')
+    write_direct(u'key', 1)
+    assert proxy[u'key'] == 1
+    assert proxy.get(u'key') == 1
+    assert u'key' in proxy
+    assert u'missing' not in proxy
+    assert proxy.get(u'missing', 2) == 2
+    assert session.count('__getitem__') == 2
+
+    # written by another session, the cached value is returned until
+    # its invalidation is received.
+    write_direct(u'key', 3)
+    assert proxy[u'key'] == 1
+    session.pending.append([('test', 'unnamed', u'key')])
+    assert proxy[u'key'] == 3
+    assert session.count('__getitem__') == 3
+
+
+def test_cache_write(session):
+    """ Writes of the session discard its cached values. """
+    proxy = dbproxy.DBProxy('test')
+    proxy[u'key'] = 1
+    assert proxy.keys() == [u'key']
+    assert len(proxy) == 1
+    proxy[u'other'] = 2
+    assert proxy[u'key'] == 1
+    assert sorted(proxy.keys()) == [u'key', u'other']
+    assert len(proxy) == 2
+    assert session.count('keys') == 2
+
+
+def test_cache_locked(session):
+    """ Reads while a lock of the schema is held are not cached. """
+    proxy = dbproxy.DBProxy('test')
+    write_direct(u'key', 1)
+    assert proxy[u'key'] == 1
+    with proxy.locked():
+        write_direct(u'key', 2)
+        assert proxy[u'key'] == 2
+    assert session.count('__getitem__') == 2
+
+
+def test_cache_bytes(session):
+    """ Values greater than a quarter of ``db_cache_bytes`` are not cached. """
+    import x84.bbs.ini
+    x84.bbs.ini.CFG.set('session', 'db_cache_bytes', '4096')
+    proxy = dbproxy.DBProxy('test')
+    write_direct(u'small', u'x')
+    write_direct(u'large', u'x' * 2048)
+    for _ in range(2):
+        assert proxy[u'small'] == u'x'
+        assert proxy[u'large'] == u'x' * 2048
+    assert session.count('__getitem__') == 3
+    assert 0 < dbproxy.CACHE_USED[0] <= 1024
+
+
+def test_iter_pages(session):
+    """ Rows are retrieved in pages, the next requested before yielded. """
+    proxy = dbproxy.DBProxy('test')
+    for num in range(10):
+        write_direct(unicode(num), {'num': num})
+    rows = proxy.iteritems(batch_size=3)
+    assert next(rows) == (u'0', {'num': 0})
+    assert session.count('page') == 2
+    assert [key for key, _ in rows] == [unicode(num) for num in range(1, 10)]
+    assert session.count('page') == 4
+
+    # rows are filtered by key and value.
+    assert list(proxy.itervalues(key_range=(2, 8), batch_size=3,
+                                 where=[('num', '>', 4)])) == [
+                                     {'num': 5}, {'num': 6}, {'num': 7}]
+
+
+def test_iter_abandoned(session):
+    """ The page prefetched by an abandoned iteration is discarded. """
+    proxy = dbproxy.DBProxy('test')
+    for num in range(10):
+        write_direct(unicode(num), num)
+    keys = proxy.iterkeys(batch_size=3)
+    assert next(keys) == u'0'
+    keys.close()
+    assert session.events['db=test'] == []
+    assert list(proxy.iterkeys(batch_size=20)) == [
+        unicode(num) for num in range(10)]
@@ -0,0 +1,87 @@
+""" Tests of session output of x/84, :mod:`x84.bbs.ipc`. """
+# std imports
+import multiprocessing
+import pickle
+import time
+
+# 3rd party
+import pytest
+
+# local
+from x84.bbs.ipc import IPCStream, OUTPUT_BYTES
+
+
+@pytest.fixture
+def pipe(datapath):
+    """ Connections ``(reader, writer)`` of a session's output pipe. """
+    reader, writer = multiprocessing.Pipe(duplex=False)
+    yield reader, writer
+    reader.close()
+    writer.close()
+
+
+def receive(reader):
+    """ Return frames received, raw output as bytes, events unpickled. """
+    frames = []
+    while reader.poll(0.1):
+        frame = reader.recv_bytes()
+        if frame[:1] == OUTPUT_BYTES:
+            frames.append(frame[1:])
+        else:
+            frames.append(pickle.loads(frame))
+    return frames
+
+
+def test_output_framing(pipe):
+    """ Output is coalesced to a single raw frame, sent before events. """
+    reader, writer = pipe
+    stream = IPCStream(writer, flush_delay=5)
+    stream.write(u'hello, ', 'utf8')
+    stream.write(u'w\xf6rld', 'utf8')
+    assert not reader.poll(0.05)
+    stream.send(('event', 1))
+    stream.send(('event', 2))
+    assert receive(reader) == [u'hello, w\xf6rld'.encode('utf8'),
+                               ('event', 1), ('event', 2)]
+
+
+def test_output_encodings(pipe):
+    """ Output of differing encodings is sent as separate frames. """
+    reader, writer = pipe
+    stream = IPCStream(writer, flush_delay=5, escape_iac=True)
+    stream.write(u'\xff', 'latin1')
+    stream.write(u'\xf6', 'utf8')
+    stream.flush()
+    assert receive(reader) == [b'\xff\xff', u'\xf6'.encode('utf8')]
+
+
+def test_output_buffer_size(pipe):
+    """ Output is sent when ``buffer_size`` characters are buffered. """
+    reader, writer = pipe
+    stream = IPCStream(writer, buffer_size=4, flush_delay=5)
+    stream.write(u'abc')
+    assert not reader.poll(0.05)
+    stream.write(u'def')
+    assert receive(reader) == [b'abcdef']
+
+
+def test_output_flush_delay(pipe):
+    """ Output is sent after ``flush_delay`` seconds, without flush. """
+    reader, writer = pipe
+    stream = IPCStream(writer, flush_delay=0.05)
+    stime = time.time()
+    stream.write(u'abc')
+    assert reader.poll(5)
+    assert time.time() - stime >= 0.05
+    assert receive(reader) == [b'abc']
+
+
+def test_output_unencoded(pipe):
+    """ Output is sent as ``output`` events when not encoded. """
+    import x84.bbs.ini
+    x84.bbs.ini.CFG.set('session', 'encode_output', 'no')
+    reader, writer = pipe
+    stream = IPCStream(writer, flush_delay=5)
+    stream.write(u'abc', 'utf8')
+    stream.flush()
+    assert receive(reader) == [('output', (u'abc', 'utf8'))]
@@ -0,0 +1,177 @@
+""" Tests of message base of x/84, :mod:`x84.bbs.msgbase`. """
+# 3rd party
+import pytest
+
+# local
+from x84.dbinit import init_databases
+from x84.bbs.dbproxy import DBProxy
+from x84.bbs.msgbase import (Msg, ReadMarks, UNREADDB, get_msg, get_thread,
+                             delete_msg, search, set_subscription, list_unread,
+                             count_unread, count_subscribed, list_subscribed,
+                             mark_read, get_readmarks)
+
+
+@pytest.fixture
+def msgbase(datapath):
+    """ Message base of the temporary data folder, as the engine begins. """
+    init_databases()
+    return datapath
+
+
+def post(author, tags, subject=u'', body=u'', recipient=None, parent=None):
+    """ Save and return new message. """
+    msg = Msg(recipient=recipient, subject=subject, body=body)
+    msg.author, msg.tags, msg.parent = author, set(tags), parent
+    msg.save(send_net=False)
+    return msg
+
+
+def retag(msg, tags):
+    """ Save message ``msg`` with new ``tags``. """
+    msg.tags = set(tags)
+    msg.save(send_net=False)
+
+
+def test_readmarks():
+    """ Indices read are held as ranges, of set operations. """
+    marks = ReadMarks([0, 1, 2, 5, 6, 9])
+    assert (marks.low, marks.bounds.tolist()) == (3, [5, 7, 9, 10])
+    assert list(marks) == [0, 1, 2, 5, 6, 9] and len(marks) == 6
+    assert 6 in marks and 7 not in marks
+    assert set(range(12)) - marks == set([3, 4, 7, 8, 10, 11])
+
+    union = marks | [3, 4, 8]
+    assert (union.low, union.bounds.tolist()) == (7, [8, 10])
+    assert (marks.low, marks.bounds.tolist()) == (3, [5, 7, 9, 10])
+    marks.update([4, 3])
+    assert (marks.low, marks.bounds.tolist()) == (7, [9, 10])
+
+
+def test_thread(msgbase):
+    """ Threads are ordered by replies, which are relinked on delete. """
+    root = post(u'alice', [u'public'])
+    reply = post(u'bob', [u'public'], parent=root.idx)
+    nested = post(u'alice', [u'public'], parent=reply.idx)
+    other = post(u'carol', [u'public'])
+    assert [(header['idx'], header['depth'])
+            for header in get_thread(nested.idx)] == [
+                (root.idx, 0), (reply.idx, 1), (nested.idx, 2)]
+    assert [header['idx'] for header in get_thread(other.idx)] == [other.idx]
+
+    # the thread index is maintained as messages are saved thereafter.
+    last = post(u'bob', [u'public'], parent=nested.idx)
+    assert [(header['idx'], header['depth'])
+            for header in get_thread(root.idx)][-1] == (last.idx, 3)
+
+    delete_msg(reply.idx)
+    assert get_thread(reply.idx) == []
+    assert [(header['idx'], header['root'], header['depth'])
+            for header in get_thread(last.idx)] == [
+                (root.idx, root.idx, 0), (nested.idx, root.idx, 1),
+                (last.idx, root.idx, 2)]
+    assert get_msg(nested.idx).parent == root.idx
+    assert get_msg(root.idx).children == set([nested.idx])
+
+
+def test_thread_index(datapath):
+    """ Replies saved before the thread index is built are indexed. """
+    root = post(u'alice', [u'public'])
+    reply = post(u'bob', [u'public'], parent=root.idx)
+    assert get_thread(reply.idx) == []
+    init_databases()
+    assert [header['idx'] for header in get_thread(reply.idx)] == [
+        root.idx, reply.idx]
+    assert get_msg(root.idx).children == set([reply.idx])
+
+
+def test_search(msgbase):
+    """ Messages are ranked by words found, private messages excluded. """
+    apples = post(u'alice', [u'public'], subject=u'Apples',
+                  body=u'apples and pears')
+    pears = post(u'bob', [u'public'], subject=u'Pears', body=u'only pears')
+    secret = post(u'alice', [u'bob'], body=u'apples', recipient=u'bob')
+    assert search(u'pears apples') == [apples.idx, pears.idx]
+    assert search(u'from:bob') == [pears.idx]
+    assert search(u'apples') == [apples.idx]
+    assert search(u'apples', handle=u'bob') == [secret.idx, apples.idx]
+    assert search(u'pears', limit=1, offset=1) == [apples.idx]
+
+    delete_msg(pears.idx)
+    assert search(u'pears') == [apples.idx]
+
+
+def test_search_index(datapath):
+    """ Messages saved before the search index is built are indexed. """
+    apples = post(u'alice', [u'public'], subject=u'Apples')
+    assert search(u'apples') == []
+    init_databases()
+    assert search(u'apples') == [apples.idx]
+
+
+def test_unread(msgbase):
+    """ Messages are indexed as unread by the subscription of each user. """
+    first = post(u'alice', [u'public', u'funny'])
+    set_subscription(u'bob', [u'fun*'])
+    second = post(u'alice', [u'public', u'funny'])
+    private = post(u'alice', [u'bob'], recipient=u'bob')
+    other = post(u'alice', [u'public', u'other'])
+    post(u'bob', [u'public', u'funny'])
+    assert count_unread(u'bob', [u'fun*']) == {u'fun*': 2, u'': 1}
+    assert list_unread(u'bob', [u'fun*']) == set([first.idx, second.idx,
+                                                  private.idx])
+
+    mark_read(u'bob', [first.idx, private.idx])
+    assert first.idx in get_readmarks(u'bob')
+    assert count_unread(u'bob', [u'fun*']) == {u'fun*': 1, u'': 0}
+
+    # messages re-tagged are added to, or removed from, the index of tag
+    # patterns matching, unless read.
+    retag(other, [u'public', u'fundamental'])
+    retag(second, [u'public', u'other'])
+    retag(first, [u'public', u'funnier'])
+    assert list_unread(u'bob', [u'fun*']) == set([other.idx])
+
+    delete_msg(other.idx)
+    assert count_unread(u'bob', [u'fun*']) == {u'fun*': 0, u'': 0}
+
+
+def test_readmarks_migration(datapath):
+    """ Indices read of the previous user attribute are moved at startup. """
+    from x84.bbs.userbase import USERDB
+    DBProxy(USERDB)[u'bob'] = dict()
+    DBProxy(USERDB, table='attrs').field_set(u'bob', 'readmsgs',
+                                             set([1, 2, 5]))
+    init_databases()
+    assert list(get_readmarks(u'bob')) == [1, 2, 5]
+    assert DBProxy(USERDB, table='attrs').field_get(u'bob',
+                                                    'readmsgs') is None
+
+
+def test_subscribed(msgbase):
+    """ Public messages of tag patterns subscribed are counted once. """
+    post(u'alice', [u'public', u'funny'])
+    post(u'alice', [u'public', u'funny', u'games'])
+    post(u'alice', [u'public', u'other'])
+    post(u'alice', [u'games'], recipient=u'bob')
+    set_subscription(u'bob', [u'fun*', u'games'])
+    assert count_subscribed([u'fun*', u'games']) == {
+        u'fun*': 2, u'games': 1, None: 2}
+
+    # tag patterns subscribed are maintained as messages are saved.
+    latest = post(u'alice', [u'public', u'games'])
+    assert count_subscribed([u'fun*', u'games']) == {
+        u'fun*': 2, u'games': 2, None: 3}
+    assert latest.idx in list_subscribed([u'games'])
+
+
+def test_subscriber_index(datapath):
+    """ Subscriptions previously saved are indexed as the engine begins. """
+    DBProxy(UNREADDB, table='subscription')[u'bob'] = [u'fun*']
+    post(u'alice', [u'public', u'funny'])
+    # until built, public messages of tag patterns are scanned.
+    assert count_subscribed([u'fun*']) == {u'fun*': 1, None: 1}
+    init_databases()
+    assert count_subscribed([u'fun*']) == {u'fun*': 1, None: 1}
+    funny = post(u'alice', [u'public', u'funny'])
+    assert list_unread(u'bob', [u'fun*']) == set([funny.idx])
+    assert count_subscribed([u'fun*']) == {u'fun*': 2, None: 2}
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+""" Tests of user base of x/84, :mod:`x84.bbs.userbase`. """
+# 3rd party
+import pytest
+
+# local
+from x84.dbinit import init_databases
+from x84.bbs.dbproxy import DBProxy
+from x84.bbs import userbase
+from x84.bbs.userbase import USERDB, User, find_user
+
+ATTRS = (USERDB, 'attrs')
+
+
+def new_user(handle):
+    """ Save and return new user. """
+    user = User(handle)
+    user.password = u'secret'
+    user.save()
+    return user
+
+
+@pytest.fixture
+def plaintext(datapath, monkeypatch):
+    """ Passwords of users are stored by the ``plaintext`` digest. """
+    import x84.bbs.ini
+    x84.bbs.ini.CFG.set('system', 'password_digest', 'plaintext')
+    monkeypatch.setattr(userbase, 'FN_PASSWORD_DIGEST', None)
+
+
+@pytest.fixture
+def user(plaintext):
+    """ User ``bob``, of attributes cached. """
+    user = new_user(u'bob')
+    user['calls'] = 1
+    user.cache_attrs()
+    return user
+
+
+def test_find_user(plaintext):
+    """ Users are found by handle, case-insensitive. """
+    init_databases()
+    new_user(u'Bob')
+    new_user(u'ÄLICE')
+    assert find_user(u'bob') == u'Bob'
+    assert find_user(u'älice') == u'ÄLICE'
+    assert find_user(u'carol') is None
+
+    new_user(u'Carol').delete()
+    assert find_user(u'carol') is None
+
+
+def test_handle_index(plaintext):
+    """ Users saved before the handle index are indexed as it is built. """
+    new_user(u'Bob')
+    db_handles = DBProxy(USERDB, table='handles')
+    for key in db_handles.keys():
+        del db_handles[key]
+    # until built, the handles of all users are compared.
+    assert find_user(u'BOB') == u'Bob'
+    init_databases()
+    assert db_handles.get(u'bob') == u'Bob'
+    assert find_user(u'BOB') == u'Bob'
+
+
+def test_attrs_flush(user):
+    """ Cached attributes are written by flush, in a single transaction. """
+    other = User(u'bob')
+    user['calls'] = 2
+    user['expert'] = True
+    del user['calls']
+    assert user.get_many() == {u'expert': True}
+    assert other.get_many() == {u'calls': 1}
+
+    user.flush_attrs(interval=60)
+    assert other.get_many() == {u'calls': 1}
+    user.flush_attrs()
+    assert other.get_many() == {u'expert': True}
+
+
+def test_attrs_invalidate(user):
+    """ Attributes written by others are reloaded, retaining our own. """
+    user['expert'] = True
+    user.flush_attrs()
+    user['location'] = u'here'
+    # invalidation of our own write is already cached.
+    user.invalidate_attrs([ATTRS + (u'bob',)])
+    # pylint: disable=W0212
+    #         Access to a protected member _stale of a client class
+    assert not user._stale
+
+    User(u'bob')['calls'] = 5
+    user.invalidate_attrs([ATTRS + (u'alice',)])
+    assert user.get('calls') == 1
+    user.invalidate_attrs([ATTRS + (b'bob',)])
+    assert user.get_many() == {u'calls': 5, u'expert': True,
+                               u'location': u'here'}
+
+
+def test_attrs_flush_failure(user, monkeypatch):
+    """ Attributes not written by a failed flush are written by the next. """
+    def transaction(self):
+        raise IOError('database unavailable')
+
+    user['expert'] = True
+    with monkeypatch.context() as patch:
+        patch.setattr(DBProxy, 'transaction', transaction)
+        with pytest.raises(IOError):
+            user.flush_attrs()
+    User(u'bob')['calls'] = 5
+    user.flush_attrs()
+    assert User(u'bob').get_many() == {u'calls': 5, u'expert': True}
+    assert user.get_many() == {u'calls': 5, u'expert': True}
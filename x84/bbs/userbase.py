@@ -1,5 +1,8 @@
 """ Userbase record database and utility functions for x/84. """
+import unicodedata
 import logging
+import pickle
+import time
 from x84.bbs.dbproxy import DBProxy
 
 FN_PASSWORD_DIGEST = None
@@ -28,16 +31,48 @@ def get_user(handle):
     return DBProxy(USERDB)[handle]
 
 
+def _handle_key(handle):
+    """ Return key of handle index of user ``handle``, case-insensitive. """
+    if isinstance(handle, bytes):
+        handle = handle.decode('utf8')
+    return unicodedata.normalize('NFKC', handle).lower()
+
+
+def build_handle_index():
+    """
+    Build handle index of all users, as they are saved thereafter.
+
+    It is built once, by :func:`x84.dbinit.init_databases`, before any
+    session reads it.
+    """
+    if is_handle_indexed():
+        return
+    with DBProxy(USERDB, table='handles').transaction() as txn:
+        for key in DBProxy(USERDB).keys():
+            handle = key.decode('utf8') if isinstance(key, bytes) else key
+            txn[_handle_key(handle)] = handle
+        txn.table('meta')['handles_indexed'] = True
+
+
+def is_handle_indexed():
+    """ Whether the index of :func:`build_handle_index` is built. """
+    return bool(DBProxy(USERDB, table='meta').get('handles_indexed'))
+
+
 def find_user(handle):
     """
     Discover and return matching user by ``handle``, case-insensitive.
 
-    :returns: matching handle as str, or None if not found.
-    :rtype: None or str.
+    :returns: matching handle as unicode, or None if not found.
+    :rtype: None or unicode.
     """
-    for key in DBProxy(USERDB).keys():
-        if handle.lower() == key.decode('utf8').lower():
-            return key
+    if not is_handle_indexed():
+        # not yet built, all handles are compared.
+        for match in list_users():
+            if _handle_key(match) == _handle_key(handle):
+                return match
+        return None
+    return DBProxy(USERDB, table='handles').get(_handle_key(handle))
 
 
 class Group(object):
@@ -94,7 +129,28 @@ class Group(object):
 
 class User(object):
 
-    """ A simple user record. """
+    """
+    A simple user record.
+
+    User attributes, such as ``user['expert']``, are read and written to
+    the database as they are accessed, unless cached by :meth:`cache_attrs`,
+    as for the user of a session.
+    """
+
+    #: pickled values of attributes by key, when cached.
+    _attrs = None
+
+    #: keys of cached attributes modified since :meth:`flush_attrs`.
+    _dirty = None
+
+    #: whether cached attributes were since modified by another session.
+    _stale = False
+
+    #: time of last :meth:`flush_attrs`.
+    _flushed = None
+
+    #: number of invalidations yet to be received for our own writes.
+    _written = 0
 
     def __init__(self, handle=u'anonymous'):
         """ Class initializer. """
@@ -106,6 +162,13 @@ class User(object):
         self._calls = 0
         self._lastcall = 0
 
+    def __getstate__(self):
+        # cached attributes are not stored with the user record.
+        state = self.__dict__.copy()
+        for name in ('_attrs', '_dirty', '_stale', '_flushed', '_written'):
+            state.pop(name, None)
+        return state
+
     @property
     def handle(self):
         """ User handle, also the database key. """
@@ -157,10 +220,8 @@ class User(object):
         assert isinstance(try_pass, unicode)
         assert len(try_pass) > 0
         assert self.password != (None, None), ('account is without password')
-        salt = self.password[0]
-        digestpw = get_digestpw()
-        return (self.password == digestpw(try_pass, salt) or pass_ucase
-                and self.password == digestpw(try_pass.upper(), salt))
+        return check_password(self.password, try_pass,
+                              get_digestpw(), pass_ucase)
 
     def __setitem__(self, key, value):
         # pylint: disable=C0111,
@@ -172,13 +233,11 @@ class User(object):
             log.debug("set attr {!r} not possible for 'anonymous'".format(key))
             return
 
-        with adb:
-            if self.handle not in adb:
-                adb[self.handle] = dict([(key, value), ])
-            else:
-                attrs = adb[self.handle]
-                attrs.__setitem__(key, value)
-                adb[self.handle] = attrs
+        if self._attrs is not None:
+            self._get_attrs()[key] = pickle.dumps(value, 2)
+            self._dirty.add(key)
+        else:
+            adb.field_set(self.handle, key, value)
         log.debug("set attr {!r} for user {!r}.".format(key, self.handle))
     __setitem__.__doc__ = dict.__setitem__.__doc__
 
@@ -187,15 +246,8 @@ class User(object):
         #        Missing docstring
         from x84.bbs import ini
         log = logging.getLogger(__name__)
-        adb = DBProxy(USERDB, 'attrs')
 
-        if self.handle not in adb:
-            if ini.CFG.getboolean('session', 'tap_db'):
-                log.debug('User({!r}).get(key={!r}) returns default={!r}'
-                          .format(self.handle, key, default))
-            return default
-
-        attrs = adb.get(self.handle, {})
+        attrs = self.get_many([key])
         if key not in attrs:
             if ini.CFG.getboolean('session', 'tap_db'):
                 log.debug('User({!r}.get(key={!r}) returns default={!r}'
@@ -211,25 +263,135 @@ class User(object):
     def __getitem__(self, key):
         # pylint: disable=C0111,
         #        Missing docstring
-        return DBProxy(USERDB, 'attrs')[self.handle][key]
+        attrs = self.get_many([key])
+        if key not in attrs:
+            raise KeyError(key)
+        return attrs[key]
     __getitem__.__doc__ = dict.__getitem__.__doc__
 
+    def get_many(self, keys=None):
+        """
+        Return dict of user attributes of any ``keys`` found.
+
+        :param list keys: return only these attributes, or all attributes
+                          of the user when ``None``.
+        :rtype: dict
+        """
+        if self._attrs is not None:
+            attrs = self._get_attrs()
+            # values are unpickled for each read, so that they may not be
+            # modified in-place without assignment.
+            return dict((key, pickle.loads(attrs[key]))
+                        for key in (attrs if keys is None else keys)
+                        if key in attrs)
+        return DBProxy(USERDB, 'attrs').field_get_many(self.handle, keys)
+
     def __delitem__(self, key):
         # pylint: disable=C0111,
         #        Missing docstring
         log = logging.getLogger(__name__)
         uadb = DBProxy(USERDB, 'attrs')
-        with uadb:
-            # retrieve attributes from uadb,
-            attrs = uadb.get(self.handle, {})
-            # delete attribute if exists
-            if key in attrs:
-                attrs.__delitem__(key)
-                uadb[self.handle] = attrs
+        # delete attribute if exists
+        if self._attrs is not None:
+            if self._get_attrs().pop(key, None) is not None:
+                self._dirty.add(key)
                 log.info("User({!r}) delete attr {!r}."
                          .format(self.handle, key))
+        elif uadb.field_del(self.handle, key):
+            log.info("User({!r}) delete attr {!r}."
+                     .format(self.handle, key))
     __delitem__.__doc__ = dict.__delitem__.__doc__
 
+    def cache_attrs(self):
+        """
+        Load all user attributes, read and written in memory thereafter.
+
+        Attributes modified are written to the database by
+        :meth:`flush_attrs`, attributes modified by others are reloaded
+        as signaled by :meth:`invalidate_attrs`.  Used for the user of a
+        session, by :attr:`x84.bbs.session.Session.user`.
+        """
+        self._attrs = self._load_attrs()
+        self._dirty = set()
+        self._stale = False
+        self._flushed = time.time()
+        self._written = 0
+
+    def _load_attrs(self):
+        """ Return dict of pickled values of all attributes of database. """
+        return dict((key, pickle.dumps(value, 2)) for key, value in
+                    DBProxy(USERDB, 'attrs').field_get_many(
+                        self.handle).items())
+
+    def _get_attrs(self):
+        """ Return dict of cached attributes, reloaded when stale. """
+        if self._stale:
+            self._stale = False
+            attrs = self._load_attrs()
+            # attributes modified but not yet written are retained.
+            for key in self._dirty:
+                if key in self._attrs:
+                    attrs[key] = self._attrs[key]
+                else:
+                    attrs.pop(key, None)
+            self._attrs = attrs
+        return self._attrs
+
+    def flush_attrs(self, interval=None):
+        """
+        Write cached attributes modified, in a single transaction.
+
+        :param float interval: write only when at least this many seconds
+                               have elapsed since the previous write.
+        """
+        if not self._dirty or (interval is not None and
+                               time.time() - self._flushed < interval):
+            return
+        # a stale cache is reloaded while the keys modified are known.  They
+        # are cleared before writing, so that attributes modified while
+        # awaiting the database are written by the next call.
+        attrs = self._get_attrs()
+        dirty, self._dirty = self._dirty, set()
+        self._flushed = time.time()
+        # each key written is signaled by event ``db-invalidate``, which may
+        # be received while awaiting the database.
+        self._written += len(dirty)
+        try:
+            with DBProxy(USERDB, 'attrs').transaction() as txn:
+                for key in dirty:
+                    if key in attrs:
+                        txn.field_set(self.handle, key,
+                                      pickle.loads(attrs[key]))
+                    else:
+                        txn.field_del(self.handle, key)
+        except Exception:
+            # retain keys not written, to be written by the next call; it is
+            # unknown which invalidations will be received, so reload.
+            self._dirty.update(dirty)
+            self._written = 0
+            self._stale = True
+            raise
+
+    def invalidate_attrs(self, invalidations):
+        """
+        Reload cached attributes when modified, such as by a sysop.
+
+        :param list invalidations: sequence of ``(schema, table, key)``
+            written to the database, as received by event ``db-invalidate``.
+        """
+        if self._attrs is None:
+            return
+        for schema, table, key in invalidations:
+            if isinstance(key, bytes):
+                key = key.decode('utf8', 'replace')
+            if (schema, table) == (USERDB, 'attrs') and key in (
+                    None, self.handle):
+                if key is not None and self._written:
+                    # written by our own flush_attrs(), already cached.
+                    self._written -= 1
+                else:
+                    self._stale = True
+
     @property
     def groups(self):
         """ Set of groups user is a member of (set of strings). """
@@ -256,14 +418,12 @@ class User(object):
                 log.warn('{!r}: First new user becomes sysop.'
                          .format(self.handle))
                 self.group_add(u'sysop')
-            is_new = self.handle not in udb
-            udb[self.handle] = self
-            if is_new:
+            with udb.transaction() as txn:
+                txn.has_key(self.handle)
+                txn[self.handle] = self
+                txn.table('handles')[_handle_key(self.handle)] = self.handle
+            if not txn.results[0]:
                 log.info("saved new user '%s'.", self.handle)
-        adb = DBProxy(USERDB, 'attrs')
-        with adb:
-            if self.handle not in adb:
-                adb[self.handle] = dict()
         self._apply_groups()
 
     def delete(self):
@@ -278,7 +438,10 @@ class User(object):
                     group.save()
         udb = DBProxy(USERDB)
         with udb:
-            del udb[self.handle]
+            with udb.transaction() as txn:
+                del txn[self.handle]
+                if _handle_key(self.handle) in DBProxy(USERDB, 'handles'):
+                    del txn.table('handles')[_handle_key(self.handle)]
         log.info("deleted user '%s'.", self.handle)
 
     @property
@@ -383,6 +546,21 @@ def _digestpw_plaintext(password, salt=None):
     return salt, password
 
 
+def check_password(password, try_pass, digestpw, pass_ucase=False):
+    """
+    Return whether ``try_pass`` matches encrypted ``password``.
+
+    :param tuple password: encrypted password as tuple (salt, hash).
+    :param unicode try_pass: password given in plain-text.
+    :param callable digestpw: password digest routine of ``password``.
+    :param bool pass_ucase: whether ``try_pass`` may also match in uppercase.
+    :rtype: bool
+    """
+    salt = password[0]
+    return (password == digestpw(try_pass, salt) or pass_ucase
+            and password == digestpw(try_pass.upper(), salt))
+
+
 def get_digestpw():
     """ Returns singleton to password digest routine. """
     global FN_PASSWORD_DIGEST
@@ -430,8 +608,14 @@ def check_anonymous_user(username):
     return allowed and username in matching
 
 
-def check_user_password(username, password):
-    """ Boolean return when username and password match user record. """
+def check_user_password(username, password, address=None):
+    """
+    Boolean return when username and password match user record.
+
+    :param str address: when given, the ip address of the client, and the
+        password is verified by :class:`x84.auth.AuthPool`, rather than by
+        the calling thread.
+    """
     from x84.bbs import find_user, get_user
     handle = find_user(username)
     if handle is None:
@@ -439,7 +623,12 @@ def check_user_password(username, password):
     user = get_user(handle)
     if user is None:
         return False
-    return password and user.auth(password)
+    if not password or user.password == (None, None):
+        return False
+    if address is not None:
+        from x84.auth import get_auth_pool
+        return get_auth_pool().verify(address, user.password, password)
+    return user.auth(password)
 
 
 def parse_public_key(user_pubkey):
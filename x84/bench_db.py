@@ -0,0 +1,83 @@
+#!/usr/bin/env python2.7
+"""
+Benchmark of database commands for x/84.
+
+Each operation is that of a command of :class:`x84.db.DBHandler`: one call
+of ``get_database()``, of a method, and of ``close()``, of a table of 100
+user records in a temporary folder, repeated for two seconds.
+
+The :mod:`x84.db` module of an earlier revision may be given for comparison,
+such as that before connections were pooled::
+
+    git show 27e5728~1:x84/db.py > /tmp/db_before.py
+    python -m x84.bench_db /tmp/db_before.py
+
+Usage::
+
+    python -m x84.bench_db [<filepath of db.py> ...]
+"""
+
+# std imports
+import tempfile
+import shutil
+import time
+import imp
+import sys
+import os
+
+#: seconds each operation is repeated.
+DURATION = 2.0
+
+#: number of user records of table.
+NUM_RECORDS = 100
+
+
+def bench(module, label):
+    """ Print operations per second of database ``module``. """
+    folder = tempfile.mkdtemp()
+    filepath = os.path.join(folder, 'userbase.sqlite3')
+
+    def command(method, *args):
+        dictdb = module.get_database(filepath, 'users')
+        try:
+            return getattr(dictdb, method)(*args)
+        finally:
+            dictdb.close()
+
+    def key(num):
+        return u'user{0}'.format(num % NUM_RECORDS)
+
+    try:
+        for num in range(NUM_RECORDS):
+            command('__setitem__', key(num), {'handle': key(num),
+                                              'attrs': range(20)})
+        for method, func in (
+                ('get', lambda num: command('get', key(num))),
+                ('__setitem__', lambda num: command('__setitem__', key(num),
+                                                    {'num': num})),
+                ('__contains__', lambda num: command('__contains__',
+                                                     key(num))),
+                ('keys', lambda num: command('keys'))):
+            num, stime = 0, time.time()
+            while time.time() - stime < DURATION:
+                func(num)
+                num += 1
+            print('{0:<24} {1:<14} {2:>9.0f}/s'.format(
+                label, method, num / (time.time() - stime)))
+    finally:
+        shutil.rmtree(folder)
+
+
+def main(filepaths):
+    """ Benchmark :mod:`x84.db`, and any modules of ``filepaths``. """
+    import x84.bbs.ini
+    import x84.db
+    x84.bbs.ini.CFG = x84.bbs.ini.init_bbs_ini()
+    for num, filepath in enumerate(filepaths):
+        bench(imp.load_source('x84_db_{0}'.format(num), filepath),
+              os.path.basename(filepath))
+    bench(x84.db, 'x84.db')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -11,6 +11,7 @@ import warnings
 # local
 from x84.bbs.exception import Disconnected
 from x84.terminal import spawn_client_session
+from x84.reactor import wakeup
 
 
 class BaseClient(object):
@@ -60,6 +61,14 @@ class BaseClient(object):
         except socket.error:
             return None
 
+    def recv_fileno(self):
+        """
+        File descriptor polled by the engine for :meth:`socket_recv`.
+
+        ``None`` is returned when there is not (yet) any such descriptor.
+        """
+        return self.fileno()
+
     def input_ready(self):
         """ Whether any data is buffered for reading. """
         return bool(self.recv_buffer.__len__())
@@ -175,6 +184,9 @@ class BaseClient(object):
         if self.active:
             self.active = False
             self.log.debug('{self.addrport}: deactivated'.format(self=self))
+            # this is often called by an on-connect thread, interrupt
+            # the engine so that it may be promptly shutdown.
+            wakeup()
 
     def idle(self):
         """ Time elapsed since data was last received. """
@@ -4,8 +4,13 @@ import sys
 import os
 
 
-def parse_args():
-    """ Parse system arguments and return lookup path for bbs and log ini. """
+def parse_args(arguments=None):
+    """
+    Parse system arguments and return lookup path for bbs and log ini.
+
+    :param list arguments: When given, any positional program arguments
+        are appended to this list, rather than rejected as unrecognized.
+    """
     if sys.platform.lower().startswith('win32'):
         system_path = os.path.join('C:', 'x84')
     else:
@@ -34,7 +39,9 @@ def parse_args():
                 '{0} [--config <filepath>] [--logger <filepath>]\n'
                 .format(os.path.basename(sys.argv[0])))
             sys.exit(1)
-    if len(tail):
+    if arguments is not None:
+        arguments.extend(tail)
+    elif len(tail):
         sys.stderr.write('Unrecognized program arguments: {0}\n'
                          .format(tail))
         sys.exit(1)
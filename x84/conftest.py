@@ -0,0 +1,15 @@
+""" Test fixtures of x/84. """
+# 3rd party
+import pytest
+
+
+@pytest.fixture
+def datapath(tmpdir, monkeypatch):
+    """ Default ini configuration, of a temporary data folder. """
+    import x84.bbs.ini
+    import x84.db
+    cfg = x84.bbs.ini.init_bbs_ini()
+    cfg.set('system', 'datapath', str(tmpdir))
+    monkeypatch.setattr(x84.bbs.ini, 'CFG', cfg)
+    monkeypatch.setattr(x84.db, 'CODEC', None)
+    return str(tmpdir)
@@ -1,32 +1,990 @@
 """ Database request handler for x/84. """
 # std imports
 import multiprocessing
+import collections
+import contextlib
 import threading
+import cPickle as pickle
 import logging
+import sqlite3
 import errno
+import zlib
+import time
 import os
 
 # 3rd-party
 import sqlitedict
 
+# local
+from x84.reactor import wakeup
+
 FILELOCK = multiprocessing.Lock()
 DATALOCK = {}
 
+#: open lock file of the data folder, when held, see :func:`lock_datapath`.
+DATAPATH_LOCK = None
+DATAPATH_LOCK_PID = None
+
+#: dictionary methods that do not modify the database, these may be
+#: executed concurrently by :class:`DBWorkerPool`.
+READ_METHODS = frozenset((
+    '__contains__', '__getitem__', '__len__', 'get', 'has_key', 'keys',
+    'values', 'items', 'iterkeys', 'itervalues', 'iteritems', 'page',
+    'index_members', 'index_count', 'index_counts', 'index_keys',
+    'index_search', 'get_many', 'field_get', 'field_get_many',
+    'items_range',
+))
+
+#: default number of rows of each page of an iterable database command,
+#: see :meth:`PooledSqliteDict.page`.
+PAGE_SIZE = 256
+
+#: dictionary methods that modify only the key given as first argument.
+KEY_METHODS = frozenset((
+    '__setitem__', '__delitem__', 'setdefault',
+    'set_add', 'set_discard', 'dict_set', 'dict_del', 'field_set',
+    'field_del', 'call_method',
+))
+
+#: dictionary methods that modify only tables private to the database,
+#: these do not invalidate any cached keys.
+PRIVATE_METHODS = frozenset((
+    'next_index', 'index_add', 'index_discard', 'index_membership',
+    'index_update', 'index_difference_update', 'index_clear', 'vacuum',
+    'create_index_table',
+))
+
+#: name of the table of :meth:`PooledSqliteDict.next_index` counters.
+SEQUENCE_TABLE = '__sequence__'
+
+#: suffix of the name of index tables, see :meth:`PooledSqliteDict.index_add`.
+INDEX_SUFFIX = '__index'
+
+#: suffix of the name of field tables, see :meth:`PooledSqliteDict.field_set`.
+FIELD_SUFFIX = '__fields'
+
+#: keys modified by database commands, as ``(schema, table, key)``,
+#: see :func:`enable_invalidations`.
+INVALIDATIONS = None
+INVALIDATIONS_PID = None
+
+
+class ValueCodec(object):
+
+    """
+    Serialization of database values.
+
+    Values are pickled by protocol 2, and those of at least ``threshold``
+    bytes are compressed, when smaller, and prefixed by a version byte
+    of their compression.  Pickles begin with opcode ``\x80``, or a
+    printable character for the earlier protocols of previously stored
+    values, so that all values are decoded by their first byte.
+
+    Further compressors may be registered to :attr:`DECOMPRESSORS`, and
+    used by a codec of its ``version`` byte and ``compress`` function.
+    """
+
+    #: version byte of zlib-compressed pickles.
+    ZLIB = b'\x01'
+
+    #: decompression function of each version byte.
+    DECOMPRESSORS = {ZLIB: zlib.decompress}
+
+    def __init__(self, threshold=512, version=ZLIB, compress=None):
+        """
+        Class initializer.
+
+        :param int threshold: minimum size of pickled values compressed,
+                              ``0`` disables compression.
+        :param bytes version: version byte of compressed values.
+        :param compress: compression function, by default, of zlib.
+        """
+        assert version in self.DECOMPRESSORS, version
+        self.threshold = threshold
+        self.version = version
+        self.compress = compress or zlib.compress
+
+    def encode(self, obj):
+        """ Serialize ``obj`` to a value accepted by sqlite. """
+        data = pickle.dumps(obj, protocol=2)
+        if self.threshold and len(data) >= self.threshold:
+            packed = self.version + self.compress(data)
+            if len(packed) < len(data):
+                data = packed
+        return sqlite3.Binary(data)
+
+    def decode(self, obj):
+        """ Deserialize value retrieved from sqlite. """
+        data = bytes(obj)
+        if data[:1] in self.DECOMPRESSORS:
+            data = self.DECOMPRESSORS[data[:1]](data[1:])
+        return pickle.loads(data)
+
+
+#: codec of database values, see :func:`get_codec`.
+CODEC = None
+
+
+def get_codec():
+    """ Return singleton :class:`ValueCodec`, by ini configuration. """
+    # pylint: disable=W0603
+    #         Using global statement
+    global CODEC
+    if CODEC is None:
+        from x84.bbs.ini import get_ini
+        threshold = get_ini('system', 'db_compress_threshold',
+                            getter='getint')
+        CODEC = ValueCodec(threshold=threshold or 0)
+    return CODEC
+
+
+class SqliteConnection(object):
+
+    """
+    Synchronous, thread-safe sqlite connection.
+
+    This is a stand-in for :class:`sqlitedict.SqliteMultithread`, which
+    starts a new thread and connection for every :class:`SqliteDict`
+    instance, and blocks the caller on a Queue for every statement.
+    Instead, a single connection to each database file is shared by all
+    tables and threads for writing, serialized by a lock, and each thread
+    reads by a connection of its own.
+
+    Connections are opened in "WAL" journal mode, so that readers do not
+    block writers or one another, and with a larger statement cache, as
+    each table uses only a handful of distinct statements.
+    """
+
+    #: number of prepared statements cached by the connection.
+    CACHED_STATEMENTS = 256
+
+    def __init__(self, filename):
+        """ Class initializer. """
+        self.filename = filename
+        self.autocommit = True
+        self.in_transaction = False
+        # thread of the transaction in progress.
+        self.writer = None
+        self.lock = threading.RLock()
+        self.conn = self._connect()
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        # connections for reading, one of each thread.
+        self._local = threading.local()
+        self._readers = []
+        self._readers_lock = threading.Lock()
+
+    def _connect(self):
+        """ Return new connection to database. """
+        import sqlite3
+        conn = sqlite3.connect(self.filename,
+                               isolation_level=None,
+                               check_same_thread=False,
+                               cached_statements=self.CACHED_STATEMENTS)
+        conn.text_factory = str
+        return conn
+
+    @contextlib.contextmanager
+    def reader(self):
+        """
+        Context manager of connection for reading by the calling thread.
+
+        Within a transaction of the calling thread, its own writes not
+        yet committed are read by the shared connection.
+        """
+        if self.writer == threading.current_thread().ident:
+            yield self.conn
+            return
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+            with self._readers_lock:
+                self._readers.append(conn)
+        yield conn
+
+    def execute(self, req, arg=None, res=None):
+        """ Execute statement ``req`` with arguments ``arg``. """
+        # pylint: disable=W0613
+        #         Unused argument 'res'
+        with self.lock:
+            self.conn.execute(req, arg or tuple())
+
+    def executemany(self, req, items):
+        """ Execute statement ``req`` for each of ``items``, atomically. """
+        with self.transaction():
+            self.conn.executemany(req, items)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Context manager executing statements in a single transaction.
+
+        The transaction is begun ``IMMEDIATE``, acquiring the database
+        write lock, and the connection is held by the calling thread
+        until it is committed, or rolled back when an exception is raised.
+        Nested transactions are merged with the outermost transaction.
+        """
+        with self.lock:
+            if self.in_transaction:
+                yield
+                return
+            self.conn.execute('BEGIN IMMEDIATE')
+            self.in_transaction = True
+            self.writer = threading.current_thread().ident
+            try:
+                yield
+            except:
+                self.in_transaction, self.writer = False, None
+                self.conn.execute('ROLLBACK')
+                raise
+            self.in_transaction, self.writer = False, None
+            self.conn.execute('COMMIT')
+
+    def select(self, req, arg=None):
+        """ Yield all rows of statement ``req`` with arguments ``arg``. """
+        # rows are fetched in full, so that they may be safely yielded while
+        # the calling thread uses the connection for other statements.
+        with self.reader() as conn:
+            rows = conn.execute(req, arg or tuple()).fetchall()
+        for row in rows:
+            yield row
+
+    def select_one(self, req, arg=None):
+        """ Return first row of statement ``req``, or None. """
+        with self.reader() as conn:
+            return conn.execute(req, arg or tuple()).fetchone()
+
+    def commit(self, blocking=True):
+        """ Statements are committed as they are executed. """
+        pass
+
+    def close(self, force=False):
+        """ Close connection to database. """
+        # pylint: disable=W0613
+        #         Unused argument 'force'
+        with self._readers_lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers = []
+        with self.lock:
+            self.conn.close()
+
+
+class PooledSqliteDict(sqlitedict.SqliteDict):
+
+    """
+    A :class:`sqlitedict.SqliteDict` using a pooled :class:`SqliteConnection`.
+
+    Instances are cached by :class:`ConnectionPool`, so that the table
+    is created or verified only once.  Calling :meth:`close` only
+    returns the instance to the pool.
+    """
+
+    def __init__(self, pool, connection, filename, tablename):
+        """ Class initializer. """
+        self._pool, self._connection = pool, connection
+        self._index_table = None
+        self._field_table = None
+        codec = get_codec()
+        sqlitedict.SqliteDict.__init__(self, filename=filename,
+                                       tablename=tablename,
+                                       autocommit=True,
+                                       encode=codec.encode,
+                                       decode=codec.decode)
+
+    def _new_conn(self):
+        return self._connection
+
+    def transaction(self, operations):
+        """
+        Execute a sequence of operations in a single transaction.
+
+        :param list operations: sequence of ``(table, method, args)``,
+            where ``table`` is any table of this database, and ``method``
+            is any non-iterable method name of :class:`PooledSqliteDict`.
+        :rtype: list
+        :returns: return value of each operation, in order.
+        """
+        tables = {self.tablename: self}
+        try:
+            # tables are retrieved from the pool before the transaction
+            # is begun, as they may create the table.
+            for table, method, _ in operations:
+                assert not method.startswith('iter') and (
+                    method != 'transaction'), (
+                    '{0!r} not allowed in transaction'.format(method))
+                if table not in tables:
+                    tables[table] = self._pool.get_database(
+                        self.filename, table)
+
+            results = []
+            with self.conn.transaction():
+                for table, method, args in operations:
+                    func = get_db_func(tables[table], method)
+                    results.append(func(*args))
+            return results
+        finally:
+            for table, dictdb in tables.items():
+                if table != self.tablename:
+                    dictdb.close()
+
+    def page(self, method, after=0, batch_size=None, key_range=None,
+             where=None):
+        """
+        Return a single page of rows of an iterable ``method``.
+
+        :param str method: one of ``iterkeys``, ``itervalues``, ``iteritems``.
+        :param int after: return rows following this ``rowid``, ``0`` for
+                          the first page.
+        :param int batch_size: maximum number of rows scanned.
+        :param tuple key_range: only rows of keys ``start <= key < stop``,
+            either of which may be ``None``.  When integers are given, keys
+            are compared as integers, such as message indices.
+        :param list where: only rows whose value matches all of
+            ``(attr, op, operand)``, see :func:`match_value`.
+        :rtype: tuple
+        :returns: ``(after, rows)``, where ``after`` is given to request the
+                  next page, or ``None`` when no further rows remain.
+        """
+        assert method in ('iterkeys', 'itervalues', 'iteritems'), method
+        batch_size = batch_size or PAGE_SIZE
+        query = ['SELECT rowid, key, value FROM "{0}" WHERE rowid > ?'
+                 .format(self.tablename)]
+        params = [after]
+        for bound, cmp_op in zip(key_range or (), ('>=', '<')):
+            if bound is None:
+                continue
+            column = 'key'
+            if isinstance(bound, (int, long)):
+                column = 'CAST(key AS INTEGER)'
+            query.append('AND {0} {1} ?'.format(column, cmp_op))
+            params.append(bound)
+        query.append('ORDER BY rowid LIMIT ?')
+        params.append(batch_size)
+
+        rows, rowid, scanned = [], None, 0
+        for rowid, key, value in self.conn.select(' '.join(query), params):
+            scanned += 1
+            if method != 'iterkeys' or where:
+                value = self.decode(value)
+                if where and not all(match_value(value, *predicate)
+                                     for predicate in where):
+                    continue
+            rows.append({'iterkeys': key,
+                         'itervalues': value,
+                         'iteritems': (key, value)}[method])
+        # a short page is the last page.
+        if scanned < batch_size:
+            return None, rows
+        return rowid, rows
+
+    def next_index(self, count=1):
+        """
+        Return next integer index of this table, allocated atomically.
+
+        Indices are allocated from a counter of this table, stored in a
+        table of counters of the same database.  The counter of a table
+        not yet allocating indices is initialized, once, to the greatest
+        integer key of the table, so that previously stored keys are not
+        re-used.  Indices are never re-used, even when keys are deleted.
+
+        :param int count: allocate a block of this many indices, the
+                          first of which is returned.
+        :rtype: int
+        """
+        self.conn.execute('CREATE TABLE IF NOT EXISTS "{0}" '
+                          '(name TEXT PRIMARY KEY, value INTEGER NOT NULL)'
+                          .format(SEQUENCE_TABLE))
+        with self.conn.transaction():
+            row = self.conn.select_one(
+                'SELECT value FROM "{0}" WHERE name = ?'
+                .format(SEQUENCE_TABLE), (self.tablename,))
+            if row is None:
+                row = self.conn.select_one(
+                    'SELECT MAX(CAST(key AS INTEGER)) FROM "{0}"'
+                    .format(self.tablename))
+            value = -1 if row[0] is None else row[0]
+            self.conn.execute('INSERT OR REPLACE INTO "{0}" (name, value) '
+                              'VALUES (?, ?)'.format(SEQUENCE_TABLE),
+                              (self.tablename, value + count))
+            return value + 1
+
+    def get_many(self, keys):
+        """
+        Return dict of values of any ``keys`` found.
+
+        Values are selected by one query of each few hundred keys, rather
+        than a query of each key.
+        """
+        keys = list(keys)
+        # keys are returned by sqlite as utf8-encoded bytes, compare
+        # them as unicode.
+        decode = lambda key: (key.decode('utf8') if isinstance(key, bytes)
+                              else key)
+        found = dict()
+        for pos in range(0, len(keys), 500):
+            chunk = keys[pos:pos + 500]
+            found.update((decode(key), self.decode(value))
+                         for key, value in self.conn.select(
+                             'SELECT key, value FROM "{0}" WHERE key IN ({1})'
+                             .format(self.tablename,
+                                     ', '.join('?' * len(chunk))), chunk))
+        return dict((key, found[decode(key)]) for key in keys
+                    if decode(key) in found)
+
+    def items_range(self, start, stop):
+        """
+        Return list of ``(key, value)`` of keys ``start <= key < stop``.
+
+        Items are ordered by key, and selected by a single query of the
+        primary key index, such as all messages of a thread.
+        """
+        return [(key.decode('utf8') if isinstance(key, bytes) else key,
+                 self.decode(value))
+                for key, value in self.conn.select(
+                    'SELECT key, value FROM "{0}" WHERE key >= ? AND key < ? '
+                    'ORDER BY key'.format(self.tablename), (start, stop))]
+
+    def set_add(self, key, member):
+        """ Add ``member`` to set value of ``key``, created if not found. """
+        with self.conn.transaction():
+            members = self.get(key, set())
+            if member not in members:
+                members.add(member)
+                self[key] = members
+
+    def set_discard(self, key, member):
+        """ Remove ``member`` from set value of ``key``, if found. """
+        with self.conn.transaction():
+            members = self.get(key, set())
+            if member in members:
+                members.remove(member)
+                self[key] = members
+
+    def set_membership(self, member, keys):
+        """
+        Make ``member`` found only in set values of given ``keys``.
+
+        Sets of ``keys`` not found are created, ``member`` is removed from
+        all sets of any other keys.  Used for message tags.
+        """
+        # keys are returned by sqlite as utf8-encoded bytes, compare
+        # them as unicode.
+        decode = lambda key: (key.decode('utf8') if isinstance(key, bytes)
+                              else key)
+        keys = set(map(decode, keys))
+        with self.conn.transaction():
+            for key, members in self.iteritems():
+                if decode(key) in keys and member not in members:
+                    members.add(member)
+                    self[key] = members
+                elif decode(key) not in keys and member in members:
+                    members.remove(member)
+                    self[key] = members
+                keys.discard(decode(key))
+            for key in keys:
+                self[key] = set([member])
+
+    def call_method(self, key, method, args=(), default=None):
+        """
+        Call ``method`` of the value of ``key``, which is then stored.
+
+        The value is read, modified and written in a single transaction,
+        such as by :meth:`x84.bbs.msgbase.ReadMarks.update`.
+
+        :param default: value of ``key`` when not found.
+        :returns: return value of ``method``.
+        """
+        with self.conn.transaction():
+            value = self.get(key, default)
+            result = getattr(value, method)(*args)
+            self[key] = value
+            return result
+
+    def dict_set(self, key, subkey, value):
+        """ Set ``subkey`` of dict value of ``key``, created if not found. """
+        with self.conn.transaction():
+            items = self.get(key, dict())
+            items[subkey] = value
+            self[key] = items
+
+    def dict_del(self, key, subkey):
+        """
+        Delete ``subkey`` of dict value of ``key``, if found.
+
+        :rtype: bool
+        :returns: whether ``subkey`` was found and deleted.
+        """
+        with self.conn.transaction():
+            items = self.get(key, dict())
+            if subkey not in items:
+                return False
+            del items[subkey]
+            self[key] = items
+            return True
+
+    def _find_table(self, suffix):
+        """ Return name of table of ``suffix`` of this table, if created. """
+        name = '{0}{1}'.format(self.tablename, suffix)
+        if self.conn.select_one('SELECT name FROM sqlite_master '
+                                'WHERE type = ? AND name = ?',
+                                ('table', name)) is not None:
+            return name
+        return None
+
+    def get_field_table(self):
+        """
+        Return name of the field table of this table, or None if not created.
+
+        The field table holds rows of ``(key, field, value)``, such as the
+        attributes of each user, so that a single field may be read or
+        written without the dict value of each key.  It is created by
+        :meth:`create_field_table`, until then, no fields are found.
+        """
+        if self._field_table is None:
+            self._field_table = self._find_table(FIELD_SUFFIX)
+        return self._field_table
+
+    def create_field_table(self):
+        """
+        Return name of the field table of this table, created if not found.
+
+        When first created, the fields of any dict values of this table are
+        moved to it.  As it modifies this table, it is not called by read
+        methods, but by the engine at startup, see
+        :func:`x84.dbinit.init_databases`, and by the field write methods.
+        """
+        if self.get_field_table() is None:
+            name = '{0}{1}'.format(self.tablename, FIELD_SUFFIX)
+            with self.conn.transaction():
+                if self._find_table(FIELD_SUFFIX) is None:
+                    self.conn.execute(
+                        'CREATE TABLE "{0}" (key TEXT NOT NULL, '
+                        'field TEXT NOT NULL, value BLOB, '
+                        'PRIMARY KEY (key, field))'.format(name))
+                    self.conn.executemany(
+                        'INSERT OR REPLACE INTO "{0}" (key, field, value) '
+                        'VALUES (?, ?, ?)'.format(name),
+                        [(key, field, self.encode(value))
+                         for key, items in self.iteritems()
+                         for field, value in items.items()])
+                    self.conn.execute('DELETE FROM "{0}"'
+                                      .format(self.tablename))
+            self._field_table = name
+        return self._field_table
+
+    def field_get(self, key, field, default=None):
+        """ Return value of ``field`` of ``key``, or ``default``. """
+        table = self.get_field_table()
+        if table is None:
+            return default
+        row = self.conn.select_one(
+            'SELECT value FROM "{0}" WHERE key = ? AND field = ?'
+            .format(table), (key, field))
+        return default if row is None else self.decode(row[0])
+
+    def field_get_many(self, key, fields=None):
+        """
+        Return dict of values of any ``fields`` of ``key`` found.
+
+        :param list fields: return only these fields, or all fields of
+                            ``key`` when ``None``.
+        :rtype: dict
+        """
+        table = self.get_field_table()
+        if table is None:
+            return dict()
+        query = ['SELECT field, value FROM "{0}" WHERE key = ?'
+                 .format(table)]
+        params = [key]
+        if fields is not None:
+            fields = set(fields)
+            if not fields:
+                return dict()
+            query.append('AND field IN ({0})'
+                         .format(', '.join('?' * len(fields))))
+            params.extend(fields)
+        return dict((field.decode('utf8'), self.decode(value))
+                    for field, value in self.conn.select(' '.join(query),
+                                                         params))
+
+    def field_set(self, key, field, value):
+        """ Set value of ``field`` of ``key``. """
+        self.conn.execute('INSERT OR REPLACE INTO "{0}" (key, field, value) '
+                          'VALUES (?, ?, ?)'.format(self.create_field_table()),
+                          (key, field, self.encode(value)))
+
+    def field_del(self, key, field):
+        """
+        Delete ``field`` of ``key``, if found.
+
+        :rtype: bool
+        :returns: whether ``field`` was found and deleted.
+        """
+        table = self.create_field_table()
+        with self.conn.transaction():
+            if self.conn.select_one(
+                    'SELECT 1 FROM "{0}" WHERE key = ? AND field = ?'
+                    .format(table), (key, field)) is None:
+                return False
+            self.conn.execute('DELETE FROM "{0}" WHERE key = ? AND field = ?'
+                              .format(table), (key, field))
+            return True
+
+    def get_index_table(self):
+        """
+        Return name of the index table of this table, or None if not created.
+
+        The index table holds rows of ``(key, member)``, such as message
+        tags and indices, so that members may be added or removed without
+        rewriting a set value of each key.  It is created by
+        :meth:`create_index_table`, until then, no members are found.
+        """
+        if self._index_table is None:
+            self._index_table = self._find_table(INDEX_SUFFIX)
+        return self._index_table
+
+    def create_index_table(self):
+        """
+        Return name of the index table of this table, created if not found.
+
+        When first created, the index is populated from the set values of
+        this table, if any.  It is not called by read methods, but by the
+        engine at startup, see :func:`x84.dbinit.init_databases`, and by
+        the index write methods.
+        """
+        if self.get_index_table() is None:
+            name = '{0}{1}'.format(self.tablename, INDEX_SUFFIX)
+            with self.conn.transaction():
+                if self._find_table(INDEX_SUFFIX) is None:
+                    self.conn.execute(
+                        'CREATE TABLE "{0}" (key TEXT NOT NULL, '
+                        'member INTEGER NOT NULL, PRIMARY KEY (key, member))'
+                        .format(name))
+                    self.conn.execute('CREATE INDEX "{0}_member" ON "{0}" '
+                                      '(member)'.format(name))
+                    self.conn.executemany(
+                        'INSERT OR IGNORE INTO "{0}" (key, member) '
+                        'VALUES (?, ?)'.format(name),
+                        [(key, member) for key, members in self.iteritems()
+                         for member in members])
+            self._index_table = name
+        return self._index_table
+
+    def index_add(self, key, member):
+        """ Add ``member`` to index of ``key``. """
+        self.conn.execute('INSERT OR IGNORE INTO "{0}" (key, member) '
+                          'VALUES (?, ?)'.format(self.create_index_table()),
+                          (key, member))
+
+    def index_discard(self, key, member):
+        """ Remove ``member`` from index of ``key``, if found. """
+        self.conn.execute('DELETE FROM "{0}" WHERE key = ? AND member = ?'
+                          .format(self.create_index_table()), (key, member))
+
+    def index_update(self, key, members):
+        """ Add all ``members`` to index of ``key``. """
+        self.conn.executemany('INSERT OR IGNORE INTO "{0}" (key, member) '
+                              'VALUES (?, ?)'
+                              .format(self.create_index_table()),
+                              [(key, member) for member in members])
+
+    def index_difference_update(self, key, members, prefix=False):
+        """
+        Remove all ``members`` from index of ``key``, if found.
+
+        :param bool prefix: remove from index of all keys beginning with
+                            ``key``, such as those of a single user.
+        """
+        if prefix:
+            self.conn.executemany('DELETE FROM "{0}" WHERE member = ? '
+                                  'AND substr(key, 1, ?) = ?'
+                                  .format(self.create_index_table()),
+                                  [(member, len(key), key)
+                                   for member in members])
+            return
+        self.conn.executemany('DELETE FROM "{0}" WHERE key = ? '
+                              'AND member = ?'
+                              .format(self.create_index_table()),
+                              [(key, member) for member in members])
+
+    def index_clear(self, key):
+        """ Remove all members from index of ``key``. """
+        self.conn.execute('DELETE FROM "{0}" WHERE key = ?'
+                          .format(self.create_index_table()), (key,))
+
+    def index_membership(self, member, keys):
+        """
+        Make ``member`` found only in index of given ``keys``.
+
+        Only rows of ``member`` are modified, such as the tags of a single
+        message.  An empty sequence of ``keys`` removes ``member`` entirely.
+        """
+        table = self.create_index_table()
+        # keys are returned by sqlite as utf8-encoded bytes, compare
+        # them as unicode.
+        decode = lambda key: (key.decode('utf8') if isinstance(key, bytes)
+                              else key)
+        keys = set(map(decode, keys))
+        with self.conn.transaction():
+            for (key,) in self.conn.select(
+                    'SELECT key FROM "{0}" WHERE member = ?'.format(table),
+                    (member,)):
+                if decode(key) not in keys:
+                    self.index_discard(key, member)
+                keys.discard(decode(key))
+            for key in keys:
+                self.index_add(key, member)
+
+    def index_members(self, keys=None, match_all=False, exclude=None):
+        """
+        Return set of members found in index of ``keys``.
+
+        :param list keys: return members of any of these keys, or all
+                          members when ``None``.
+        :param bool match_all: return only members of all ``keys``, their
+                               intersection, rather than their union.
+        :param list exclude: omit members of any of these keys.
+        :rtype: set
+        """
+        table = self.get_index_table()
+        if table is None:
+            return set()
+        query = ['SELECT member FROM "{0}"'.format(table)]
+        params, where = [], []
+        if keys is not None:
+            keys = set(keys)
+            if not keys:
+                return set()
+            where.append('key IN ({0})'.format(', '.join('?' * len(keys))))
+            params.extend(keys)
+        if exclude:
+            exclude = set(exclude)
+            where.append('member NOT IN (SELECT member FROM "{0}" '
+                         'WHERE key IN ({1}))'
+                         .format(table, ', '.join('?' * len(exclude))))
+            params.extend(exclude)
+        if where:
+            query.append('WHERE ' + ' AND '.join(where))
+        query.append('GROUP BY member')
+        if match_all and keys:
+            query.append('HAVING COUNT(*) = ?')
+            params.append(len(keys))
+        return set(member for (member,) in
+                   self.conn.select(' '.join(query), params))
+
+    def index_count(self, keys):
+        """ Return number of distinct members found in index of ``keys``. """
+        keys, table = set(keys), self.get_index_table()
+        if not keys or table is None:
+            return 0
+        return self.conn.select_one(
+            'SELECT COUNT(DISTINCT member) FROM "{0}" WHERE key IN ({1})'
+            .format(table, ', '.join('?' * len(keys))),
+            list(keys))[0]
+
+    def index_counts(self, keys=None):
+        """
+        Return number of members of each key of index.
+
+        :param list keys: count only these keys, or all keys when ``None``.
+        :rtype: dict
+        """
+        table = self.get_index_table()
+        if table is None:
+            return dict()
+        query = ['SELECT key, COUNT(*) FROM "{0}"'.format(table)]
+        params = []
+        if keys is not None:
+            keys = set(keys)
+            if not keys:
+                return dict()
+            query.append('WHERE key IN ({0})'
+                         .format(', '.join('?' * len(keys))))
+            params.extend(keys)
+        query.append('GROUP BY key')
+        return dict((key.decode('utf8'), count) for key, count in
+                    self.conn.select(' '.join(query), params))
+
+    def index_search(self, keys, within=None, limit=None, offset=0):
+        """
+        Return members found in index of any ``keys``, ranked.
+
+        Members are ranked by the number of ``keys`` they are found in,
+        then by greatest member, such as the most recent message.
+
+        :param list keys: keys of index, such as words of a search query.
+        :param list within: only members also found in any of these keys.
+        :param int limit: maximum number of members returned.
+        :param int offset: number of ranked members skipped, for paging.
+        :rtype: list
+        :returns: list of ``(member, number of keys found)``.
+        """
+        keys, table = set(keys), self.get_index_table()
+        if not keys or table is None:
+            return []
+        query = ['SELECT member, COUNT(*) AS rank FROM "{0}" AS idx '
+                 'WHERE key IN ({1})'.format(table,
+                                             ', '.join('?' * len(keys)))]
+        params = list(keys)
+        if within is not None:
+            within = set(within)
+            if not within:
+                return []
+            # each member found is looked up by primary key, rather than
+            # selecting every member of ``within``.
+            query.append('AND EXISTS (SELECT 1 FROM "{0}" AS within '
+                         'WHERE within.member = idx.member '
+                         'AND within.key IN ({1}))'
+                         .format(table, ', '.join('?' * len(within))))
+            params.extend(within)
+        query.append('GROUP BY member ORDER BY rank DESC, member DESC '
+                     'LIMIT ? OFFSET ?')
+        params.extend((-1 if limit is None else limit, offset))
+        return list(self.conn.select(' '.join(query), params))
+
+    def index_keys(self):
+        """ Return list of keys of index having any members. """
+        table = self.get_index_table()
+        if table is None:
+            return []
+        return [key.decode('utf8') for (key,) in self.conn.select(
+            'SELECT DISTINCT key FROM "{0}"'.format(table))]
+
+    def vacuum(self):
+        """
+        Rebuild database file, releasing free pages to the filesystem.
+
+        The write-ahead log is checkpointed and truncated first.  The
+        connection is held for the duration.
+        """
+        with self.conn.lock:
+            assert not self.conn.in_transaction, 'vacuum in transaction'
+            self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            self.conn.execute('VACUUM')
+
+    def close(self, do_log=True, force=False):
+        """ Return this instance to its pool. """
+        # pylint: disable=W0613
+        #         Unused argument 'do_log', 'force'
+        self._pool.release(self.filename)
+
+    def __del__(self):
+        # the pool closes the underlying connection.
+        pass
+
+
+class ConnectionPool(object):
+
+    """
+    Pool of database connections, one for each database file.
+
+    Database tables are returned by :meth:`get_database` as instances of
+    :class:`PooledSqliteDict`, and returned to the pool by their ``close()``
+    method.  Connections that have not been used for ``idle_timeout``
+    seconds are closed.  A pool inherited by a forked process is discarded.
+    """
+
+    #: seconds a connection may remain unused before it is closed.
+    IDLE_TIMEOUT = 300
+
+    def __init__(self, idle_timeout=None):
+        """ Class initializer. """
+        self.idle_timeout = idle_timeout or self.IDLE_TIMEOUT
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        """ Discard all connections, without closing them. """
+        self.pid = os.getpid()
+        # database filepath => SqliteConnection
+        self.connections = {}
+        # database (filepath, table) => PooledSqliteDict
+        self.tables = {}
+        # database filepath => number of tables in use
+        self.in_use = {}
+        # database filepath => time of last release
+        self.last_used = {}
+        self.last_sweep = time.time()
+
+    def get_database(self, filepath, table):
+        """ Return :class:`PooledSqliteDict` instance for given database. """
+        with self.lock:
+            if self.pid != os.getpid():
+                # sqlite connections must not be shared by forked processes.
+                self._reset()
+            self._sweep()
+            key = (filepath, table)
+            if key not in self.tables:
+                if filepath not in self.connections:
+                    self.connections[filepath] = SqliteConnection(filepath)
+                self.tables[key] = PooledSqliteDict(
+                    pool=self, connection=self.connections[filepath],
+                    filename=filepath, tablename=table)
+            self.in_use[filepath] = self.in_use.get(filepath, 0) + 1
+            return self.tables[key]
+
+    def release(self, filepath):
+        """ Return a table of database ``filepath`` to the pool. """
+        with self.lock:
+            if self.in_use.get(filepath):
+                self.in_use[filepath] -= 1
+            self.last_used[filepath] = time.time()
+
+    def close(self):
+        """ Close all connections. """
+        with self.lock:
+            for filepath in self.connections.keys():
+                self._close(filepath)
+
+    def _sweep(self):
+        """ Close connections idle for longer than ``idle_timeout``. """
+        now = time.time()
+        if now - self.last_sweep < self.idle_timeout / 10.0:
+            return
+        self.last_sweep = now
+        for filepath in self.connections.keys():
+            if (not self.in_use.get(filepath) and
+                    now - self.last_used.get(filepath, now)
+                    > self.idle_timeout):
+                logging.getLogger(__name__).debug(
+                    'close idle database {0}'.format(filepath))
+                self._close(filepath)
+
+    def _close(self, filepath):
+        """ Close connection of ``filepath`` and discard its tables. """
+        for key in [key for key in self.tables if key[0] == filepath]:
+            del self.tables[key]
+        self.in_use.pop(filepath, None)
+        self.last_used.pop(filepath, None)
+        self.connections.pop(filepath).close()
+
+
+#: Singleton connection pool of this process, see :func:`get_database`.
+POOL = ConnectionPool()
+
 
 def get_database(filepath, table):
-    """ Return :class:`sqlitedict.SqliteDict` instance for given database. """
+    """
+    Return :class:`PooledSqliteDict` instance for given database.
+
+    The caller must call its ``close()`` method when finished, which
+    returns it to the connection pool.
+    """
     # pylint: disable=W0602
     #          Using global for 'FILELOCK' but no assignment is done
     global FILELOCK
+    key = (filepath, table)
+    if POOL.pid == os.getpid() and key in POOL.tables:
+        # already verified, as it was opened.
+        return POOL.get_database(filepath, table)
     with FILELOCK:
         # if the bbs is run as root, file ownerships become read-only
         # and db transactions will throw 'read-only database' errors,
         # exit earlier if we know that file permissions are to blame
         check_db(filepath)
 
-        dictdb = sqlitedict.SqliteDict(filename=filepath,
-                                       tablename=table,
-                                       autocommit=True)
+        dictdb = POOL.get_database(filepath, table)
     return dictdb
 
 
@@ -54,16 +1012,151 @@ def get_db_filepath(schema):
     return os.path.join(folder, '{0}.sqlite3'.format(schema))
 
 
-def get_db_lock(schema, table):
-    """ Return database lock for given ``(schema, table)``. """
-    key = (schema, table)
+def get_db_lock(schema, table, key=None):
+    """
+    Return database lock for given ``(schema, table, key)``.
+
+    This lock is local to the calling process, used by command line tools
+    that hold the lock of :func:`lock_datapath`.  Sessions, and threads of
+    the engine process, acquire database locks from the engine, see
+    :meth:`x84.bbs.dbproxy.DBProxy.acquire`.
+    """
+    lock_key = (schema, table, key)
     # pylint: disable=W0602
     #          Using global for 'FILELOCK' but no assignment is done
     global DATALOCK, FILELOCK
     with FILELOCK:
-        if key not in DATALOCK:
-            DATALOCK[key] = multiprocessing.Lock()
-    return DATALOCK[key]
+        if lock_key not in DATALOCK:
+            DATALOCK[lock_key] = threading.Lock()
+    return DATALOCK[lock_key]
+
+
+def lock_datapath():
+    """
+    Acquire exclusive lock of the data folder, for the life of the process.
+
+    Held by the engine, and by command line tools that modify databases
+    outside of it, such as :mod:`x84.msgbulk`, so that they are not run
+    while the board is online: their database locks are local to their
+    own process.  The lock is a ``fcntl(2)`` record lock of file
+    ``x84.lock`` of ini option ``[system] datapath``, which, unlike
+    ``flock(2)``, is not inherited by forked sessions and worker
+    processes, which would otherwise hold it after the engine exits.
+
+    :rtype: bool
+    :returns: whether the lock was acquired, False when held by another.
+    """
+    # pylint: disable=W0603
+    #         Using the global statement
+    global DATAPATH_LOCK, DATAPATH_LOCK_PID
+    if DATAPATH_LOCK is None or DATAPATH_LOCK_PID != os.getpid():
+        import fcntl
+        from x84.bbs.ini import get_ini
+        folder = get_ini('system', 'datapath')
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        fobj = open(os.path.join(folder, 'x84.lock'), 'a')
+        try:
+            fcntl.lockf(fobj.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as err:
+            fobj.close()
+            if err.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            return False
+        DATAPATH_LOCK, DATAPATH_LOCK_PID = fobj, os.getpid()
+    return True
+
+
+def match_value(value, attr, op, operand):
+    """
+    Whether database ``value`` matches predicate ``(attr, op, operand)``.
+
+    The attribute ``attr`` of ``value``, or item when ``value`` is a dict,
+    is compared by ``op``, which is one of ``'=='``, ``'!='``, ``'<'``,
+    ``'>'``, ``'in'`` (attribute is found in ``operand``) or ``'contains'``
+    (``operand`` is found in attribute, such as a message tag).  A value
+    without ``attr`` does not match.
+
+    :rtype: bool
+    """
+    try:
+        if isinstance(value, dict):
+            attr_value = value[attr]
+        else:
+            attr_value = getattr(value, attr)
+    except (KeyError, AttributeError):
+        return False
+    if op == 'contains':
+        return operand in attr_value
+    elif op == 'in':
+        return attr_value in operand
+    return {'==': lambda: attr_value == operand,
+            '!=': lambda: attr_value != operand,
+            '<': lambda: attr_value < operand,
+            '>': lambda: attr_value > operand}[op]()
+
+
+def enable_invalidations():
+    """
+    Begin recording database writes for cache invalidation.
+
+    Called by the engine, which broadcasts the records returned by
+    :func:`pop_invalidations` to all sessions as event ``db-invalidate``.
+    """
+    # pylint: disable=W0603
+    #         Using the global statement
+    global INVALIDATIONS, INVALIDATIONS_PID
+    INVALIDATIONS = collections.deque()
+    INVALIDATIONS_PID = os.getpid()
+
+
+def get_invalidations(schema, table, cmd, args):
+    """
+    Return list of ``(schema, table, key)`` modified by a database command.
+
+    A ``key`` of ``None`` signifies that any key of ``table`` may have been
+    modified.  An empty list is returned for read commands.
+
+    :rtype: list
+    """
+    if cmd in READ_METHODS or cmd in PRIVATE_METHODS:
+        return []
+    if cmd == 'transaction':
+        invalidations = []
+        for op_table, op_cmd, op_args in args[0]:
+            invalidations.extend(
+                get_invalidations(schema, op_table, op_cmd, op_args))
+        return invalidations
+    if cmd in KEY_METHODS and args:
+        return [(schema, table, args[0])]
+    return [(schema, table, None)]
+
+
+def is_engine():
+    """
+    Whether called by the engine process, see :func:`enable_invalidations`.
+
+    Forked sessions inherit, but are not, the engine.
+    """
+    return INVALIDATIONS is not None and INVALIDATIONS_PID == os.getpid()
+
+
+def record_invalidations(schema, table, cmd, args):
+    """ Record keys modified by database command, when enabled. """
+    # forked sessions inherit, but must not record to, the engine's deque.
+    if is_engine():
+        invalidations = get_invalidations(schema, table, cmd, args)
+        if invalidations:
+            INVALIDATIONS.extend(invalidations)
+            wakeup()
+
+
+def pop_invalidations():
+    """ Return and clear list of recorded ``(schema, table, key)``. """
+    invalidations = []
+    while INVALIDATIONS:
+        invalidations.append(INVALIDATIONS.popleft())
+    return invalidations
 
 
 def get_db_func(dictdb, cmd):
@@ -111,14 +1204,15 @@ def log_db_cmd(log, schema, cmd, args):
                                             args=s_args))
 
 
-class DBHandler(threading.Thread):
+class DBHandler(object):
 
     """
     This handler receives and handles a dictionary-based "database command".
 
     See complimenting :class:`x84.bbs.dbproxy.DBProxy`, which behaves as a
     dictionary and "packs" command iterables through an IPC event queue which
-    is then dispatched by the engine.
+    is then dispatched by the engine, to be executed by a thread of
+    :class:`DBWorkerPool`.
 
     The return values are sent to the session queue with equal 'event' name.
     """
@@ -131,9 +1225,10 @@ class DBHandler(threading.Thread):
                                            ipc queue (``tty.master_write``).
         :param str event: database schema in form of string ``'db-schema'``
                           or ``'db=schema'``.  When ``'-'`` is used, the result
-                          is returned as a single transfer. When ``'='``, an
-                          iterable is yielded and the data is transfered via
-                          the IPC Queue as a stream.
+                          is returned as a single transfer. When ``'='``, the
+                          command must be ``page``, a single transfer of one
+                          page of an iterable, see
+                          :meth:`PooledSqliteDict.page`.
         :param tuple data: a dict method proxy command sequence in form of
                            ``(table, command, arguments)``.  For example,
                            ``('unnamed', 'pop', 0).
@@ -149,27 +1244,41 @@ class DBHandler(threading.Thread):
         self._tap_db = self.log.isEnabledFor(logging.DEBUG) and (
             get_ini('session', 'tab_db', getter='getboolean'))
 
-        threading.Thread.__init__(self)
+    @property
+    def is_read(self):
+        """ Whether this command does not modify the database. """
+        return self.cmd in READ_METHODS
+
+    def reject(self, err):
+        """ Send exception ``err`` to session, without executing command. """
+        try:
+            self.queue.send(('exception', err,))
+        except IOError as err:
+            if err.errno != errno.EBADF:
+                raise
 
     def run(self):
         """ Execute database command and return results to session queue. """
         dictdb = get_database(self.filepath, self.table)
-        func = get_db_func(dictdb, self.cmd)
         if self._tap_db:
             log_db_cmd(self.log, self.schema, self.cmd, self.args)
 
         try:
-            # single value result,
-            if not self.iterable:
-                result = func(*self.args)
-                self.queue.send((self.event, result))
+            # an invalid method is also an exception sent to the session,
+            # which otherwise awaits a reply without end.
+            func = get_db_func(dictdb, self.cmd)
+            assert not self.iterable or self.cmd == 'page', (
+                'iterable results are retrieved by command page')
 
-            # iterable value result,
-            else:
-                self.queue.send((self.event, (None, 'StartIteration'),))
-                for item in func(*self.args):
-                    self.queue.send((self.event, item,))
-                self.queue.send((self.event, (None, StopIteration,),))
+            # single value result, or single page of an iterable result,
+            try:
+                result = func(*self.args)
+            finally:
+                # recorded before the reply, so that the engine sends
+                # them before granting any lock the session releases.
+                record_invalidations(self.schema, self.table,
+                                     self.cmd, self.args)
+            self.queue.send((self.event, result))
 
         # pylint: disable=W0703
         #         Catching too general exception
@@ -187,3 +1296,171 @@ class DBHandler(threading.Thread):
 
         finally:
             dictdb.close()
+
+
+class DBWorkerPool(object):
+
+    """
+    Fixed-size pool of threads executing :class:`DBHandler` commands.
+
+    Commands are queued by database ``schema``, and executed in order for
+    each schema: consecutive read commands (:data:`READ_METHODS`) of a schema
+    may be executed concurrently, while a write command waits for all
+    commands queued before it to complete, and is executed alone.
+
+    When more than ``max_pending`` commands are queued, further commands
+    are rejected, the session receiving exception
+    :class:`x84.bbs.exception.DatabaseBusy`.
+    """
+
+    #: default number of worker threads.
+    NUM_WORKERS = 4
+
+    #: default maximum number of commands queued.
+    MAX_PENDING = 1024
+
+    def __init__(self, num_workers=None, max_pending=None):
+        """ Class initializer. """
+        self.log = logging.getLogger(__name__)
+        self.num_workers = num_workers or self.NUM_WORKERS
+        self.max_pending = max_pending or self.MAX_PENDING
+        self.cond = threading.Condition()
+        self.threads = []
+        # schema => collections.deque of DBHandler, in order received.
+        self.queues = {}
+        # schema => number of commands executing, and those schemas
+        # currently executing a write command.
+        self.active = {}
+        self.writing = set()
+        # schemas, in round-robin order.
+        self._schemas = collections.deque()
+        self.pending = 0
+        self.stats = dict(submitted=0, completed=0, rejected=0, failed=0,
+                          max_pending=0, wait_time=0.0)
+
+    def submit(self, handler):
+        """
+        Queue :class:`DBHandler` instance for execution.
+
+        :rtype: bool
+        :returns: False if the command was rejected, the queue being full.
+        """
+        with self.cond:
+            if self.pending >= self.max_pending:
+                self.stats['rejected'] += 1
+                reject = True
+            else:
+                reject = False
+                self._start()
+                handler.queued_time = time.time()
+                if handler.schema not in self.queues:
+                    self.queues[handler.schema] = collections.deque()
+                    self._schemas.append(handler.schema)
+                self.queues[handler.schema].append(handler)
+                self.pending += 1
+                self.stats['submitted'] += 1
+                if self.pending > self.stats['max_pending']:
+                    self.stats['max_pending'] = self.pending
+                self.cond.notify()
+
+        if reject:
+            from x84.bbs.exception import DatabaseBusy
+            self.log.warn('database queue full ({0} pending), rejected '
+                          '{1}/{2}'.format(self.pending, handler.schema,
+                                           handler.cmd))
+            handler.reject(DatabaseBusy(
+                'database queue is full, try again later'))
+        return not reject
+
+    def get_stats(self):
+        """
+        Return dictionary of queue statistics.
+
+        Values ``pending`` and ``active`` are the current number of queued
+        and executing commands, ``max_pending`` the largest queue depth
+        observed, and ``wait_time`` the sum of seconds that ``completed``
+        commands were queued before being executed.
+        """
+        with self.cond:
+            stats = self.stats.copy()
+            stats['pending'] = self.pending
+            stats['active'] = sum(self.active.values())
+            stats['schemas'] = dict(
+                (schema, len(queue)) for schema, queue in self.queues.items())
+        return stats
+
+    def _start(self):
+        """ Start worker threads, if not yet started. """
+        while len(self.threads) < self.num_workers:
+            thread = threading.Thread(target=self._worker,
+                                      name='db-worker-{0}'
+                                      .format(len(self.threads)))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def _next(self):
+        """ Return next command that may be executed, or None. """
+        for _ in range(len(self._schemas)):
+            schema = self._schemas[0]
+            self._schemas.rotate(-1)
+            queue = self.queues[schema]
+            if not queue or schema in self.writing:
+                continue
+            if queue[0].is_read or not self.active.get(schema):
+                handler = queue.popleft()
+                self.active[schema] = self.active.get(schema, 0) + 1
+                if not handler.is_read:
+                    self.writing.add(schema)
+                self.pending -= 1
+                return handler
+        return None
+
+    def _done(self, handler, failed):
+        """ Record completion of ``handler``. """
+        with self.cond:
+            self.active[handler.schema] -= 1
+            self.writing.discard(handler.schema)
+            self.stats['completed'] += 1
+            if failed:
+                self.stats['failed'] += 1
+            # a write, or its readers completing, may allow another command.
+            self.cond.notify_all()
+
+    def _worker(self):
+        """ Execute queued commands, forever. """
+        while True:
+            with self.cond:
+                handler = self._next()
+                while handler is None:
+                    self.cond.wait()
+                    handler = self._next()
+                self.stats['wait_time'] += time.time() - handler.queued_time
+            failed = False
+            try:
+                handler.run()
+            # pylint: disable=W0703
+            #         Catching too general exception
+            except Exception as err:
+                failed = True
+                self.log.exception('{0}/{1}: {2}'.format(
+                    handler.schema, handler.cmd, err))
+            finally:
+                self._done(handler, failed)
+
+
+#: Singleton worker pool of the engine process, see :func:`get_db_pool`.
+DB_POOL = None
+
+
+def get_db_pool():
+    """ Return singleton :class:`DBWorkerPool`, sized by ini configuration. """
+    # pylint: disable=W0603
+    #         Using the global statement
+    global DB_POOL
+    if DB_POOL is None:
+        from x84.bbs.ini import get_ini
+        DB_POOL = DBWorkerPool(
+            num_workers=get_ini('system', 'db_workers', getter='getint'),
+            max_pending=get_ini('system', 'db_queue_size', getter='getint'))
+    return DB_POOL
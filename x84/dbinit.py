@@ -0,0 +1,59 @@
+#!/usr/bin/env python2.7
+"""
+Database initialization for x/84.
+
+Creates the tables of databases that are read by sessions, moving any
+values of earlier revisions to them.  Called by the engine at startup,
+before any session is accepted, and by command line tools that hold
+:func:`x84.db.lock_datapath`.  It may also be run once, while the board
+is offline::
+
+    python -m x84.dbinit [--config <filepath>] [--logger <filepath>]
+"""
+
+# local
+from . import cmdline
+
+
+def init_databases():
+    """
+    Create index and field tables, moving values of earlier revisions.
+
+    These, and the indices of the message base, are created once, rather
+    than by the first session to read them, which may race with others.
+    """
+    from x84.bbs.dbproxy import DBProxy
+    from x84.bbs.msgbase import (TAGDB, build_subscriber_index,
+                                 build_readmarks, build_search_index,
+                                 build_thread_index)
+    from x84.bbs.userbase import USERDB, build_handle_index
+
+    # tags of messages, previously a set of indices of each tag.
+    DBProxy(TAGDB, use_session=False).create_index_table()
+
+    # attributes of users, previously a dict of each user.
+    DBProxy(USERDB, table='attrs', use_session=False).create_field_table()
+
+    # indices built once, which are thereafter maintained as written.
+    build_subscriber_index()
+    build_readmarks()
+    build_search_index()
+    build_thread_index()
+    build_handle_index()
+
+
+if __name__ == '__main__':
+    # as we are running outside of the 'engine' context, it is necessary
+    # for us to initialize the .ini configuration scheme so that the
+    # database path may be gathered.
+    import x84.bbs.ini
+    x84.bbs.ini.init(*cmdline.parse_args())
+
+    # database locks of this process are not those of the engine, refuse
+    # to modify databases while the board is online.
+    import sys
+    from x84.db import lock_datapath
+    if not lock_datapath():
+        sys.exit('data folder is in use, such as by x84/engine.py.')
+
+    init_databases()
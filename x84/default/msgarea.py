@@ -17,24 +17,35 @@ import difflib
 
 # local
 from x84.bbs import (
+    count_subscribed,
     syncterm_setfont,
+    get_subscription,
+    set_subscription,
+    list_subscribed,
     ScrollingEditor,
+    get_msg_headers,
+    get_msg_header,
     list_privmsgs,
+    count_unread,
+    list_unread,
     decode_pipe,
     getterminal,
     getsession,
     LineEditor,
     list_users,
-    list_msgs,
+    delete_msg,
+    count_tags,
+    get_thread,
     list_tags,
+    mark_read,
     get_ini,
     get_msg,
     timeago,
-    DBProxy,
     gosub,
     echo,
     Msg,
 )
+from x84.bbs.msgbase import search
 from common import (
     render_menu_entries,
     show_description,
@@ -90,6 +101,11 @@ color_lowlight = get_ini(
     section='msgarea', key='color_lowlight'
 ) or 'bold_black'
 
+#: maximum number of messages matched by search
+search_max_results = get_ini(
+    section='msgarea', key='search_max_results', getter='getint'
+) or 100
+
 #: maximum length of user handles
 username_max_length = get_ini(
     section='nua', key='max_user', getter='getint'
@@ -109,9 +125,9 @@ def get_menu(messages):
             MenuItem(u'n', u'new ({0})'.format(len(messages['new']))),
             MenuItem(u'm', u'mark all read'),
         ])
-    if messages['all']:
+    if messages['num_all']:
         items.append(
-            MenuItem(u'a', u'all ({0})'.format(len(messages['all'])))
+            MenuItem(u'a', u'all ({0})'.format(messages['num_all']))
         )
     if messages['private']:
         items.append(
@@ -121,6 +137,7 @@ def get_menu(messages):
         MenuItem(u'p', u'post public'),
         MenuItem(u'w', u'write private'),
         MenuItem(u'c', u'change area'),
+        MenuItem(u's', u'search'),
         MenuItem(u'?', u'help'),
         MenuItem(u'q', u'quit'),
     ])
@@ -129,41 +146,39 @@ def get_menu(messages):
 
 def do_mark_as_read(session, message_indicies):
     """ Mark all given messages read. """
-    session.user['readmsgs'] = (
-        session.user.get('readmsgs', set()) | set(message_indicies)
-    )
+    mark_read(session.user.handle, message_indicies)
 
 
 def get_messages_by_subscription(session, subscription):
-    all_tags = list_tags()
-    messages = {'all': set(), 'new': set()}
+    handle = session.user.handle
+    if get_subscription(handle) != list(subscription):
+        # (re-)build index of unread messages for this subscription,
+        # which is then maintained as messages are posted and read.
+        set_subscription(handle, subscription)
+    messages = {}
     messages_bytag = {}
-    messages_read = session.user.get('readmsgs', set())
+    num_unread = count_unread(handle, subscription)
 
-    # now occlude all private messages :)
-    all_private = list_privmsgs(None)
+    # only public messages, private messages are occluded :)  All messages
+    # are counted from their index, and only listed when read.
+    num_all = count_subscribed(subscription)
+    messages['num_all'] = num_all[None]
 
-    # this looks like perl code
     for tag_pattern in subscription:
-        messages_bytag[tag_pattern] = collections.defaultdict(set)
-        for tag_match in fnmatch.filter(all_tags, tag_pattern):
-            msg_indicies = list_msgs(tags=(tag_match,))
-            messages['all'].update(msg_indicies - all_private)
-            messages_bytag[tag_pattern]['all'].update(msg_indicies - all_private)
-        messages_bytag[tag_pattern]['new'] = (
-            messages_bytag[tag_pattern]['all'] - messages_read)
+        messages_bytag[tag_pattern] = {'all': num_all[tag_pattern],
+                                       'new': num_unread[tag_pattern]}
 
     # and make a list of only our own
-    messages['private'] = list_privmsgs(session.user.handle)
+    messages['private'] = list_privmsgs(handle)
 
-    # and calculate 'new' messages
-    messages['new'] = (messages['all'] | messages['private']) - messages_read
+    # and 'new' messages, from index of unread messages
+    messages['new'] = list_unread(handle, subscription)
 
     return messages, messages_bytag
 
 
 def describe_message_area(term, subscription, messages_bytags, colors):
-    get_num = lambda lookup, tag_pattern, grp: len(lookup[tag_pattern][grp])
+    get_num = lambda lookup, tag_pattern, grp: lookup[tag_pattern][grp]
     return u''.join((
         colors['highlight'](u'msgarea: '),
         colors['text'](u', ').join((
@@ -192,8 +207,9 @@ def quote(txt, colors):
 
 
 def do_describe_available_tags(term, colors):
-    sorted_tags = sorted([(len(list_msgs(tags=(tag,))), tag)
-                          for tag in list_tags() or [u'public']
+    tag_counts = count_tags()
+    sorted_tags = sorted([(tag_counts.get(tag, 0), tag)
+                          for tag in tag_counts or [u'public']
                           ], reverse=True)
     decorated_tags = [
         colors['text'](tag) +
@@ -369,11 +385,11 @@ def allow_tag(session, idx):
         # tags are moderated, but user is one of the moderator groups
         return True
 
-    msg = get_msg(idx)
-    if session.user.handle in (msg.recipient, msg.author):
+    header = get_msg_header(idx)
+    if session.user.handle in (header['recipient'], header['author']):
         return True
 
-    for tag in msg.tags:
+    for tag in header['tags']:
         if tag in session.user.groups:
             return True
     return False
@@ -479,29 +495,7 @@ def can_delete(session):
 
 def delete_message(msg):
     """ Experimental message delete! """
-    # ! belongs as msg.delete() function !
-    msg.recipient = u''
-    msg.subject = u''
-    msg.body = u''
-    msg.children = set()
-    msg.parent = None
-    msg.tags = set()
-    msg.save()
-    with DBProxy('tags') as tag_db:
-        for key, values in tag_db.items()[:]:
-            if msg.idx in values:
-                newvalue = values - set([msg.idx])
-                if newvalue:
-                    tag_db[key] = newvalue
-                else:
-                    # no more messages by this tag, delete it
-                    del tag_db[key]
-    with DBProxy('privmsg') as priv_db:
-        for key, values in priv_db.items()[:]:
-            if msg.idx in values:
-                priv_db[key] = values - set([msg.idx])
-    with DBProxy('msgbase') as msg_db:
-        del msg_db['%d' % int(msg.idx)]
+    delete_msg(msg.idx)
 
 
 def do_reader_prompt(session, term, index, message_indices, colors):
@@ -515,6 +509,8 @@ def do_reader_prompt(session, term, index, message_indices, colors):
         opts += (('e', 'dit tags'),)
     if can_delete(session):
         opts += (('D', 'elete'),)
+    opts += (('l', 'ist'),)
+    opts += (('t', 'hread'),)
     opts += (('r', 'eply'),)
     opts += (('q', 'uit'),)
     opts += (('idx', ''),)
@@ -561,6 +557,19 @@ def do_reader_prompt(session, term, index, message_indices, colors):
         elif inp == u'D' and can_delete(session):
             delete_message(msg=get_msg(message_indices[index]))
             return None
+        elif inp == u'l':
+            # list messages, then prompt again for message number
+            echo(u'\r\n')
+            display_message_list(term=term, index=index,
+                                 message_indices=message_indices,
+                                 colors=colors)
+            continue
+        elif inp == u't':
+            # read all messages of thread
+            echo(u'\r\n')
+            read_thread(session=session, term=term,
+                        idx=message_indices[index], colors=colors)
+            return index
         elif inp == u'r':
             # write message reply
             msg = create_reply_message(session=session,
@@ -600,6 +609,43 @@ def do_reader_prompt(session, term, index, message_indices, colors):
                 continue
 
 
+def display_message_list(term, index, message_indices, colors):
+    """ Display list of given messages, by their headers. """
+    now = datetime.datetime.now()
+    prompt_pager(content=[
+        u''.join((colors['lowlight'](u'{0}.'.format(num)), u' ',
+                  colors['highlight'](header['subject'])
+                  if num == index + 1 else header['subject'],
+                  u' ', colors['lowlight'](u'({0}, {1} ago)'.format(
+                      header['author'],
+                      timeago((now - header['stime']).total_seconds())
+                      .strip()))))
+        for num, header in enumerate(get_msg_headers(message_indices),
+                                     start=1)],
+        line_no=0, width=min(80, term.width), colors=colors,
+        breaker=u'- ', end_prompt=False, break_long_words=True)
+
+
+def read_thread(session, term, idx, colors):
+    """ Display reply tree of thread of message ``idx``, then read it. """
+    headers = [header for header in get_thread(idx)
+               if 'public' in header['tags'] or session.user.handle in (
+                   header['author'], header['recipient'])]
+    if not headers:
+        return
+    prompt_pager(content=[
+        u''.join((u'  ' * header['depth'],
+                  colors['highlight'](header['subject'])
+                  if header['idx'] == idx else header['subject'],
+                  u' ', colors['lowlight'](u'({0})'.format(header['author']))))
+        for header in headers],
+        line_no=0, width=min(80, term.width), colors=colors,
+        breaker=u'- ', break_long_words=True)
+    read_messages(session=session, term=term,
+                  message_indices=[header['idx'] for header in headers],
+                  colors=colors)
+
+
 def read_messages(session, term, message_indices, colors):
     """ Read list of given messages. """
     index = 0
@@ -723,10 +769,10 @@ def main(quick=False):
             if inp.lower() in (u'n', 'a', 'v'):
                 # read new/all/private messages
                 message_indices = sorted(list(
-                    {'n': messages['new'],
-                     'a': messages['all'],
-                     'v': messages['private'],
-                     }[inp.lower()]))
+                    {'n': lambda: messages['new'],
+                     'a': lambda: list_subscribed(subscription),
+                     'v': lambda: messages['private'],
+                     }[inp.lower()]()))
                 if message_indices:
                     dirty = 2
                     read_messages(session=session, term=term,
@@ -756,6 +802,15 @@ def main(quick=False):
                     continue
                 do_send_message(session=session, term=term,
                                 msg=msg, colors=colors)
+            elif inp.lower() == u's':
+                # search messages
+                dirty = 2
+                message_indices = prompt_search(session=session, term=term,
+                                                colors=colors)
+                if message_indices:
+                    read_messages(session=session, term=term,
+                                  message_indices=message_indices,
+                                  colors=colors)
             elif inp.lower() == u'c':
                 # prompt for new tag subscription (at next loop)
                 subscription = []
@@ -859,6 +914,36 @@ def prompt_subject(term, msg, colors):
     return True
 
 
+def prompt_search(session, term, colors):
+    """ Prompt for search query, returning list of matching messages. """
+    xpos = max(0, (term.width // 2) - (80 // 2))
+    echo(u''.join((term.move_x(xpos),
+                   term.clear_eos,
+                   u'Enter search words, or from:, to:, or tag: '
+                   u'followed by a handle or tag.\r\n',
+                   term.move_x(xpos),
+                   u':: ')))
+    inp = LineEditor(subject_max_length,
+                     colors={'highlight': colors['backlight']}
+                     ).read()
+
+    if inp is None or not inp.strip():
+        echo(u''.join((term.move_x(xpos),
+                       colors['highlight']('Canceled.'),
+                       term.clear_eol)))
+        term.inkey(1)
+        return []
+
+    message_indices = search(inp.strip(), handle=session.user.handle,
+                             limit=search_max_results)
+    if not message_indices:
+        echo(u''.join((u'\r\n', term.move_x(xpos),
+                       colors['highlight']('No messages found.'),
+                       term.clear_eol)))
+        term.inkey(1)
+    return message_indices
+
+
 def prompt_body(term, msg, colors):
     """ Prompt for and set 'body' of message by executing 'editor' script. """
     with term.fullscreen():
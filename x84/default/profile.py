@@ -69,6 +69,9 @@ def get_display_fields(user, point):
         key: field.description for (key, field) in
         nua.get_validation_fields(user).items()}
 
+    # user attributes displayed, retrieved at once.
+    attrs = user.get_many(('last_from', 'msgs_sent', 'timeout', 'pubkey'))
+
     fields = collections.OrderedDict()
     _indent = point.x + 4 + nua.username_max_length
     # user: <name> last called 10m ago
@@ -90,7 +93,7 @@ def get_display_fields(user, point):
         key=None, width=None, validate_fn=None, description=None,
     )
     fields['last_from'] = field(
-        value=user.get('last_from', 'None'),
+        value=attrs.get('last_from', 'None'),
         field_fmt=u'from {value}',
         display_location=Point(y=point.y + 1, x=_indent),
         edit_location=Point(None, None),
@@ -104,7 +107,7 @@ def get_display_fields(user, point):
         key=None, width=None, validate_fn=None, description=None,
     )
     fields['posts'] = field(
-        value=str(user.get('msgs_sent', 0)),
+        value=str(attrs.get('msgs_sent', 0)),
         field_fmt=u'{value} posts',
         display_location=Point(y=point.y + 2,
                                x=_indent + len('1999 calls') + 1),
@@ -141,7 +144,7 @@ def get_display_fields(user, point):
         validate_fn=None, description=descriptions.get('email'),
     )
     fields['timeout'] = field(
-        value=str(user.get('timeout', 'no')),
+        value=str(attrs.get('timeout', 'no')),
         field_fmt=u'{lb}{key}{rb}dle off{colon} {value}',
         display_location=Point(y=point.y + 11, x=point.x),
         edit_location=Point(y=point.y + 11, x=point.x + 12),
@@ -152,7 +155,7 @@ def get_display_fields(user, point):
                      u"period of time has elapsed (in seconds).  0 disables."),
     )
     fields['pubkey'] = field(
-        value=user.get('pubkey') or 'no',
+        value=attrs.get('pubkey') or 'no',
         field_fmt=u'{lb}{key}{rb}sh-key{colon}  {value}',
         display_location=Point(y=point.y + 11, x=point.x + 19),
         edit_location=Point(y=point.y + 11, x=point.x + 31),
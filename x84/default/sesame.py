@@ -83,16 +83,17 @@ def acquire_node(session, name):
         yield None
         return
 
-    for node in range(1, nodes + 1):
-        event = 'lock-{name}/{node}'.format(name=name, node=node)
-        session.send_event(event, ('acquire', None))
-        if session.read_event(event):
-            yield node
-            session.send_event(event, ('release', None))
-            return
+    session.send_event('node-allocate', (name, nodes))
+    node = session.read_event('node-allocate')
+    if node is None:
+        # node could not be acquired
+        yield -1
+        return
 
-    # node could not be acquired
-    yield -1
+    try:
+        yield node
+    finally:
+        session.send_event('node-release', (name, node))
 
 
 def get_env(session, name):
@@ -21,8 +21,11 @@ __credits__ = [
 __license__ = 'ISC'
 
 # std
+import cPickle as pickle
+import collections
 import logging
 import select
+import threading
 import socket
 import time
 import sys
@@ -30,8 +33,23 @@ import sys
 # local
 __import__('encodings')  # provides alternate encodings
 from x84 import cmdline
-from x84.db import DBHandler
-from x84.terminal import get_terminals, kill_session, find_tty
+from x84.db import (
+    DBHandler,
+    get_db_pool,
+    enable_invalidations,
+    lock_datapath,
+    pop_invalidations,
+)
+from x84.reactor import get_reactor
+from x84.terminal import (
+    get_terminals,
+    allocate_node,
+    release_node,
+    kill_session,
+    find_tty,
+    find_tty_by_fd,
+    get_tty,
+)
 from x84.fail2ban import get_fail2ban_function
 
 
@@ -51,6 +69,23 @@ def main():
     from x84.bbs import get_ini
     from x84.bbs.ini import CFG
 
+    if not lock_datapath():
+        # databases are being modified by another process, such as
+        # x84/msgbulk.py, or another instance of the engine.
+        logging.getLogger('x84.engine').error(
+            'data folder {0} is in use by another process.'
+            .format(get_ini('system', 'datapath')))
+        return 1
+
+    # database writes are broadcast to sessions for cache invalidation,
+    # this also marks the engine process, whose threads acquire database
+    # locks from the engine lock table.
+    enable_invalidations()
+
+    # create tables of databases read by sessions, before any are accepted.
+    from x84.dbinit import init_databases
+    init_databases()
+
     if sys.maxunicode == 65535:
         # apple is the only known bastardized variant that does this;
         # presumably for memory/speed savings (UCS-2 strings are faster
@@ -77,6 +112,12 @@ def main():
         from x84 import msgpoll
         msgpoll.main()
 
+    if get_ini(section='msg', key='maintenance_interval', getter='getint'):
+        # start background timer for message base retention, archiving
+        # and compaction.
+        from x84 import msgmaint
+        msgmaint.main()
+
     try:
         # begin main event loop
         _loop(servers)
@@ -88,7 +129,7 @@ def main():
                     thread.stopped = True
                 server.threads.remove(thread)
             for key, client in server.clients.items()[:]:
-                kill_session(client, 'server shutdown')
+                kill_session(client, 'server shutdown', grace=0)
                 del server.clients[key]
     return 0
 
@@ -189,6 +230,7 @@ def accept(log, server, check_ban):
         # spawn on-connect negotiation thread.  When successful,
         # a new sub-process is spawned and registered as a session tty.
         server.clients[client.sock.fileno()] = client
+        get_reactor().register(client.recv_fileno())
         thread = server.connect_factory(client, **connect_factory_kwargs)
         log.info('{client.kind} connection from {client.addrport} '
                  '(*{thread.name}).'.format(client=client, thread=thread))
@@ -199,17 +241,6 @@ def accept(log, server, check_ban):
         log.error('accept error {0}:{1}'.format(*err))
 
 
-def get_session_output_fds(servers):
-    """ Return file descriptors of all ``tty.master_read`` pipes. """
-    session_fds = []
-    for server in servers:
-        for client in server.clients.values():
-            tty = find_tty(client)
-            if tty is not None:
-                session_fds.append(tty.master_read.fileno())
-    return session_fds
-
-
 def client_recv(servers, ready_fds, log):
     """
     Test all clients for recv_ready().
@@ -217,8 +248,13 @@ def client_recv(servers, ready_fds, log):
     If any data is available, then ``client.socket_recv()`` is called,
     buffering the data for the session which is exhausted by
     :func:`session_send`.
+
+    :rtype: list
+    :returns: terminals as tuples (session-id, tty) of clients that
+              received data.
     """
     from x84.bbs.exception import Disconnected
+    terminals = []
     for server in servers:
         for client in server.clients_ready(ready_fds):
             try:
@@ -227,6 +263,11 @@ def client_recv(servers, ready_fds, log):
                 log.debug('{client.addrport}: disconnect on recv: {err}'
                           .format(client=client, err=err))
                 kill_session(client, 'disconnected: {err}'.format(err=err))
+            else:
+                tty = find_tty(client)
+                if tty is not None:
+                    terminals.append((tty.sid, tty))
+    return terminals
 
 
 def client_send(terminals, log):
@@ -235,17 +276,28 @@ def client_send(terminals, log):
 
     If any data is available, then ``tty.client.send()`` is called.
     This is data sent from the session to the tcp client.
+
+    :rtype: list
+    :returns: terminals as tuples (session-id, tty) of clients that have
+              data remaining that could not yet be sent (bandwidth
+              exceeded), and should be retried.
     """
     from x84.bbs.exception import Disconnected
+    pending = []
     # nothing to send until tty is registered.
-    for _, tty in terminals:
-        if tty.client.send_ready():
+    for sid, tty in terminals:
+        # the socket of a disconnected session, awaiting its exit, is closed.
+        if tty.exit_deadline is None and tty.client.send_ready():
             try:
                 tty.client.send()
             except Disconnected as err:
                 log.debug('{client.addrport}: disconnect on send: {err}'
                           .format(client=tty.client, err=err))
                 kill_session(tty.client, 'disconnected: {err}'.format(err=err))
+            else:
+                if tty.client.send_ready():
+                    pending.append((sid, tty))
+    return pending
 
 
 def session_send(terminals):
@@ -253,8 +305,7 @@ def session_send(terminals):
     Test all tty clients for input_ready().
 
     Meaning, tcp data has been buffered to be received by the tty session,
-    and send it to the tty input queue (tty.master_write).  Also, test all
-    sessions for idle timeout, signaling exit to subprocess when reached.
+    and send it to the tty input queue (tty.master_write).
     """
     for _, tty in terminals:
         if tty.client.input_ready():
@@ -265,35 +316,245 @@ def session_send(terminals):
                 # because the subprocess has logged off, but the user kept
                 # banging the keyboard before we have had the opportunity
                 # to close their telnet socket.
-                kill_session(tty.client, 'no tty for socket data')
+                kill_session(tty.client, 'no tty for socket data', grace=0)
+
+
+#: maximum number of keys of a table pending for a session, more are sent
+#: as a single invalidation of the entire table.
+INVALIDATE_KEYS = 32
+
+
+def queue_invalidations(terminals):
+    """
+    Add keys written to database to those pending for all sessions.
+
+    Keys are coalesced by table, as attribute ``invalidations`` of each
+    :class:`x84.terminal.TerminalProcess`, until sent by
+    :func:`send_invalidations`.  Called while holding :data:`LOCKS_MUTEX`.
+    """
+    invalidations = pop_invalidations()
+    for _, tty in terminals:
+        for schema, table, key in invalidations:
+            keys = tty.invalidations.setdefault((schema, table), set())
+            if keys is None:
+                continue
+            elif key is None or len(keys) >= INVALIDATE_KEYS:
+                tty.invalidations[(schema, table)] = None
+            else:
+                keys.add(key)
+
+
+def send_invalidations(terminals, blocking=False):
+    """
+    Send keys written to database to sessions, as ``db-invalidate``.
+
+    Sessions discard these keys from the session-local cache of
+    :class:`x84.bbs.dbproxy.DBProxy`.  Unless ``blocking``, a session is
+    skipped when its pipe is full, and its pending keys are reduced to an
+    invalidation of each table, sent by a later call.  Called while holding
+    :data:`LOCKS_MUTEX`.
+
+    :rtype: bool
+    :returns: whether any invalidations remain to be sent.
+    """
+    queue_invalidations(get_terminals())
+    remaining = False
+    for _, tty in terminals:
+        if not tty.invalidations:
+            continue
+        invalidations = [
+            (schema, table, key)
+            for (schema, table), keys in sorted(tty.invalidations.items())
+            for key in (sorted(keys) if keys is not None else (None,))]
+        event = ('db-invalidate', invalidations)
+        try:
+            if blocking:
+                tty.master_write.send(event)
+            elif not tty.master_write.try_send(event):
+                for table in tty.invalidations:
+                    tty.invalidations[table] = None
+                remaining = True
+                continue
+        except IOError:
+            # the session has exited, it will be unregistered.
+            pass
+        tty.invalidations.clear()
+    return remaining
+
+
+def check_idle(terminals, recheck=30):
+    """
+    Test all sessions for idle timeout, signaling exit to subprocess.
+
+    Sessions disconnected that have not exited by their ``exit_deadline``,
+    see :func:`x84.terminal.kill_session`, are unregistered.
+
+    :param int recheck: maximum seconds until the next call, so that
+                        changes to ``tty.timeout`` are honored.
+    :rtype: float
+    :returns: time (as epoch) when the next session may reach its timeout.
+    """
+    now = time.time()
+    deadline = now + recheck
+    for _, tty in terminals:
+        if tty.exit_deadline is not None:
+            if now >= tty.exit_deadline:
+                kill_session(tty.client, 'exit timeout', grace=0)
+            else:
+                deadline = min(deadline, tty.exit_deadline)
+        elif tty.timeout:
+            idle = tty.client.idle()
+            if idle > tty.timeout:
+                # poll about and kick off idle users
+                kill_session(tty.client, 'timeout')
+            else:
+                deadline = min(deadline, now + (tty.timeout - idle))
+    return deadline
+
+
+#: locks held, by lock event name, as ``(time acquired, holder)``: where
+#: holder is a session-id, or a thread of the engine process, see
+#: :func:`acquire_thread_lock`.
+LOCKS = {}
+
+#: sessions waiting to acquire a lock held by another session, by lock
+#: event name, as a ``collections.deque`` of ``(session-id, time queued)``.
+LOCK_WAITERS = {}
+
+#: guards :data:`LOCKS` and :data:`LOCK_WAITERS`, modified by the main loop
+#: and by threads of the engine process.
+LOCKS_MUTEX = threading.RLock()
+
+#: threads of the engine process waiting for a lock, by holder name, as
+#: a ``threading.Event`` set when the lock is granted.
+THREAD_WAITERS = {}
+
+#: lock contention statistics, by lock name without its final path segment
+#: (such as ``lock-db/userbase``, or ``lock-db/userbase/attrs`` for a key
+#: lock).
+LOCK_STATS = collections.defaultdict(lambda: dict(
+    acquired=0, contended=0, rejected=0, cancelled=0,
+    wait_time=0.0, max_wait=0.0))
+
+
+def get_lock_stats():
+    """
+    Return dictionary of lock contention statistics, see :data:`LOCK_STATS`.
+
+    Values ``acquired`` is the number of locks granted, ``contended`` the
+    number of those that waited for another session, ``rejected`` and
+    ``cancelled`` the number of requests that were not granted, and
+    ``wait_time`` and ``max_wait`` the total and longest seconds waited.
+    """
+    return dict((name, stats.copy()) for name, stats in LOCK_STATS.items())
 
-        # poll about and kick off idle users
-        elif tty.timeout and tty.client.idle() > tty.timeout:
-            kill_session(tty.client, 'timeout')
+
+def _lock_stats(event):
+    """ Return statistics record of lock ``event``. """
+    return LOCK_STATS[event.rsplit('/', 1)[0]]
+
+
+def _thread_holder(thread=None):
+    """ Return lock holder name of a thread of the engine process. """
+    return u'thread-{0}'.format((thread or threading.current_thread()).ident)
+
+
+def is_lock_holder(sid):
+    """ Whether lock holder ``sid``, a session or thread, is active. """
+    return get_tty(sid) is not None or sid in [
+        _thread_holder(thread) for thread in threading.enumerate()]
+
+
+def grant_lock(locks, event, sid, log, queued=None):
+    """
+    Grant lock ``event`` to session ``sid``, or waiting thread.
+
+    :param float queued: time that session began waiting for the lock.
+    :rtype: bool
+    :returns: whether the lock was granted, False if the session is
+              no longer active.
+    """
+    if sid in THREAD_WAITERS:
+        THREAD_WAITERS.pop(sid).set()
+    else:
+        tty = get_tty(sid)
+        if tty is None:
+            return False
+        # database writes made while the lock was held by another are sent
+        # first, so that they are not read from the session-local cache.
+        send_invalidations([(sid, tty)], blocking=True)
+        try:
+            tty.master_write.send((event, True,))
+        except IOError as err:
+            log.debug('[{sid}] {event} not granted: {err}'
+                      .format(sid=sid, event=event, err=err))
+            return False
+    locks[event] = (time.time(), sid)
+    stats = _lock_stats(event)
+    stats['acquired'] += 1
+    if queued is not None:
+        waited = time.time() - queued
+        stats['contended'] += 1
+        stats['wait_time'] += waited
+        stats['max_wait'] = max(stats['max_wait'], waited)
+    return True
+
+
+def release_lock(locks, event, log):
+    """ Release lock ``event``, granting it to the next waiting session. """
+    locks.pop(event, None)
+    waiters = LOCK_WAITERS.get(event)
+    while waiters:
+        sid, queued = waiters.popleft()
+        if grant_lock(locks, event, sid, log, queued):
+            log.debug('[{sid}] {event} granted lock after {waited:0.2f}s'
+                      .format(sid=sid, event=event,
+                              waited=time.time() - queued))
+            break
+    if not waiters:
+        LOCK_WAITERS.pop(event, None)
+
+
+def release_stale_locks(locks, log):
+    """ Release locks held, and waits queued, by sessions no longer active. """
+    for event, waiters in LOCK_WAITERS.items():
+        for waiter in [_waiter for _waiter in waiters
+                       if not is_lock_holder(_waiter[0])]:
+            waiters.remove(waiter)
+    for event, (_, holder) in locks.items():
+        if not is_lock_holder(holder):
+            log.debug('{event} released, held by session no longer '
+                      'active: {holder}'.format(event=event, holder=holder))
+            release_lock(locks, event, log)
 
 
 def handle_lock(locks, tty, event, data, tap_events, log):
-    """ handle locking event of ``(lock-key, (method, stale))``. """
+    """
+    handle locking event of ``(lock-key, (method, stale))``.
+
+    Method ``acquire`` replies ``True`` or ``False`` immediately, method
+    ``wait`` replies ``True`` when the lock is acquired, waiting in order
+    of request for any other session to release it.  Method ``cancel``
+    withdraws a ``wait``, replying ``False``, unless the lock has already
+    been granted.  Method ``release`` releases a lock without reply.
+    """
     # pylint: disable=R0913
     #         Too many arguments (6/5)
     method, stale = data
-    if method == 'acquire':
+    if method in ('acquire', 'wait'):
         # this lock is already held,
         if event in locks:
             # check if lock held by an active session,
             holder = locks[event][1]
-            for _sid, _ in get_terminals():
-                if _sid == holder and _sid != tty.sid:
-                    # acquire the lock from a now-deceased session.
-                    log.debug('[{tty.sid}] {event} not acquired, '
-                              'held by active session: {holder}'
-                              .format(tty=tty, event=event, holder=holder))
-                    break
-                elif _sid == holder and _sid == tty.sid:
-                    # acquire the lock from ourselves!  We'll allow it
-                    # (this is termed, "re-entrant locking").
-                    log.debug('{tty.sid}] {event} is re-acquired!'
-                              .format(tty=tty, event=event))
+            if holder == tty.sid:
+                # acquire the lock from ourselves!  We'll allow it
+                # (this is termed, "re-entrant locking").
+                log.debug('{tty.sid}] {event} is re-acquired!'
+                          .format(tty=tty, event=event))
+            elif is_lock_holder(holder):
+                log.debug('[{tty.sid}] {event} not acquired, '
+                          'held by active session: {holder}'
+                          .format(tty=tty, event=event, holder=holder))
             else:
                 # lock is held by a now-defunct session, re-acquired.
                 log.debug('[{tty.sid}] {event} re-acquiring stale lock, '
@@ -303,10 +564,9 @@ def handle_lock(locks, tty, event, data, tap_events, log):
                 del locks[event]
 
         # lock is not held, or release by previous block
-        if event not in locks:
+        if event not in locks or locks[event][1] == tty.sid:
             # acknowledge its requirement,
-            locks[event] = (time.time(), tty.sid)
-            tty.master_write.send((event, True,))
+            grant_lock(locks, event, tty.sid, log)
             if tap_events:
                 log.debug('[{tty.sid}] {event} granted lock.'
                           .format(tty=tty, event=event))
@@ -322,13 +582,21 @@ def handle_lock(locks, tty, event, data, tap_events, log):
                 # when the programmer knows the holder may fail to release,
                 # though this is not currently used in the demonstration
                 # system.
-                locks[event] = (time.time(), tty.sid)
                 log.warn('[{tty.sid}] {event} re-acquiring stale lock, '
                          'previously held active session {holder} after '
                          '{elapsed}s elapsed (stale={stale})'
                          .format(tty=tty, event=event, holder=holder,
                                  elapsed=elapsed, stale=stale))
-                tty.master_write.send((event, True,))
+                grant_lock(locks, event, tty.sid, log)
+
+            # queue for release by holder
+            elif method == 'wait':
+                if tap_events:
+                    log.debug('[{tty.sid}] {event} waiting for lock held '
+                              'by active session {holder}'
+                              .format(tty=tty, event=event, holder=holder))
+                LOCK_WAITERS.setdefault(event, collections.deque()).append(
+                    (tty.sid, time.time()))
 
             # signal busy with matching event, data=False
             else:
@@ -337,41 +605,123 @@ def handle_lock(locks, tty, event, data, tap_events, log):
                           '(stale={stale})'
                           .format(tty=tty, event=event, holder=holder,
                                   elapsed=elapsed, stale=stale))
+                _lock_stats(event)['rejected'] += 1
                 tty.master_write.send((event, False,))
 
+    elif method == 'cancel':
+        waiters = LOCK_WAITERS.get(event, ())
+        for waiter in [_waiter for _waiter in waiters
+                       if _waiter[0] == tty.sid]:
+            waiters.remove(waiter)
+            _lock_stats(event)['cancelled'] += 1
+            tty.master_write.send((event, False,))
+        # otherwise, the lock was granted before the request to cancel
+        # was received, and the session receives its grant.
+
     elif method == 'release':
         if event not in locks:
             log.error('[{tty.sid}] {event} lock failed to release, '
                       'not acquired.'.format(tty=tty, event=event))
         else:
-            del locks[event]
+            release_lock(locks, event, log)
             if tap_events:
                 log.debug('[{tty.sid}] {event} released lock.'
                           .format(tty=tty, event=event))
 
 
+def acquire_thread_lock(event, timeout=None, stale=None):
+    """
+    Acquire lock ``event`` for the calling thread of the engine process.
+
+    Threads of the engine, such as :mod:`x84.msgpoll`, share the lock table
+    of sessions, waiting in turn for any session or thread that holds it.
+    Arguments are those of :meth:`x84.bbs.dbproxy.DBProxy.acquire`.
+
+    :rtype: bool
+    :returns: whether the lock was acquired.
+    """
+    log = logging.getLogger('x84.engine')
+    holder, granted = _thread_holder(), threading.Event()
+    with LOCKS_MUTEX:
+        THREAD_WAITERS[holder] = granted
+        if event in LOCKS and LOCKS[event][1] != holder and (
+                is_lock_holder(LOCKS[event][1]) and (
+                    stale is None or
+                    time.time() - LOCKS[event][0] <= stale)):
+            # queue for release by holder
+            LOCK_WAITERS.setdefault(event, collections.deque()).append(
+                (holder, time.time()))
+        else:
+            grant_lock(LOCKS, event, holder, log)
+    if granted.wait(timeout):
+        return True
+    with LOCKS_MUTEX:
+        # timed out, withdraw request, unless granted in the meantime.
+        THREAD_WAITERS.pop(holder, None)
+        waiters = LOCK_WAITERS.get(event, ())
+        for waiter in [_waiter for _waiter in waiters
+                       if _waiter[0] == holder]:
+            waiters.remove(waiter)
+            _lock_stats(event)['cancelled'] += 1
+        return LOCKS.get(event, (None, None))[1] == holder
+
+
+def release_thread_lock(event):
+    """ Release lock ``event`` held by the calling thread of the engine. """
+    log = logging.getLogger('x84.engine')
+    with LOCKS_MUTEX:
+        if LOCKS.get(event, (None, None))[1] != _thread_holder():
+            log.error('{event} lock failed to release, not acquired.'
+                      .format(event=event))
+        else:
+            release_lock(LOCKS, event, log)
+
+
+def get_ready_terminals(ready_fds):
+    """
+    Return terminals whose ``master_read`` pipe is found in ``ready_fds``.
+
+    :rtype: list
+    :returns: terminals as tuples (session-id, tty).
+    """
+    terminals = []
+    for fd in ready_fds:
+        tty = find_tty_by_fd(fd)
+        if tty is not None and tty.master_fd == fd:
+            terminals.append((tty.sid, tty))
+    return terminals
+
+
 def session_recv(locks, terminals, log, tap_events):
     """
     Receive data waiting for terminal sessions.
 
-    All data received from subprocess is handled here.
+    All data received from subprocess is handled here.  Raw output
+    frames, pre-encoded by the session, are copied directly to the
+    client's send buffer; all other frames are unpickled as events.
     """
+    from x84.bbs.ipc import OUTPUT_BYTES
     for sid, tty in terminals:
         while tty.master_read.poll():
             try:
-                event, data = tty.master_read.recv()
+                frame = tty.master_read.recv_bytes()
+                if frame[:1] == OUTPUT_BYTES:
+                    tty.client.send_str(frame[1:])
+                    continue
+                event, data = pickle.loads(frame)
             except (EOFError, IOError) as err:
                 # sub-process unexpectedly closed
                 log.exception('master_read pipe: {0}'.format(err))
-                kill_session(tty.client, 'master_read pipe: {0}'.format(err))
+                kill_session(tty.client, 'master_read pipe: {0}'.format(err),
+                             grace=0)
                 break
-            except TypeError as err:
+            except (TypeError, pickle.UnpicklingError) as err:
                 log.exception('unpickling error: {0}'.format(err))
                 break
 
             # 'exit' event, unregisters client
             if event == 'exit':
-                kill_session(tty.client, 'client exit')
+                kill_session(tty.client, 'client exit', grace=0)
                 break
 
             # 'logger' event, prefix log message with handle and IP address
@@ -386,28 +736,26 @@ def session_recv(locks, terminals, log, tap_events):
 
             # 'remote-disconnect' event, hunt and destroy
             elif event == 'remote-disconnect':
-                for _sid, _tty in terminals:
-                    # data[0] is 'send-to' address.
-                    if data[0] == _sid:
-                        kill_session(
-                            tty.client, 'remote-disconnect by {0}'.format(sid))
-                        break
+                # data is 'send-to' address.
+                _tty = get_tty(data)
+                if _tty is not None:
+                    kill_session(
+                        _tty.client, 'remote-disconnect by {0}'.format(sid))
 
             # 'route': message passing directly from one session to another
             elif event == 'route':
                 if tap_events:
                     log.debug('route {0!r}'.format(data))
                 tgt_sid, send_event, send_val = data[0], data[1], data[2:]
-                for _sid, _tty in terminals:
-                    if tgt_sid == _sid:
-                        _tty.master_write.send((send_event, send_val))
-                        break
+                _tty = get_tty(tgt_sid)
+                if _tty is not None:
+                    _tty.master_write.send((send_event, send_val))
 
             # 'global': message broadcasting to all sessions
             elif event == 'global':
                 if tap_events:
                     log.debug('broadcast: {data!r}'.format(data=data))
-                for _sid, _tty in terminals:
+                for _sid, _tty in get_terminals():
                     if sid != _sid:
                         _tty.master_write.send((event, data,))
 
@@ -420,11 +768,22 @@ def session_recv(locks, terminals, log, tap_events):
 
             # 'db*': access DBProxy API for shared sqlitedict
             elif event.startswith('db'):
-                DBHandler(tty.master_write, event, data).start()
+                get_db_pool().submit(DBHandler(tty.master_write, event, data))
+
+            # 'node-allocate': lowest node number not in use, or None
+            elif event == 'node-allocate':
+                name, maximum = data
+                tty.master_write.send((event, allocate_node(
+                    tty, name, maximum)))
+
+            # 'node-release': node number no longer in use
+            elif event == 'node-release':
+                release_node(tty, *data)
 
             # 'lock': access fine-grained bbs-global locking
             elif event.startswith('lock'):
-                handle_lock(locks, tty, event, data, tap_events, log)
+                with LOCKS_MUTEX:
+                    handle_lock(locks, tty, event, data, tap_events, log)
 
             else:
                 log.error('[{tty.sid}] unhandled event, data: '
@@ -438,13 +797,13 @@ def _loop(servers):
     #         Too many local variables (24/15)
     from x84.bbs.ini import CFG
 
-    SELECT_POLL = 0.02  # polling time is 20ms
+    # polling time is 20ms, used only while data remains that could not
+    # be sent, or where the reactor is unable to poll session pipes.
+    SELECT_POLL = 0.02
 
     # WIN32 has no session_fds (multiprocess queues are not polled using
-    # select), use a persistently empty set; for WIN32, sessions are always
-    # polled for data at every loop.
+    # select), sessions are always polled for data at every loop.
     WIN32 = sys.platform.lower().startswith('win32')
-    session_fds = set()
 
     log = logging.getLogger('x84.engine')
 
@@ -453,7 +812,16 @@ def _loop(servers):
 
     tap_events = CFG.getboolean('session', 'tap_events')
     check_ban = get_fail2ban_function()
-    locks = dict()
+    locks = LOCKS
+
+    # server sockets are registered once, client sockets as they are
+    # accepted, and session pipes as their tty is registered.
+    reactor = get_reactor()
+    for server in servers:
+        reactor.register(server.server_socket.fileno())
+
+    idle_deadline, num_terms, pending_terms = 0, 0, []
+    pending_invalidations = False
 
     while True:
         # shutdown, close & delete inactive clients,
@@ -470,26 +838,35 @@ def _loop(servers):
                            if _thread.stopped][:]:
                 server.threads.remove(thread)
 
-        check_r = list()
-        for server in servers:
-            check_r.append(server.server_socket.fileno())
-            check_r.extend(server.client_fds())
-        if not WIN32:
-            # WIN32's IPC is not done using sockets, so it
-            # is not possible to use select.select() on them
-            session_fds = get_session_output_fds(servers)
-            check_r.extend(session_fds)
-
-        # We'd like to use timeout 'None', but the registration of
-        # a new client in terminal.start_process surprises us with new
-        # file descriptors for the session i/o.  Unless we loop for
-        # additional `session_fds', a connecting client would block.
+        # kick off idle users, only as often as the nearest timeout
+        # requires, or when sessions have been added or removed.
+        terms = get_terminals()
+        terms_changed = len(terms) != num_terms
+        if terms_changed or time.time() >= idle_deadline:
+            idle_deadline = check_idle(terms)
+            terms = get_terminals()
+            num_terms = len(terms)
+
+        # release locks held by sessions that have exited.
+        if terms_changed:
+            with LOCKS_MUTEX:
+                release_stale_locks(locks, log)
+
+        # block until any file descriptor is ready for reading, up to the
+        # nearest idle timeout when any sessions are connected.
+        timeout = None
+        if (pending_terms or pending_invalidations or WIN32 or
+                not reactor.can_block):
+            timeout = SELECT_POLL
+        elif num_terms or any(server.threads for server in servers):
+            timeout = max(0, idle_deadline - time.time())
+
         try:
-            ready_r, _, _ = select.select(check_r, [], [], SELECT_POLL)
-        except select.error as err:
+            ready_r = reactor.poll(timeout)
+        except (IOError, OSError, select.error) as err:
             # more than likely EBADF (9, 'Bad file descriptor'), it would seem
             # the socket we've just decided to poll has just gone bad.
-            log.debug('continue after select.error: {0}'.format(err))
+            log.debug('continue after poll error: {0}'.format(err))
             continue
 
         for fd in ready_r:
@@ -499,22 +876,34 @@ def _loop(servers):
                 accept(log, server, check_ban)
 
         # receive new data from tcp clients.
-        client_recv(servers, ready_r, log)
-        terms = get_terminals()
+        recv_terms = client_recv(servers, ready_r, log)
 
-        # receive new data from session terminals
-        if WIN32 or set(session_fds) & set(ready_r):
+        # receive new data from session terminals, WIN32 sessions
+        # are always polled.
+        ready_terms = (get_terminals() if WIN32
+                       else get_ready_terminals(ready_r))
+        if ready_terms:
             try:
-                session_recv(locks, terms, log, tap_events)
+                session_recv(locks, ready_terms, log, tap_events)
             except IOError as err:
                 # if the ipc closes while we poll, warn and continue
                 log.warn(err)
 
-        # send tcp data to clients
-        client_send(terms, log)
-
-        # send session data, poll for user-timeout and disconnect them
-        session_send(terms)
+        # send tcp data to clients: those that have received session output
+        # or telnet negotiation replies, or could not be sent in full before.
+        # When sessions are added or removed, all are tried, so that any
+        # data buffered during on-connect negotiation is delivered.
+        send_terms = dict(terms if terms_changed else pending_terms)
+        send_terms.update(ready_terms)
+        send_terms.update(recv_terms)
+        pending_terms = client_send(send_terms.items(), log)
+
+        # send session data
+        session_send(terms if terms_changed else recv_terms)
+
+        # send database cache invalidations, coalesced for each iteration.
+        with LOCKS_MUTEX:
+            pending_invalidations = send_invalidations(get_terminals())
 
 
 if __name__ == '__main__':
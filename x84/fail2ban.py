@@ -144,3 +144,8 @@ def get_fail2ban_function():
         return True
 
     return wrapper
+
+
+def is_banned(ip):
+    """ Whether ip address ``ip`` is currently banned. """
+    return BANNED_IP_LIST.get(ip, 0) > time.time()
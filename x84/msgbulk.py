@@ -0,0 +1,409 @@
+#!/usr/bin/env python2.7
+"""
+Bulk message import and export for x/84.
+
+Messages are exported to, and imported from, files of one JSON object of
+each message per line, such as the archives written by :mod:`x84.msgmaint`,
+optionally gzip-compressed, or standard mbox mail folders, by filename
+extension ``.mbox``.
+
+Messages are imported by transactions of many messages, and the thread
+and search indices are built once when all messages are imported, rather
+than as each message is saved.
+
+Usage::
+
+    python -m x84.msgbulk [--config <filepath>] export <filepath>
+    python -m x84.msgbulk [--config <filepath>] import <filepath>
+"""
+
+# std imports
+import email.header
+import email.mime.text
+import email.utils
+import collections
+import itertools
+import datetime
+import calendar
+import mailbox
+import logging
+import gzip
+import json
+import time
+import sys
+import os
+
+# local
+from . import cmdline
+
+#: number of messages of each transaction.
+BATCH_SIZE = 1000
+
+#: seconds between progress reports.
+REPORT_INTERVAL = 5
+
+
+def is_mbox(filepath):
+    """ Whether ``filepath`` is a mbox folder, by its filename extension. """
+    return filepath.lower().endswith('.mbox')
+
+
+def _open(filepath, mode):
+    """ Return file object of ``filepath``, gzip-compressed by extension. """
+    if filepath.lower().endswith('.gz'):
+        return gzip.open(filepath, mode)
+    return open(filepath, mode)
+
+
+def _decode_header(value):
+    """ Return unicode of rfc2047-encoded mail header ``value``. """
+    if not value:
+        return None
+    return unicode(email.header.make_header(
+        email.header.decode_header(value)))
+
+
+def _mbox_body(message):
+    """ Return unicode body of first text part of mail ``message``. """
+    for part in message.walk():
+        if part.get_content_maintype() == 'text':
+            payload = part.get_payload(decode=True) or b''
+            return payload.decode(part.get_content_charset() or 'utf8',
+                                  'replace')
+    return u''
+
+
+def _mbox_time(value):
+    """ Return UTC time string of mail ``Date`` header ``value``. """
+    parsed = email.utils.parsedate_tz(value) if value else None
+    if parsed is None:
+        return None
+    return datetime.datetime.utcfromtimestamp(
+        email.utils.mktime_tz(parsed)).isoformat(' ')
+
+
+def read_jsonl(filepath):
+    """ Generate message records of JSON lines file ``filepath``. """
+    fobj = _open(filepath, 'rb')
+    try:
+        for line in fobj:
+            if line.strip():
+                yield json.loads(line)
+    finally:
+        fobj.close()
+
+
+def read_mbox(filepath):
+    """
+    Generate message records of mbox folder ``filepath``.
+
+    Messages exported by :func:`write_mbox` retain their index, parent and
+    tags by headers ``X-Msg-Idx``, ``X-Parent`` and ``X-Tags``, messages of
+    any other mail system are related by headers ``Message-ID`` and
+    ``In-Reply-To``.
+    """
+    folder = mailbox.mbox(filepath, create=False)
+    try:
+        for message in folder:
+            date = _mbox_time(message['Date'])
+            tags = _decode_header(message['X-Tags'])
+            yield {u'idx': (message['X-Msg-Idx'] or
+                            message['Message-ID']),
+                   u'parent': (message['X-Parent'] or
+                               message['In-Reply-To']),
+                   u'author': _decode_header(message['From']),
+                   u'recipient': _decode_header(message['To']),
+                   u'subject': _decode_header(message['Subject']) or u'',
+                   u'tags': ([tag.strip() for tag in tags.split(u',')]
+                             if tags else None),
+                   u'ctime': date,
+                   u'stime': date,
+                   u'body': _mbox_body(message)}
+    finally:
+        folder.close()
+
+
+def write_jsonl(filepath, msgs):
+    """ Write ``msgs`` to JSON lines file ``filepath``. """
+    from x84.msgmaint import msg_to_dict
+    fobj = _open(filepath, 'wb')
+    try:
+        for msg in msgs:
+            fobj.write(json.dumps(msg_to_dict(msg)) + '\n')
+    finally:
+        fobj.close()
+
+
+def msg_to_mbox(msg):
+    """ Return message as :class:`mailbox.mboxMessage`. """
+    from x84.bbs.msgbase import to_utctime
+
+    def _header(value):
+        return email.header.Header(value or u'', 'utf-8').encode()
+
+    stime = calendar.timegm(time.strptime(
+        to_utctime(msg.stime), '%Y-%m-%d %H:%M:%S'))
+    message = mailbox.mboxMessage(email.mime.text.MIMEText(
+        (msg.body or u'').encode('utf8'), 'plain', 'utf-8'))
+    message.set_from((msg.author or u'nobody').encode('utf8')
+                     .replace(' ', '_'), time.gmtime(stime))
+    message['From'] = _header(msg.author)
+    if msg.recipient:
+        message['To'] = _header(msg.recipient)
+    message['Subject'] = _header(msg.subject)
+    message['Date'] = email.utils.formatdate(stime)
+    message['Message-ID'] = '<{0}@x84>'.format(msg.idx)
+    if msg.parent is not None:
+        message['In-Reply-To'] = '<{0}@x84>'.format(msg.parent)
+        message['X-Parent'] = '%d' % (msg.parent,)
+    message['X-Msg-Idx'] = '%d' % (msg.idx,)
+    message['X-Tags'] = _header(u', '.join(sorted(msg.tags)))
+    return message
+
+
+def write_mbox(filepath, msgs):
+    """ Write ``msgs`` to mbox folder ``filepath``. """
+    folder = mailbox.mbox(filepath)
+    folder.lock()
+    try:
+        for msg in msgs:
+            folder.add(msg_to_mbox(msg))
+        folder.flush()
+    finally:
+        folder.unlock()
+        folder.close()
+
+
+def dict_to_msg(record):
+    """
+    Return new :class:`~x84.bbs.msgbase.Msg` of message ``record``.
+
+    A record without any tags is tagged ``public``, unless addressed to
+    a recipient.  Its index and parent are not assigned.
+
+    :raises ValueError: private message without a recipient.
+    """
+    from x84.bbs.msgbase import Msg, to_localtime
+    msg = Msg(recipient=record.get(u'recipient'),
+              subject=record.get(u'subject') or u'',
+              body=record.get(u'body') or u'')
+    msg.author = record.get(u'author')
+    msg.tags = set(record.get(u'tags') or ())
+    if not msg.tags and not msg.recipient:
+        msg.tags.add(u'public')
+    elif u'public' not in msg.tags and not msg.recipient:
+        raise ValueError('private message without recipient: {0!r}'
+                         .format(record.get(u'subject')))
+    if record.get(u'stime'):
+        msg._stime = to_localtime(record[u'stime'])
+    else:
+        msg._stime = datetime.datetime.now()
+    msg._ctime = (to_localtime(record[u'ctime']) if record.get(u'ctime')
+                  else msg._stime)
+    return msg
+
+
+class Progress(object):
+
+    """ Periodic report of the number and rate of messages processed. """
+
+    def __init__(self, verb):
+        self.verb = verb
+        self.count = 0
+        self.stime = self.last = time.time()
+
+    def add(self, count):
+        """ Add ``count`` messages processed, reporting periodically. """
+        self.count += count
+        if time.time() - self.last >= REPORT_INTERVAL:
+            self.last = time.time()
+            elapsed = self.last - self.stime
+            logging.getLogger(__name__).info(
+                '{0} messages {1}, {2:0.1f}/s.'.format(
+                    self.count, self.verb, self.count / elapsed))
+
+
+def export_msgs(filepath):
+    """
+    Export all messages to ``filepath``.
+
+    :rtype: int
+    :returns: number of messages exported.
+    """
+    from x84.bbs.msgbase import MSGDB
+    from x84.bbs import DBProxy
+    log = logging.getLogger(__name__)
+    stime = time.time()
+    progress = Progress('exported')
+
+    def msgs():
+        db_msg = DBProxy(MSGDB)
+        indices = sorted(int(key) for key in db_msg.keys())
+        for pos in range(0, len(indices), BATCH_SIZE):
+            batch = db_msg.get_many(['%d' % (idx,) for idx in
+                                     indices[pos:pos + BATCH_SIZE]])
+            for key in sorted(batch, key=int):
+                yield batch[key]
+            progress.add(len(batch))
+
+    if is_mbox(filepath):
+        write_mbox(filepath, msgs())
+    else:
+        write_jsonl(filepath, msgs())
+    log.info('{0} messages exported to {1} in {2:0.2f}s.'
+             .format(progress.count, filepath, time.time() - stime))
+    return progress.count
+
+
+def import_msgs(records, batch_size=BATCH_SIZE):
+    """
+    Import messages of ``records``, dicts as returned by
+    :func:`x84.msgmaint.msg_to_dict`.
+
+    Messages are given new indices, and replies are related to their parent
+    by the index of the parent message within ``records``.  Each batch of
+    ``batch_size`` messages is stored in a single transaction, and added to
+    the unread index of users subscribed, relationships of parent and
+    children, private messages, and the thread and search indices are
+    updated once all messages are imported.
+
+    :rtype: list
+    :returns: indices of messages imported.
+    """
+    from x84.bbs.msgbase import (MSGDB, TAGDB, PRIVDB, SEARCHDB, THREADDB,
+                                 build_thread_index, get_search_keys,
+                                 index_unread_msgs)
+    from x84.bbs import DBProxy
+    log = logging.getLogger(__name__)
+    stime = time.time()
+    progress = Progress('imported')
+
+    db_msg, db_tag = DBProxy(MSGDB), DBProxy(TAGDB)
+
+    # new index of each message by its index of ``records``, and the parent
+    # of each reply not yet imported, by its index of ``records``.
+    new_idx, pending, imported = dict(), dict(), list()
+    privmsgs = collections.defaultdict(set)
+
+    records = iter(records)
+    while True:
+        batch = list(itertools.islice(records, batch_size))
+        if not batch:
+            break
+        # invalid records are skipped before indices are allocated.
+        msgs = []
+        for record in batch:
+            try:
+                msgs.append((record, dict_to_msg(record)))
+            except ValueError as err:
+                log.warn('record {0!r} skipped: {1}'
+                         .format(record.get(u'idx'), err))
+        if not msgs:
+            continue
+        first_idx = db_msg.next_index(len(msgs))
+        tagged = collections.defaultdict(list)
+        with db_msg.transaction() as txn:
+            for idx, (record, msg) in enumerate(msgs, first_idx):
+                msg.idx = idx
+                if record.get(u'idx') is not None:
+                    new_idx[record[u'idx']] = idx
+                parent = record.get(u'parent')
+                if new_idx.get(parent) not in (None, idx):
+                    msg.parent = new_idx[parent]
+                elif parent is not None:
+                    pending[idx] = parent
+                txn['%d' % (idx,)] = msg
+                txn.table('headers')['%d' % (idx,)] = msg.header
+                for tag in msg.tags:
+                    tagged[tag].append(idx)
+                if u'public' not in msg.tags:
+                    privmsgs[msg.recipient].add(idx)
+                imported.append(idx)
+        with db_tag.transaction() as txn:
+            for tag, members in tagged.items():
+                txn.index_update(tag, members)
+        index_unread_msgs([msg for _, msg in msgs])
+        progress.add(len(msgs))
+
+    # relate replies to parent messages imported after them, the parent
+    # of any others is not known.
+    resolved = dict((idx, new_idx[parent])
+                    for idx, parent in pending.items()
+                    if new_idx.get(parent) not in (None, idx))
+    related = sorted(resolved)
+    for pos in range(0, len(related), batch_size):
+        msgs = db_msg.get_many(['%d' % (idx,)
+                                for idx in related[pos:pos + batch_size]])
+        with db_msg.transaction() as txn:
+            for key, msg in msgs.items():
+                msg.parent = resolved[msg.idx]
+                txn[key] = msg
+                txn.table('headers')[key] = msg.header
+
+    if privmsgs:
+        with DBProxy(PRIVDB) as db_priv:
+            existing = db_priv.get_many(privmsgs.keys())
+            with db_priv.transaction() as txn:
+                for recipient, indices in privmsgs.items():
+                    txn[recipient] = existing.get(recipient, set()) | indices
+
+    if DBProxy(SEARCHDB, table='meta').get('indexed'):
+        # otherwise, the search index is built by init_databases.
+        db_search = DBProxy(SEARCHDB)
+        for pos in range(0, len(imported), batch_size):
+            keywords = collections.defaultdict(list)
+            for msg in db_msg.get_many(
+                    ['%d' % (idx,) for idx in
+                     imported[pos:pos + batch_size]]).values():
+                for key in get_search_keys(msg):
+                    keywords[key].append(msg.idx)
+            with db_search.transaction() as txn:
+                for key, members in keywords.items():
+                    txn.index_update(key, members)
+
+    if DBProxy(THREADDB, table='meta').get('indexed'):
+        # the thread index, and the replies of each message, are rebuilt,
+        # otherwise, they are built by init_databases.
+        build_thread_index(rebuild=True)
+
+    elapsed = time.time() - stime
+    log.info('{0} messages imported in {1:0.2f}s, {2:0.1f}/s.'
+             .format(len(imported), elapsed,
+                     len(imported) / max(elapsed, 0.001)))
+    return imported
+
+
+def main(arguments):
+    """ Import or export messages by program ``arguments``. """
+    if len(arguments) != 2 or arguments[0] not in ('import', 'export'):
+        sys.stderr.write('Usage: \n'
+                         '{0} [--config <filepath>] [--logger <filepath>] '
+                         '{{import,export}} <filepath>\n'
+                         .format(os.path.basename(sys.argv[0])))
+        return 1
+    command, filepath = arguments
+    if command == 'export':
+        export_msgs(filepath)
+    elif is_mbox(filepath):
+        import_msgs(read_mbox(filepath))
+    else:
+        import_msgs(read_jsonl(filepath))
+    return 0
+
+if __name__ == '__main__':
+    # as we are running outside of the 'engine' context, it is necessary
+    # for us to initialize the .ini configuration scheme so that the
+    # database path may be gathered.
+    import x84.bbs.ini
+    ARGUMENTS = []
+    x84.bbs.ini.init(*cmdline.parse_args(ARGUMENTS))
+
+    # database locks of this process are not those of the engine, refuse
+    # to modify the message base while the board is online.
+    from x84.db import lock_datapath
+    if not lock_datapath():
+        sys.exit('data folder is in use, such as by x84/engine.py.')
+
+    from x84.dbinit import init_databases
+    init_databases()
+    sys.exit(main(ARGUMENTS))
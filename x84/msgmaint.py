@@ -0,0 +1,241 @@
+#!/usr/bin/env python2.7
+""" Message base maintenance for x/84: retention, archiving and compaction. """
+
+# std imports
+import datetime
+import logging
+import gzip
+import json
+import time
+import os
+
+# local
+from . import cmdline
+
+
+def get_retention():
+    """
+    Return dict of retention policies, number of days by tag.
+
+    Configured by option ``retention`` of section ``[msg]``, a list of
+    ``tag:days``, such as ``x84net:90, public:365``.
+    """
+    from x84.bbs.ini import get_ini
+    log = logging.getLogger(__name__)
+
+    retention = dict()
+    for policy in filter(None, get_ini(section='msg', key='retention',
+                                       split=True)):
+        tag, _, days = policy.rpartition(':')
+        try:
+            retention[tag.strip()] = int(days)
+        except ValueError:
+            log.error('Invalid retention policy {0!r}, expected tag:days.'
+                      .format(policy))
+    return retention
+
+
+def get_expired(retention, now=None):
+    """
+    Return sorted list of indices of messages expired by ``retention``.
+
+    A message is expired when all of its tags have a retention policy,
+    and it is older than the longest of them.  Messages of any tag without
+    a policy are retained indefinitely.
+    """
+    from x84.bbs.msgbase import list_msgs, get_msg_headers
+    now = now or datetime.datetime.now()
+    candidates = list_msgs(tags=retention.keys()) if retention else set()
+    expired = list()
+    for header in get_msg_headers(sorted(candidates)):
+        tags = set(header['tags'])
+        if not tags or not tags.issubset(retention):
+            continue
+        days = max(retention[tag] for tag in tags)
+        if header['stime'] < now - datetime.timedelta(days=days):
+            expired.append(header['idx'])
+    return expired
+
+
+def msg_to_dict(msg):
+    """ Return message as a dict of JSON-serializable values. """
+    from x84.bbs.msgbase import to_utctime
+    return {u'idx': msg.idx,
+            u'author': msg.author,
+            u'recipient': msg.recipient,
+            u'parent': msg.parent,
+            u'subject': msg.subject,
+            u'tags': sorted(msg.tags),
+            u'ctime': to_utctime(msg.ctime),
+            u'stime': to_utctime(msg.stime),
+            u'body': msg.body}
+
+
+def archive_msgs(indices, archive_path):
+    """
+    Write messages of ``indices`` to a new compressed archive file.
+
+    The archive is a gzip-compressed file of one JSON object of each
+    message per line, named by the current time.
+
+    :rtype: str
+    :returns: filepath of archive written.
+    """
+    from x84.bbs.msgbase import MSGDB
+    from x84.bbs import DBProxy
+    if not os.path.isdir(archive_path):
+        os.makedirs(archive_path)
+    filepath = os.path.join(archive_path, 'msgbase-{0}.jsonl.gz'.format(
+        time.strftime('%Y%m%d-%H%M%S')))
+    db_msg = DBProxy(MSGDB)
+    archive = gzip.open(filepath, 'wb')
+    try:
+        for pos in range(0, len(indices), 100):
+            msgs = db_msg.get_many(['%d' % (idx,)
+                                    for idx in indices[pos:pos + 100]])
+            for key in sorted(msgs, key=int):
+                archive.write(json.dumps(msg_to_dict(msgs[key])) + '\n')
+    finally:
+        archive.close()
+    return filepath
+
+
+def purge_indices():
+    """
+    Remove messages no longer found from all message indices.
+
+    :rtype: int
+    :returns: number of index entries removed.
+    """
+    from x84.bbs.msgbase import (MSGDB, TAGDB, UNREADDB, SEARCHDB, THREADDB,
+                                 discard_thread)
+    from x84.bbs import DBProxy
+    existing = set(int(key) for key in DBProxy(MSGDB).keys())
+    num_removed = 0
+    for db_index in (DBProxy(TAGDB), DBProxy(UNREADDB), DBProxy(SEARCHDB),
+                     DBProxy(THREADDB, table='children')):
+        orphans = db_index.index_members() - existing
+        with db_index.transaction() as txn:
+            for idx in orphans:
+                txn.index_membership(idx, ())
+        num_removed += len(orphans)
+    for key in DBProxy(THREADDB, table='position').keys():
+        if int(key) not in existing:
+            discard_thread(int(key))
+            num_removed += 1
+    return num_removed
+
+
+def vacuum():
+    """ Rebuild database files of the message base. """
+    from x84.bbs.msgbase import (MSGDB, TAGDB, PRIVDB, UNREADDB,
+                                 SEARCHDB, THREADDB)
+    from x84.bbs import DBProxy
+    for schema in (MSGDB, TAGDB, PRIVDB, UNREADDB, SEARCHDB, THREADDB):
+        DBProxy(schema).vacuum()
+
+
+def do_maintenance():
+    """
+    Message base maintenance process.
+
+    Messages expired by retention policy are archived and deleted,
+    indices are purged of any messages no longer found, and the database
+    files are rebuilt.  Function is called periodically by
+    :func:`maintainer`.
+    """
+    from x84.bbs.ini import get_ini
+    from x84.bbs.msgbase import delete_msg
+    log = logging.getLogger(__name__)
+    stime = time.time()
+
+    expired = get_expired(get_retention())
+    if expired:
+        archive_path = get_ini(section='msg', key='archive_path')
+        if archive_path:
+            filepath = archive_msgs(expired, archive_path)
+            log.info('{0} messages archived to {1}.'
+                     .format(len(expired), filepath))
+        for idx in expired:
+            try:
+                delete_msg(idx)
+            except KeyError:
+                pass
+        log.info('{0} messages expired.'.format(len(expired)))
+
+    num_removed = purge_indices()
+    if num_removed:
+        log.info('{0} index entries of missing messages removed.'
+                 .format(num_removed))
+
+    if expired or num_removed:
+        # only compact the database files when rows were deleted.
+        vacuum()
+    log.info('message base maintenance completed in {0:0.2f}s.'
+             .format(time.time() - stime))
+
+
+def maintainer(interval):
+    """ Blocking function periodically maintains the message base. """
+    log = logging.getLogger(__name__)
+    while True:
+        time.sleep(interval)
+        try:
+            do_maintenance()
+        # pylint: disable=W0703
+        #         Catching too general exception
+        except Exception as err:
+            log.exception('exception in message base maintenance: {err}'
+                          .format(err=err))
+
+
+def main(background_daemon=True):
+    """
+    Entry point to configure and begin message base maintenance.
+
+    Called by x84/engine.py, function main() as unmanaged thread.
+
+    :param bool background_daemon: When True (default), this function returns
+                and maintenance is scheduled in an unmanaged, background
+                (daemon) thread.  Otherwise, maintenance is performed once.
+    :rtype: None
+    """
+    from threading import Thread
+    from x84.bbs.ini import get_ini
+
+    log = logging.getLogger(__name__)
+
+    interval = get_ini(section='msg',
+                       key='maintenance_interval',
+                       getter='getint')
+
+    if background_daemon:
+        t = Thread(target=maintainer, args=(interval,))
+        t.daemon = True
+        log.info('message base maintenance at {0}s intervals.'
+                 .format(interval))
+        t.start()
+    else:
+        do_maintenance()
+
+if __name__ == '__main__':
+    # perform message base maintenance once, outside of the 'engine'
+    # context, such as by cron(8) or when the board is offline.
+    #
+    # as we are running outside of the 'engine' context, it is necessary
+    # for us to initialize the .ini configuration scheme so that the
+    # database path and retention options may be gathered.
+    import x84.bbs.ini
+    x84.bbs.ini.init(*cmdline.parse_args())
+
+    # database locks of this process are not those of the engine, refuse
+    # to modify the message base while the board is online.
+    import sys
+    from x84.db import lock_datapath
+    if not lock_datapath():
+        sys.exit('data folder is in use, such as by x84/engine.py.')
+
+    from x84.dbinit import init_databases
+    init_databases()
+
+    main(background_daemon=False)
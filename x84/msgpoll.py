@@ -385,5 +385,15 @@ if __name__ == '__main__':
     import x84.bbs.ini
     x84.bbs.ini.init(*cmdline.parse_args())
 
+    # database locks of this process are not those of the engine, refuse
+    # to modify the message base while the board is online.
+    import sys
+    from x84.db import lock_datapath
+    if not lock_datapath():
+        sys.exit('data folder is in use, such as by x84/engine.py.')
+
+    from x84.dbinit import init_databases
+    init_databases()
+
     # do not execute message polling as a background thread.
     main(background_daemon=False)
@@ -0,0 +1,274 @@
+"""
+I/O readiness reactor for the x/84 engine.
+
+File descriptors of server sockets, client sockets and session pipes are
+registered once, when they are created (accept, :func:`register_tty`), and
+unregistered when they are destroyed, rather than re-building a list of
+all file descriptors for every iteration of the main event loop.
+
+The best available mechanism is chosen by :func:`get_reactor`: ``epoll``
+on linux, ``poll`` for other posix systems, and ``select`` otherwise.
+"""
+# std imports
+import logging
+import select
+import errno
+import sys
+import os
+
+#: singleton reactor of the engine process, see :func:`get_reactor`.
+REACTOR = None
+
+#: WIN32's IPC pipes cannot be polled, and it has no os.pipe() that
+#: may be used with select(), the event loop must poll at intervals.
+WIN32 = sys.platform.lower().startswith('win32')
+
+
+class BaseReactor(object):
+
+    """
+    Base class for I/O readiness reactors.
+
+    Derived classes implement :meth:`_register`, :meth:`_unregister` and
+    :meth:`_poll`.  A "self-pipe" is registered so that other threads may
+    interrupt a blocking call to :meth:`poll` by calling :meth:`wakeup`.
+    """
+
+    #: Whether :meth:`poll` may block indefinitely (timeout of ``None``).
+    #: When False, the caller must poll at intervals.
+    can_block = True
+
+    def __init__(self):
+        """ Class initializer. """
+        self.log = logging.getLogger(__name__)
+        self._fds = set()
+        self._wakeup_read, self._wakeup_write = None, None
+        if not WIN32:
+            import fcntl
+            self._wakeup_read, self._wakeup_write = os.pipe()
+            for fd in (self._wakeup_read, self._wakeup_write):
+                flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+                fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+            self._register(self._wakeup_read)
+        else:
+            self.can_block = False
+
+    def __len__(self):
+        return len(self._fds)
+
+    def __contains__(self, fd):
+        return fd in self._fds
+
+    def register(self, fd):
+        """
+        Register file descriptor ``fd`` for read-readiness.
+
+        Registering a file descriptor more than once is not an error,
+        and ``None`` (the value returned by a closed socket) is ignored.
+        """
+        if fd is None:
+            return
+        self._register(fd)
+        self._fds.add(fd)
+
+    def unregister(self, fd):
+        """ Unregister file descriptor ``fd``, if registered. """
+        if fd is None or fd not in self._fds:
+            return
+        self._fds.discard(fd)
+        try:
+            self._unregister(fd)
+        except (IOError, OSError, KeyError, ValueError) as err:
+            # the file descriptor has already been closed.
+            self.log.debug('unregister fd {0}: {1}'.format(fd, err))
+
+    def poll(self, timeout=None):
+        """
+        Return list of file descriptors ready for reading.
+
+        :param float timeout: seconds to wait, blocking indefinitely
+                              when ``None``.
+        :rtype: list
+        """
+        try:
+            ready_fds = self._poll(timeout)
+        except (IOError, OSError, select.error) as err:
+            if err.args[0] != errno.EINTR:
+                raise
+            return []
+        if self._wakeup_read in ready_fds:
+            ready_fds.remove(self._wakeup_read)
+            self._drain_wakeup()
+        return ready_fds
+
+    def wakeup(self):
+        """ Interrupt a blocking call to :meth:`poll` from another thread. """
+        if self._wakeup_write is None:
+            return
+        try:
+            os.write(self._wakeup_write, b'\x00')
+        except (IOError, OSError) as err:
+            # pipe is full, a wakeup is already pending.
+            if err.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def close(self):
+        """ Release all resources held by this reactor. """
+        for fd in (self._wakeup_read, self._wakeup_write):
+            if fd is not None:
+                os.close(fd)
+        self._wakeup_read, self._wakeup_write = None, None
+        self._fds.clear()
+
+    def _drain_wakeup(self):
+        """ Exhaust bytes written to self-pipe by :meth:`wakeup`. """
+        try:
+            while os.read(self._wakeup_read, 4096):
+                pass
+        except (IOError, OSError) as err:
+            if err.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def _register(self, fd):
+        """ Subclass and implement: register ``fd`` for reading. """
+        raise NotImplementedError()
+
+    def _unregister(self, fd):
+        """ Subclass and implement: unregister ``fd``. """
+        raise NotImplementedError()
+
+    def _poll(self, timeout):
+        """ Subclass and implement: return list of ready ``fds``. """
+        raise NotImplementedError()
+
+
+class EpollReactor(BaseReactor):
+
+    """ Reactor using linux ``epoll(7)``. """
+
+    def __init__(self):
+        """ Class initializer. """
+        self._epoll = select.epoll()
+        super(EpollReactor, self).__init__()
+
+    def _register(self, fd):
+        mask = select.EPOLLIN | select.EPOLLPRI
+        try:
+            self._epoll.register(fd, mask)
+        except (IOError, OSError) as err:
+            if err.errno != errno.EEXIST:
+                raise
+            self._epoll.modify(fd, mask)
+
+    def _unregister(self, fd):
+        self._epoll.unregister(fd)
+
+    def _poll(self, timeout):
+        if timeout is None:
+            timeout = -1
+        return [fd for fd, _ in self._epoll.poll(timeout)]
+
+    def close(self):
+        """ Release all resources held by this reactor. """
+        super(EpollReactor, self).close()
+        self._epoll.close()
+
+
+class PollReactor(BaseReactor):
+
+    """ Reactor using posix ``poll(2)``. """
+
+    def __init__(self):
+        """ Class initializer. """
+        self._poller = select.poll()
+        super(PollReactor, self).__init__()
+
+    def register(self, fd):
+        """
+        Register file descriptor ``fd`` for read-readiness.
+
+        A blocking call to :meth:`poll` by another thread is interrupted,
+        as a poll() already in progress does not observe new registrations.
+        """
+        super(PollReactor, self).register(fd)
+        self.wakeup()
+
+    def _register(self, fd):
+        self._poller.register(fd, select.POLLIN | select.POLLPRI)
+
+    def _unregister(self, fd):
+        self._poller.unregister(fd)
+
+    def _poll(self, timeout):
+        if timeout is not None:
+            timeout = int(timeout * 1000)
+        ready_fds = []
+        for fd, event in self._poller.poll(timeout):
+            if event & select.POLLNVAL:
+                # file descriptor was closed without being unregistered.
+                self.unregister(fd)
+                continue
+            ready_fds.append(fd)
+        return ready_fds
+
+
+class SelectReactor(BaseReactor):
+
+    """ Reactor using ``select(2)``, for systems without ``poll(2)``. """
+
+    def register(self, fd):
+        """
+        Register file descriptor ``fd`` for read-readiness.
+
+        A blocking call to :meth:`poll` by another thread is interrupted,
+        as a select() already in progress does not observe new registrations.
+        """
+        super(SelectReactor, self).register(fd)
+        self.wakeup()
+
+    def _register(self, fd):
+        pass
+
+    def _unregister(self, fd):
+        pass
+
+    def _poll(self, timeout):
+        check_r = list(self._fds)
+        if self._wakeup_read is not None:
+            check_r.append(self._wakeup_read)
+        try:
+            return select.select(check_r, [], [], timeout)[0]
+        except select.error as err:
+            if err.args[0] != errno.EBADF:
+                raise
+            # a file descriptor was closed without being unregistered,
+            # discover and discard it.
+            for fd in list(self._fds):
+                try:
+                    os.fstat(fd)
+                except OSError:
+                    self.unregister(fd)
+            return []
+
+
+def get_reactor():
+    """ Return singleton reactor, instantiating the best available kind. """
+    # pylint: disable=W0603
+    #         Using the global statement
+    global REACTOR
+    if REACTOR is None:
+        if hasattr(select, 'epoll'):
+            REACTOR = EpollReactor()
+        elif hasattr(select, 'poll') and not WIN32:
+            REACTOR = PollReactor()
+        else:
+            REACTOR = SelectReactor()
+        logging.getLogger(__name__).debug(
+            'using {0}'.format(REACTOR.__class__.__name__))
+    return REACTOR
+
+
+def wakeup():
+    """ Interrupt the engine's blocking poll, if a reactor is in use. """
+    if REACTOR is not None:
+        REACTOR.wakeup()
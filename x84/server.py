@@ -81,6 +81,7 @@ class BaseServer(object):
                     if client.recv_ready()]
 
         # given a list of ready_fds pairs, we return only clients with
-        # matching file descriptors.
-        return [client for client in self.clients.values()
-                if client.fileno() in ready_fds]
+        # matching file descriptors, which are also the dictionary keys
+        # of self.clients.
+        return [self.clients[fd] for fd in ready_fds
+                if fd in self.clients and self.clients[fd].is_active()]
@@ -13,6 +13,7 @@ import os
 
 # local
 from x84.bbs.exception import Disconnected
+from x84.auth import get_auth_pool
 from x84.bbs.userbase import (
     check_new_user,
     check_bye_user,
@@ -21,7 +22,7 @@ from x84.bbs.userbase import (
     check_user_pubkey,
 )
 
-from x84.terminal import spawn_client_session, on_naws
+from x84.terminal import spawn_client_session, on_naws, find_tty_by_fd
 from x84.client import BaseClient, BaseConnect
 from x84.server import BaseServer
 from x84.sftp import X84SFTPServer
@@ -133,6 +134,17 @@ class SshClient(BaseClient):
             self.send_buffer.fromstring(ready_bytes[sent:])
         return sent
 
+    def recv_fileno(self):
+        """
+        File descriptor polled by the engine for :meth:`socket_recv`.
+
+        The tcp socket is read by paramiko's transport thread, it is the
+        pipe of the session channel that becomes ready for reading.
+        """
+        if self.channel is None or self.kind == 'sftp':
+            return None
+        return self.channel.fileno()
+
     def recv_ready(self):
         """ Whether data is awaiting on the ssh channel.  """
         if self.channel is None or self.kind == 'sftp':
@@ -318,7 +330,8 @@ class SshSessionServer(paramiko.ServerInterface):
             self.log.info('any password accepted for system-enabled '
                           'account, {0!r}'.format(username))
             return paramiko.AUTH_SUCCESSFUL
-        if check_user_password(username, password):
+        if check_user_password(username, password,
+                               address=self.client.address_pair[0]):
             self.log.info('password accepted for user {0!r}.'.format(username))
             return paramiko.AUTH_SUCCESSFUL
 
@@ -441,6 +454,10 @@ class SshServer(BaseServer):
         self.log = logging.getLogger(__name__)
         self.config = config
         self.address = config.get('ssh', 'addr')
+
+        # password verification processes are forked before any threads
+        # are started, or sockets are bound.
+        get_auth_pool().start()
         self.port = config.getint('ssh', 'port')
 
         if self.config.has_option('ssh', 'HostKey'):
@@ -501,7 +518,20 @@ class SshServer(BaseServer):
         """
         Return a list of clients with data ready to be receive.
 
-        The ``ready_fds`` parameter is ignored by the SSH Server.
+        :param list ready_fds: file descriptors already known to be ready.
+                               The ssh channel file descriptors are not keys
+                               of ``self.clients``, they are found by their
+                               registered tty.
         """
-        return [client for client in self.clients.values()
-                if client.recv_ready()]
+        if ready_fds is None:
+            return [client for client in self.clients.values()
+                    if client.recv_ready()]
+
+        clients = []
+        for fd in ready_fds:
+            tty = find_tty_by_fd(fd)
+            if (tty is not None and tty.client_fd == fd and
+                    self.clients.get(tty.client.fileno()) is tty.client and
+                    tty.client.recv_ready()):
+                clients.append(tty.client)
+        return clients
@@ -1,12 +1,34 @@
 """ Terminal handler for x/84 """
+import cPickle as pickle
 import contextlib
+import threading
 import logging
 import codecs
+import select
+import heapq
+import time
 import sys
 from blessed import Terminal as BlessedTerminal
 
+#: registered :class:`TerminalProcess` instances, keyed by session-id.
 TERMINALS = dict()
 
+#: index of registered terminals, keyed by client instance.
+TERMINALS_BY_CLIENT = dict()
+
+#: index of registered terminals, keyed by file descriptor of both the
+#: client's socket (or channel) and the session's ``master_read`` pipe.
+TERMINALS_BY_FD = dict()
+
+#: node numbers by name, such as ``node`` for sessions, or the name of a
+#: door, as a dict of ``free``, a heap of numbers released, and ``next``,
+#: the lowest number never allocated, see :func:`allocate_node`.
+NODES = dict()
+
+#: seconds a disconnected session is given to exit, writing the attributes
+#: of its user, before its pipes are closed, see :func:`kill_session`.
+EXIT_GRACE = 10
+
 
 class Terminal(BlessedTerminal):
 
@@ -157,7 +179,7 @@ def determine_encoding(env):
     return env.get('encoding', fallback_encoding)
 
 
-def init_term(writer, env):
+def init_term(stream, env):
     """
     Determine the final TERM and encoding and return a Terminal.
 
@@ -166,15 +188,15 @@ def init_term(writer, env):
     terminal-type is of 'ansi' or 'ansi-bbs', then the cp437 encoding
     is assumed; otherwise 'utf8'.
 
-    A blessed-abstracted curses terminal is returned.
+    A blessed-abstracted curses terminal is returned, writing to
+    ``stream``, an instance of :class:`x84.bbs.ipc.IPCStream`.
     """
-    from x84.bbs.ipc import IPCStream
     from x84.bbs import get_ini
     log = logging.getLogger(__name__)
     env['TERM'] = translate_ttype(env.get('TERM', 'unknown'))
     env['encoding'] = determine_encoding(env)
     term = Terminal(kind=env['TERM'],
-                    stream=IPCStream(writer=writer),
+                    stream=stream,
                     rows=int(env.get('LINES', '24')),
                     columns=int(env.get('COLUMNS', '80')))
 
@@ -185,7 +207,7 @@ def init_term(writer, env):
         log.debug('terminal-type {0} failed, using {1} instead.'
                   .format(env['TERM'], termcap_unknown))
         term = Terminal(kind=termcap_unknown,
-                        stream=IPCStream(writer=writer),
+                        stream=stream,
                         rows=int(env.get('LINES', '24')),
                         columns=int(env.get('COLUMNS', '80')))
 
@@ -193,6 +215,68 @@ def init_term(writer, env):
     return term
 
 
+class SessionWriter(object):
+
+    """
+    Engine end of a session's ``master_write`` pipe.
+
+    Events are sent by the main loop, by threads of
+    :class:`x84.db.DBWorkerPool`, and by threads of the engine granting
+    locks: each event is written whole, while holding attribute ``lock``.
+    """
+
+    def __init__(self, conn):
+        """
+        Class constructor.
+
+        :param multiprocessing.Connection conn: write end of pipe.
+        """
+        self.conn = conn
+        self.lock = threading.RLock()
+
+    def send(self, obj):
+        """ Send ``obj``, blocking while the pipe is full. """
+        with self.lock:
+            self.conn.send(obj)
+
+    def try_send(self, obj):
+        """
+        Send ``obj`` only if it may be written without blocking.
+
+        The event is not sent when the pipe is full, when another thread
+        is sending, or when it is too large to be written atomically.
+
+        :rtype: bool
+        :returns: whether ``obj`` was sent.
+        """
+        from x84.reactor import WIN32
+        if WIN32:
+            # win32 pipes may not be polled by select.select()
+            self.send(obj)
+            return True
+        # equal to Connection.send(), which writes a 4-byte length header.
+        frame = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+        if len(frame) + 4 > select.PIPE_BUF:
+            return False
+        if not self.lock.acquire(False):
+            return False
+        try:
+            if not select.select([], [self.conn.fileno()], [], 0)[1]:
+                return False
+            self.conn.send_bytes(frame)
+            return True
+        finally:
+            self.lock.release()
+
+    def fileno(self):
+        """ Return file descriptor of pipe. """
+        return self.conn.fileno()
+
+    def close(self):
+        """ Close pipe. """
+        self.conn.close()
+
+
 class TerminalProcess(object):
 
     """
@@ -216,9 +300,25 @@ class TerminalProcess(object):
         from x84.bbs import get_ini
         self.client = client
         self.sid = sid
-        (self.master_write, self.master_read) = master_pipes
+        (master_write, self.master_read) = master_pipes
+        self.master_write = SessionWriter(master_write)
         self.timeout = get_ini('system', 'timeout') or 0
 
+        # node numbers allocated by this session, as (name, node).
+        self.nodes = set()
+
+        # database keys written, not yet sent as ``db-invalidate``, as a
+        # set of keys by (schema, table), or None for the entire table.
+        self.invalidations = dict()
+
+        # time by which a disconnected session must exit, see kill_session().
+        self.exit_deadline = None
+
+        # file descriptors are recorded, as they are no longer available
+        # from the socket or pipe once closed.
+        self.client_fd = client.recv_fileno()
+        self.master_fd = self.master_read.fileno()
+
 
 def flush_queue(queue):
     """
@@ -238,15 +338,37 @@ def flush_queue(queue):
 
 
 def register_tty(tty):
-    """ Register a :class:`TerminalProcess` instance. """
+    """
+    Register a :class:`TerminalProcess` instance.
+
+    The session's ``master_read`` pipe, and the client's receiving file
+    descriptor (which, for ssh, only now exists), are registered with the
+    engine's reactor.
+    """
+    from x84.reactor import get_reactor, WIN32
     log = logging.getLogger(__name__)
     log.debug('[{tty.sid}] registered tty'.format(tty=tty))
     TERMINALS[tty.sid] = tty
+    TERMINALS_BY_CLIENT[tty.client] = tty
+    for fd in (tty.client_fd, tty.master_fd):
+        if fd is not None:
+            TERMINALS_BY_FD[fd] = tty
+    reactor = get_reactor()
+    reactor.register(tty.client_fd)
+    if not WIN32:
+        # WIN32's IPC is not done using sockets, so it
+        # is not possible to use select.select() on them
+        reactor.register(tty.master_fd)
 
 
 def unregister_tty(tty):
     """ Unregister a :class:`TerminalProcess` instance. """
+    from x84.reactor import get_reactor
     try:
+        # file descriptors must be unregistered before they are closed:
+        # forked sessions hold duplicates, and epoll(7) would otherwise
+        # continue to report the now-closed file descriptor.
+        get_reactor().unregister(tty.master_fd)
         flush_queue(tty.master_read)
         tty.master_read.close()
         tty.master_write.close()
@@ -256,37 +378,102 @@ def unregister_tty(tty):
     if tty.client.active:
         # signal tcp socket to close
         tty.client.deactivate()
+    for fd in (tty.client_fd, tty.master_fd):
+        if TERMINALS_BY_FD.get(fd) is tty:
+            del TERMINALS_BY_FD[fd]
+    if TERMINALS_BY_CLIENT.get(tty.client) is tty:
+        del TERMINALS_BY_CLIENT[tty.client]
+    for name, node in list(tty.nodes):
+        release_node(tty, name, node)
     del TERMINALS[tty.sid]
 
 
+def allocate_node(tty, name=u'node', maximum=None):
+    """
+    Allocate lowest node number of ``name`` not in use, for session ``tty``.
+
+    Node numbers begin at 1, and are released by :func:`release_node`, or
+    when the session is unregistered by :func:`unregister_tty`.
+
+    :param int maximum: greatest node number that may be allocated.
+    :rtype: int or None
+    :returns: node number, or None when all nodes are in use.
+    """
+    nodes = NODES.setdefault(name, dict(free=[], next=1))
+    if nodes['free'] and (maximum is None or nodes['free'][0] <= maximum):
+        node = heapq.heappop(nodes['free'])
+    elif maximum is None or nodes['next'] <= maximum:
+        node = nodes['next']
+        nodes['next'] += 1
+    else:
+        return None
+    tty.nodes.add((name, node))
+    return node
+
+
+def release_node(tty, name, node):
+    """ Release node number ``node`` of ``name`` held by session ``tty``. """
+    if (name, node) in tty.nodes:
+        tty.nodes.remove((name, node))
+        heapq.heappush(NODES[name]['free'], node)
+
+
 def get_terminals():
     """ Returns a list of all terminals as tuples (session-id, ttys). """
     return TERMINALS.items()
 
 
+def get_tty(sid):
+    """ Given a session-id, return a matching tty, or None. """
+    return TERMINALS.get(sid)
+
+
 def find_tty(client):
     """ Given a client, return a matching tty, or None if not registered. """
-    try:
-        return next(tty for _, tty in get_terminals() if client == tty.client)
-    except StopIteration:
-        pass
+    return TERMINALS_BY_CLIENT.get(client)
 
 
-def kill_session(client, reason='killed'):
-    """ Given a client, shutdown its socket and signal subprocess exit. """
+def find_tty_by_fd(fd):
+    """
+    Given a file descriptor, return a matching tty, or None.
+
+    The file descriptor may be that of the client (socket, or ssh channel),
+    or of the session's ``master_read`` pipe, as recorded by attributes
+    ``client_fd`` and ``master_fd`` of :class:`TerminalProcess`.
+    """
+    return TERMINALS_BY_FD.get(fd)
+
+
+def kill_session(client, reason='killed', grace=EXIT_GRACE):
+    """
+    Given a client, shutdown its socket and signal subprocess exit.
+
+    The session is sent :class:`~x84.bbs.exception.Disconnected`, and its
+    database requests are served until it exits, so that the attributes of
+    its user are written, or until ``grace`` seconds have elapsed, as
+    checked by :func:`x84.engine.check_idle`.  A ``grace`` of ``0``
+    unregisters the session immediately.
+    """
     from x84.bbs.exception import Disconnected
+    from x84.reactor import get_reactor
+    reactor = get_reactor()
+    reactor.unregister(client.fileno())
+    reactor.unregister(client.recv_fileno())
     client.shutdown()
 
     log = logging.getLogger(__name__)
     tty = find_tty(client)
     if tty is not None:
-        try:
-            tty.master_write.send(('exception', Disconnected(reason),))
-        except (EOFError, IOError):
-            pass
-        log.info('[{tty.sid}] goodbye: {reason}'
-                 .format(tty=tty, reason=reason))
-        unregister_tty(tty)
+        if tty.exit_deadline is None:
+            try:
+                tty.master_write.send(('exception', Disconnected(reason),))
+            except (EOFError, IOError):
+                grace = 0
+            log.info('[{tty.sid}] goodbye: {reason}'
+                     .format(tty=tty, reason=reason))
+            tty.exit_deadline = time.time() + grace
+        if not grace:
+            unregister_tty(tty)
 
 
 def start_process(sid, env, CFG, child_pipes, kind, addrport,
@@ -311,7 +498,7 @@ def start_process(sid, env, CFG, child_pipes, kind, addrport,
     #         Too many arguments (8/5)
     #         Too many local variables (16/15)
     import x84.bbs.ini
-    from x84.bbs.ipc import make_root_logger
+    from x84.bbs.ipc import make_root_logger, IPCStream
     from x84.bbs.session import Session
     from x84.bbs.exception import Disconnected
 
@@ -320,7 +507,11 @@ def start_process(sid, env, CFG, child_pipes, kind, addrport,
     # sending to child process
     x84.bbs.ini.CFG = CFG
 
-    (writer, _) = child_pipes
+    # all events are sent through a buffered output stream, so that
+    # screen output is coalesced, yet remains ordered with other events.
+    (writer, reader) = child_pipes
+    writer = IPCStream(writer=writer, escape_iac=kind == 'telnet')
+    child_pipes = (writer, reader)
 
     # remove any existing log handlers in child process and replace
     # with a new root log handler that sends to x84.bbs.engine over IPC.
@@ -329,7 +520,7 @@ def start_process(sid, env, CFG, child_pipes, kind, addrport,
     # instantiate and create a new terminal instance given the value
     # of env[TERM], negotiated by protocol. May modify the value of
     # env[TERM] by function translate_ttype
-    terminal = init_term(writer=writer, env=env)
+    terminal = init_term(stream=writer, env=env)
 
     try:
         # instantiate and run session
@@ -397,10 +588,9 @@ def on_naws(client):
 
     This is ultimately handled by :meth:`x84.bbs.session.Session.buffer_event`.
     """
-    for _, tty in get_terminals():
-        if client == tty.client:
-            columns = int(client.env['COLUMNS'])
-            rows = int(client.env['LINES'])
-            tty.master_write.send(('refresh', ('resize', (columns, rows),)))
-            break
+    tty = find_tty(client)
+    if tty is not None:
+        columns = int(client.env['COLUMNS'])
+        rows = int(client.env['LINES'])
+        tty.master_write.send(('refresh', ('resize', (columns, rows),)))
     return True
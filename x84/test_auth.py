@@ -0,0 +1,100 @@
+""" Tests of password verification of x/84, :mod:`x84.auth`. """
+# std imports
+import threading
+import time
+
+# 3rd party
+import pytest
+
+# local
+from x84 import auth, fail2ban
+
+
+@pytest.fixture
+def password(datapath, monkeypatch):
+    """ Encrypted password ``secret``, by the ``plaintext`` digest. """
+    import x84.bbs.ini
+    import x84.bbs.userbase
+    x84.bbs.ini.CFG.set('system', 'password_digest', 'plaintext')
+    monkeypatch.setattr(x84.bbs.userbase, 'FN_PASSWORD_DIGEST', None)
+    return x84.bbs.userbase.get_digestpw()(u'secret')
+
+
+@pytest.fixture
+def pool():
+    """ Instance of :class:`x84.auth.AuthPool`, terminated when finished. """
+    instances = []
+
+    def make_pool(**kwargs):
+        instance = auth.AuthPool(**kwargs)
+        instance.start()
+        instances.append(instance)
+        return instance
+    yield make_pool
+    for instance in instances:
+        instance.pool.terminate()
+
+
+def test_verify(pool, password):
+    """ Passwords are verified by a worker process. """
+    instance = pool(num_workers=1)
+    assert instance.verify('127.0.0.1', password, u'secret')
+    assert not instance.verify('127.0.0.1', password, u'wrong')
+    assert instance.pending == {}
+
+
+def test_verify_banned(pool, password, monkeypatch):
+    """ Passwords of a banned ip address are not verified. """
+    monkeypatch.setitem(fail2ban.BANNED_IP_LIST, '127.0.0.2',
+                        time.time() + 60)
+    assert not pool(num_workers=1).verify('127.0.0.2', password, u'secret')
+
+
+def test_verify_per_ip(pool, password, monkeypatch):
+    """ Verifications beyond ``per_ip`` pending of an address fail. """
+    instance = pool(num_workers=1, per_ip=1)
+    monkeypatch.setitem(instance.pending, '127.0.0.1', 1)
+    assert not instance.verify('127.0.0.1', password, u'secret')
+    assert instance.verify('127.0.0.3', password, u'secret')
+    assert instance.pending == {'127.0.0.1': 1}
+
+
+def test_verify_max_pending(pool, password, monkeypatch):
+    """ Verifications beyond ``max_pending`` of all addresses fail. """
+    instance = pool(num_workers=1, max_pending=2)
+    monkeypatch.setitem(instance.pending, '127.0.0.1', 1)
+    monkeypatch.setitem(instance.pending, '127.0.0.2', 1)
+    assert not instance.verify('127.0.0.3', password, u'secret')
+    instance.release('127.0.0.2')
+    assert instance.verify('127.0.0.3', password, u'secret')
+
+
+def test_verify_timeout(pool, password):
+    """ A timed out verification fails, and is no longer pending. """
+    instance = pool(num_workers=1, per_ip=1, timeout=0.001)
+    checked = []
+    instance.check_ban = checked.append
+    # occupy the only worker process.
+    instance.pool.apply_async(time.sleep, (0.5,))
+    assert not instance.verify('127.0.0.1', password, u'secret')
+    assert instance.pending == {}
+    assert checked == ['127.0.0.1']
+    instance.timeout = 5
+    assert instance.verify('127.0.0.1', password, u'secret')
+    assert instance.pending == {}
+
+
+def test_verify_concurrent(pool, password):
+    """ Concurrent verifications of an address are limited by ``per_ip``. """
+    instance = pool(num_workers=1, per_ip=2)
+    # occupy the only worker process, until all threads have begun.
+    instance.pool.apply_async(time.sleep, (0.5,))
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        instance.verify('127.0.0.1', password, u'secret')))
+        for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(results) == [False, True, True]
@@ -0,0 +1,323 @@
+""" Tests of database functions of x/84, :mod:`x84.db`. """
+# std imports
+import threading
+import pickle
+import time
+import os
+
+# 3rd party
+import pytest
+
+# local
+from x84 import db
+
+
+@pytest.fixture
+def dictdb(datapath):
+    """ Table ``unnamed`` of a database of the temporary data folder. """
+    dictdb = db.get_database(os.path.join(datapath, 'test.sqlite3'),
+                             'unnamed')
+    yield dictdb
+    dictdb.close()
+
+
+class FakeQueue(object):
+
+    """ Session queue of :class:`x84.db.DBHandler`, recording replies. """
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, obj):
+        # record invalidations pending as each reply is sent.
+        self.sent.append((obj, list(db.INVALIDATIONS or ())))
+
+
+class FakeHandler(object):
+
+    """ Command of :class:`x84.db.DBWorkerPool`, run until released. """
+
+    def __init__(self, cmd='__setitem__', schema='test', failure=None):
+        self.cmd, self.schema = cmd, schema
+        self.failure = failure
+        self.started, self.released = threading.Event(), threading.Event()
+        self.rejected = None
+
+    @property
+    def is_read(self):
+        return self.cmd in db.READ_METHODS
+
+    def run(self):
+        self.started.set()
+        self.released.wait(5)
+        if self.failure is not None:
+            raise self.failure
+
+    def reject(self, err):
+        self.rejected = err
+
+
+def wait_for(predicate, timeout=5):
+    """ Wait until ``predicate()`` is true, returning its value. """
+    stime = time.time()
+    while not predicate() and time.time() - stime < timeout:
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_codec_roundtrip():
+    """ Values are compressed only when large, and always decoded. """
+    codec = db.ValueCodec(threshold=64)
+    small, large = {u'key': 1}, u'x' * 1024
+    assert bytes(codec.encode(small))[:1] == b'\x80'
+    assert bytes(codec.encode(large))[:1] == db.ValueCodec.ZLIB
+    assert codec.decode(codec.encode(small)) == small
+    assert codec.decode(codec.encode(large)) == large
+    # values of earlier pickle protocols, as previously stored.
+    assert codec.decode(pickle.dumps(small, 0)) == small
+
+
+def test_next_index(dictdb):
+    """ Indices follow previous keys, allocated in blocks, never re-used. """
+    dictdb['7'] = u'previously stored'
+    assert dictdb.next_index() == 8
+    assert dictdb.next_index(count=10) == 9
+    assert dictdb.next_index() == 19
+    del dictdb['7']
+    assert dictdb.next_index() == 20
+
+
+def test_index_table(dictdb):
+    """ Index members are queried by union, intersection and rank. """
+    dictdb.index_update(u'a', [1, 2, 3])
+    dictdb.index_update(u'b', [3, 4])
+    dictdb.index_add(u'c', 5)
+    assert dictdb.index_members([u'a', u'b']) == set([1, 2, 3, 4])
+    assert dictdb.index_members([u'a', u'b'], match_all=True) == set([3])
+    assert dictdb.index_members([u'a'], exclude=[u'b']) == set([1, 2])
+    assert dictdb.index_count([u'a', u'b']) == 4
+    assert dictdb.index_count([]) == 0
+    assert dictdb.index_counts([u'a', u'b']) == {u'a': 3, u'b': 2}
+    assert dictdb.index_search([u'a', u'b']) == [(3, 2), (4, 1), (2, 1),
+                                                 (1, 1)]
+    assert dictdb.index_search([u'a'], within=[u'b']) == [(3, 1)]
+
+    dictdb.index_membership(3, [u'c'])
+    assert dictdb.index_members([u'c']) == set([3, 5])
+    assert sorted(dictdb.index_keys()) == [u'a', u'b', u'c']
+    dictdb.index_difference_update(u'a', [1, 2])
+    dictdb.index_discard(u'c', 5)
+    assert dictdb.index_counts() == {u'b': 1, u'c': 1}
+    dictdb.index_update(u'b2', [3, 4])
+    dictdb.index_difference_update(u'b', [4], prefix=True)
+    assert dictdb.index_counts() == {u'b2': 1, u'c': 1}
+
+
+def test_index_table_migration(dictdb):
+    """ Set values of a table populate its index table, once created. """
+    dictdb[u'a'] = set([1, 2])
+    dictdb[u'b'] = set([2])
+    # reads, which may be concurrent, do not create the index table.
+    assert dictdb.index_counts() == {}
+    assert dictdb.get_index_table() is None
+    dictdb.create_index_table()
+    assert dictdb.index_counts() == {u'a': 2, u'b': 1}
+
+
+def test_field_table_migration(dictdb):
+    """ Dict values of a table are moved to its field table, once created. """
+    dictdb[u'bob'] = {u'expert': True, u'calls': 3}
+    assert dictdb.field_get_many(u'bob') == {}
+    assert dictdb.get_field_table() is None
+    dictdb.create_field_table()
+    assert dictdb.field_get_many(u'bob') == {u'expert': True, u'calls': 3}
+    assert u'bob' not in dictdb
+
+    dictdb.field_set(u'bob', u'calls', 4)
+    assert dictdb.field_get(u'bob', u'calls') == 4
+    assert dictdb.field_get(u'bob', u'missing', 0) == 0
+    assert dictdb.field_get_many(u'bob', [u'calls']) == {u'calls': 4}
+    assert dictdb.field_del(u'bob', u'expert')
+    assert not dictdb.field_del(u'bob', u'expert')
+    assert dictdb.field_get_many(u'bob') == {u'calls': 4}
+
+
+def test_transaction_rollback(dictdb):
+    """ A failed transaction writes none of its operations. """
+    with pytest.raises(KeyError):
+        dictdb.transaction([('unnamed', '__setitem__', (u'a', 1)),
+                            ('other', '__setitem__', (u'b', 2)),
+                            ('unnamed', '__delitem__', (u'missing',))])
+    assert u'a' not in dictdb
+    assert dictdb.transaction([('unnamed', '__setitem__', (u'a', 1)),
+                               ('unnamed', 'has_key', (u'a',))]) == [
+                                   None, True]
+
+
+def test_reader_not_blocked_by_writer(dictdb):
+    """ Threads read while another thread holds a write transaction. """
+    dictdb[u'key'] = 1
+    begun, done = threading.Event(), threading.Event()
+
+    def write():
+        with dictdb.conn.transaction():
+            dictdb[u'key'] = 2
+            begun.set()
+            done.wait(5)
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    try:
+        assert begun.wait(5)
+        # uncommitted writes of another thread are not read.
+        assert dictdb[u'key'] == 1
+    finally:
+        done.set()
+        thread.join()
+    assert dictdb[u'key'] == 2
+
+
+def test_get_invalidations():
+    """ Keys modified by a command, or ``None`` for any key of its table. """
+    assert db.get_invalidations('msgbase', 'unnamed', 'get', (u'1',)) == []
+    assert db.get_invalidations('msgbase', 'unnamed', '__setitem__',
+                                (u'1', None)) == [
+                                    ('msgbase', 'unnamed', u'1')]
+    assert db.get_invalidations('msgbase', 'unnamed', 'update', ([],)) == [
+        ('msgbase', 'unnamed', None)]
+    assert db.get_invalidations(
+        'msgbase', 'unnamed', 'transaction', ([
+            ('unnamed', '__setitem__', (u'1', None)),
+            ('headers', 'get', (u'1',)),
+            ('headers', '__delitem__', (u'2',))],)) == [
+                ('msgbase', 'unnamed', u'1'), ('msgbase', 'headers', u'2')]
+
+
+def test_handler_invalidations_before_reply(datapath, monkeypatch):
+    """ Invalidations of a write are recorded before its reply is sent. """
+    monkeypatch.setattr(db, 'INVALIDATIONS', None)
+    db.enable_invalidations()
+    queue = FakeQueue()
+    db.DBHandler(queue, 'db-test', ('unnamed', '__setitem__',
+                                    (u'key', 1))).run()
+    assert queue.sent == [(('db-test', None), [('test', 'unnamed', u'key')])]
+    assert db.pop_invalidations() == [('test', 'unnamed', u'key')]
+
+    # reads are not recorded.
+    queue = FakeQueue()
+    db.DBHandler(queue, 'db-test', ('unnamed', 'get', (u'key',))).run()
+    assert queue.sent == [(('db-test', 1), [])]
+
+
+def test_handler_invalid_method(datapath):
+    """ An invalid method is sent to the session as an exception. """
+    queue = FakeQueue()
+    db.DBHandler(queue, 'db-test', ('unnamed', 'missing', ())).run()
+    (event, err), _ = queue.sent[0]
+    assert event == 'exception'
+    assert isinstance(err, AssertionError)
+
+
+def test_handler_iterable(datapath):
+    """ Iterable results are only retrieved by command ``page``. """
+    queue = FakeQueue()
+    db.DBHandler(queue, 'db=test', ('unnamed', 'iterkeys', ())).run()
+    db.DBHandler(queue, 'db=test', ('unnamed', 'page', ('iterkeys',))).run()
+    (event, err), _ = queue.sent[0]
+    assert event == 'exception'
+    assert isinstance(err, AssertionError)
+    assert queue.sent[1][0] == ('db=test', (None, []))
+
+
+def test_worker_pool_busy():
+    """ Commands beyond ``max_pending`` are rejected as busy. """
+    from x84.bbs.exception import DatabaseBusy
+    pool = db.DBWorkerPool(num_workers=1, max_pending=1)
+    running, queued, rejected = FakeHandler(), FakeHandler(), FakeHandler()
+    assert pool.submit(running)
+    assert running.started.wait(5)
+    assert pool.submit(queued)
+    assert not pool.submit(rejected)
+    assert isinstance(rejected.rejected, DatabaseBusy)
+    running.released.set()
+    queued.released.set()
+    assert wait_for(lambda: pool.get_stats()['completed'] == 2)
+    stats = pool.get_stats()
+    assert (stats['submitted'], stats['rejected'], stats['pending']) == (
+        2, 1, 0)
+
+
+def test_worker_pool_ordering():
+    """ Reads of a schema are concurrent, a write waits for them. """
+    pool = db.DBWorkerPool(num_workers=3)
+    reads = [FakeHandler(cmd='get'), FakeHandler(cmd='get')]
+    write = FakeHandler()
+    for handler in reads + [write]:
+        pool.submit(handler)
+    assert all(handler.started.wait(5) for handler in reads)
+    assert not write.started.wait(0.1)
+    for handler in reads:
+        handler.released.set()
+    assert write.started.wait(5)
+    write.released.set()
+    assert wait_for(lambda: pool.get_stats()['completed'] == 3)
+
+
+def test_worker_pool_failure():
+    """ A command raising an exception is counted, the worker continues. """
+    pool = db.DBWorkerPool(num_workers=1)
+    failed, handler = FakeHandler(failure=ValueError()), FakeHandler()
+    failed.released.set()
+    handler.released.set()
+    pool.submit(failed)
+    pool.submit(handler)
+    assert wait_for(lambda: pool.get_stats()['completed'] == 2)
+    assert pool.get_stats()['failed'] == 1
+
+
+def lock_other():
+    """ Return whether another process acquires the data folder lock. """
+    import multiprocessing
+    reader, writer = multiprocessing.Pipe(duplex=False)
+    proc = multiprocessing.Process(
+        target=lambda: writer.send(db.lock_datapath()))
+    proc.start()
+    proc.join()
+    return reader.recv()
+
+
+def test_lock_datapath(datapath, monkeypatch):
+    """ The data folder is locked exclusively of other processes. """
+    monkeypatch.setattr(db, 'DATAPATH_LOCK', None)
+    assert db.lock_datapath()
+    try:
+        assert not lock_other()
+        assert db.lock_datapath()
+    finally:
+        db.DATAPATH_LOCK.close()
+    assert lock_other()
+
+
+def test_lock_datapath_fork(datapath, monkeypatch):
+    """ Forked children do not hold the lock once their parent exits. """
+    import multiprocessing
+    monkeypatch.setattr(db, 'DATAPATH_LOCK', None)
+    assert db.lock_datapath()
+    done = multiprocessing.Event()
+    child = multiprocessing.Process(target=done.wait, args=(5,))
+    child.start()
+    try:
+        db.DATAPATH_LOCK.close()
+        assert child.is_alive()
+        assert lock_other()
+    finally:
+        done.set()
+        child.join()
+
+
+def test_items_range(dictdb):
+    """ Items of a range of keys are returned in order of key. """
+    for key in (u'b/2', u'a', u'b', u'b/1', u'c'):
+        dictdb[key] = key.upper()
+    assert dictdb.items_range(u'b', u'b0') == [
+        (u'b', u'B'), (u'b/1', u'B/1'), (u'b/2', u'B/2')]
@@ -0,0 +1,22 @@
+""" Tests of database initialization of x/84, :mod:`x84.dbinit`. """
+# local
+from x84 import db
+from x84.dbinit import init_databases
+
+
+def test_init_databases(datapath):
+    """ Values of earlier revisions are moved to index and field tables. """
+    from x84.bbs.msgbase import TAGDB
+    from x84.bbs.userbase import USERDB
+    db_tags = db.get_database(db.get_db_filepath(TAGDB), 'unnamed')
+    db_attrs = db.get_database(db.get_db_filepath(USERDB), 'attrs')
+    try:
+        db_tags[u'public'] = set([1, 2])
+        db_attrs[u'bob'] = {u'calls': 3}
+        init_databases()
+        assert db_tags.index_members([u'public']) == set([1, 2])
+        assert db_attrs.field_get(u'bob', u'calls') == 3
+        assert u'bob' not in db_attrs
+    finally:
+        db_tags.close()
+        db_attrs.close()
@@ -0,0 +1,269 @@
+""" Tests of locks and sessions of the x/84 engine, :mod:`x84.engine`. """
+# std imports
+import threading
+import logging
+import time
+
+# 3rd party
+import pytest
+
+# local
+from x84 import engine, terminal, db
+
+LOCK_EVENT = u'lock-db/test/unnamed'
+
+
+class FakeWriter(object):
+
+    """ Session end of ``master_write`` pipe, recording events sent. """
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, obj):
+        self.sent.append(obj)
+
+    def try_send(self, obj):
+        self.send(obj)
+        return True
+
+
+class FakeTerminal(object):
+
+    """ Session registered with the engine. """
+
+    def __init__(self, sid):
+        self.sid = sid
+        self.master_write = FakeWriter()
+        self.invalidations = dict()
+
+
+class FakeClient(object):
+
+    """ Client of a session, its socket shut down by ``kill_session``. """
+
+    active = True
+
+    def fileno(self):
+        return None
+
+    recv_fileno = fileno
+
+    def shutdown(self):
+        self.active = False
+
+    deactivate = shutdown
+
+
+class PipeSession(object):
+
+    """ Session process, of the other end of the pipes of its terminal. """
+
+    def __init__(self, reader, writer):
+        self.reader, self.writer = reader, writer
+
+    def send_event(self, event, data):
+        self.writer.send((event, data))
+
+    def read_event(self, event, timeout=None):
+        while True:
+            recv_event, data = self.reader.recv()
+            if recv_event == 'exception':
+                raise data
+            elif recv_event == event:
+                return data
+
+    def flush_event(self, event):
+        return []
+
+    def buffer_pending_events(self):
+        pass
+
+
+@pytest.fixture
+def locks(monkeypatch):
+    """ Empty lock table, sessions and invalidations of the engine. """
+    for name, value in (('LOCKS', {}), ('LOCK_WAITERS', {}),
+                        ('THREAD_WAITERS', {})):
+        monkeypatch.setattr(engine, name, value)
+    monkeypatch.setattr(terminal, 'TERMINALS', dict())
+    monkeypatch.setattr(db, 'INVALIDATIONS', None)
+    db.enable_invalidations()
+    return engine.LOCKS
+
+
+def register(sid):
+    """ Return session ``sid``, registered with the engine. """
+    terminal.TERMINALS[sid] = FakeTerminal(sid)
+    return terminal.TERMINALS[sid]
+
+
+def handle_lock(tty, method, stale=None):
+    """ Handle lock event ``method`` of session ``tty``. """
+    engine.handle_lock(engine.LOCKS, tty, LOCK_EVENT, (method, stale),
+                       False, logging.getLogger(__name__))
+
+
+def test_lock_waiters(locks):
+    """ Sessions waiting for a lock are granted it in order. """
+    first, second, third = register('1'), register('2'), register('3')
+    handle_lock(first, 'wait')
+    handle_lock(second, 'wait')
+    handle_lock(third, 'acquire')
+    assert first.master_write.sent == [(LOCK_EVENT, True)]
+    assert third.master_write.sent == [(LOCK_EVENT, False)]
+    assert second.master_write.sent == []
+
+    handle_lock(first, 'release')
+    assert second.master_write.sent == [(LOCK_EVENT, True)]
+    assert locks[LOCK_EVENT][1] == '2'
+
+
+def test_lock_stale(locks):
+    """ A lock held by a session no longer active is released. """
+    first, second = register('1'), register('2')
+    handle_lock(first, 'wait')
+    handle_lock(second, 'wait')
+    del terminal.TERMINALS['1']
+    engine.release_stale_locks(locks, logging.getLogger(__name__))
+    assert second.master_write.sent == [(LOCK_EVENT, True)]
+
+
+def test_invalidations_before_grant(locks):
+    """ Writes made while a lock was held are sent before its grant. """
+    first, second = register('1'), register('2')
+    handle_lock(first, 'wait')
+    handle_lock(second, 'wait')
+    db.record_invalidations('test', 'unnamed', '__setitem__', (u'key', 1))
+    handle_lock(first, 'release')
+    assert second.master_write.sent == [
+        ('db-invalidate', [('test', 'unnamed', u'key')]),
+        (LOCK_EVENT, True)]
+
+
+def test_invalidations_coalesced(locks):
+    """ Keys written are sent to each session once, by table. """
+    first, second = register('1'), register('2')
+    for key in (u'b', u'a', u'b'):
+        db.record_invalidations('test', 'unnamed', '__setitem__', (key, 1))
+    db.record_invalidations('test', 'other', 'clear', ())
+    assert not engine.send_invalidations(terminal.get_terminals())
+    for tty in (first, second):
+        assert tty.master_write.sent == [('db-invalidate', [
+            ('test', 'other', None),
+            ('test', 'unnamed', u'a'), ('test', 'unnamed', u'b')])]
+    assert not engine.send_invalidations(terminal.get_terminals())
+    assert len(first.master_write.sent) == 1
+
+
+def test_invalidations_pipe_full(locks):
+    """ Invalidations are not sent to a session whose pipe is full. """
+    import multiprocessing
+    reader, writer = multiprocessing.Pipe(duplex=False)
+    tty = register('1')
+    tty.master_write = terminal.SessionWriter(writer)
+    try:
+        while tty.master_write.try_send(('input', u'x' * 1024)):
+            pass
+        db.record_invalidations('test', 'unnamed', '__setitem__', (u'a', 1))
+        assert engine.send_invalidations(terminal.get_terminals())
+        assert tty.invalidations == {('test', 'unnamed'): None}
+        while reader.poll():
+            assert reader.recv()[0] == 'input'
+        assert not engine.send_invalidations(terminal.get_terminals())
+        assert reader.recv() == ('db-invalidate', [('test', 'unnamed', None)])
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_thread_lock(locks):
+    """ Threads of the engine wait in turn with sessions for a lock. """
+    tty = register('1')
+    handle_lock(tty, 'wait')
+    assert not engine.acquire_thread_lock(LOCK_EVENT, timeout=0.01)
+    assert not engine.LOCK_WAITERS.get(LOCK_EVENT)
+
+    acquired = []
+    thread = threading.Thread(target=lambda: acquired.append(
+        engine.acquire_thread_lock(LOCK_EVENT, timeout=5)))
+    thread.start()
+    while not engine.LOCK_WAITERS.get(LOCK_EVENT) and thread.is_alive():
+        thread.join(0.01)
+    handle_lock(tty, 'release')
+    thread.join()
+    assert acquired == [True]
+    # pylint: disable=W0212
+    #         Access to a protected member _thread_holder of a client class
+    assert locks[LOCK_EVENT][1] == engine._thread_holder(thread)
+
+    # the thread has exited, its lock is stale.
+    handle_lock(tty, 'wait')
+    assert tty.master_write.sent[-1] == (LOCK_EVENT, True)
+
+    handle_lock(tty, 'release')
+    assert engine.acquire_thread_lock(LOCK_EVENT)
+    handle_lock(tty, 'wait')
+    engine.release_thread_lock(LOCK_EVENT)
+    assert locks[LOCK_EVENT][1] == '1'
+
+
+@pytest.fixture
+def session(locks, datapath, monkeypatch):
+    """ Pipes of a session, registered with the engine as ``tty``. """
+    import multiprocessing
+    for name in ('TERMINALS_BY_CLIENT', 'TERMINALS_BY_FD'):
+        monkeypatch.setattr(terminal, name, dict())
+    session_read, master_write = multiprocessing.Pipe(duplex=False)
+    master_read, session_write = multiprocessing.Pipe(duplex=False)
+    client = FakeClient()
+    tty = terminal.TerminalProcess(client, '1', (master_write, master_read))
+    terminal.TERMINALS[tty.sid] = tty
+    terminal.TERMINALS_BY_CLIENT[client] = tty
+    yield PipeSession(session_read, session_write)
+    for conn in (session_read, master_write, master_read, session_write):
+        conn.close()
+
+
+def test_disconnect_attrs(session, monkeypatch):
+    """ A session disconnected is served until it exits, writing attrs. """
+    import x84.bbs.session
+    from x84.bbs.exception import Disconnected
+    from x84.bbs.userbase import User
+    user = User(u'bob')
+    user.cache_attrs()
+    user['calls'] = 1
+    tty = terminal.get_tty('1')
+    terminal.kill_session(tty.client, 'hangup')
+    assert terminal.get_tty('1') is tty
+
+    def run():
+        # as x84.bbs.session.Session.run(), then close().
+        try:
+            session.read_event('input')
+        except Disconnected:
+            user.flush_attrs()
+        session.send_event('exit', None)
+
+    monkeypatch.setattr(x84.bbs.session, 'SESSION', session)
+    thread = threading.Thread(target=run)
+    thread.start()
+    stime = time.time()
+    while terminal.get_tty('1') is not None and time.time() - stime < 5:
+        if tty.master_read.poll(0.01):
+            engine.session_recv(engine.LOCKS, [(tty.sid, tty)],
+                                logging.getLogger(__name__), False)
+    thread.join()
+    assert terminal.get_tty('1') is None
+    monkeypatch.setattr(x84.bbs.session, 'SESSION', None)
+    assert User(u'bob').get('calls') == 1
+
+
+def test_disconnect_grace(session):
+    """ A session disconnected is unregistered if not exited in time. """
+    tty = terminal.get_tty('1')
+    terminal.kill_session(tty.client, 'hangup', grace=0.01)
+    assert engine.check_idle(terminal.get_terminals()) <= tty.exit_deadline
+    time.sleep(0.02)
+    engine.check_idle(terminal.get_terminals())
+    assert terminal.get_tty('1') is None
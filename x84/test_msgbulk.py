@@ -0,0 +1,74 @@
+""" Tests of bulk message import and export of x/84, :mod:`x84.msgbulk`. """
+# std imports
+import os
+
+# 3rd party
+import pytest
+
+# local
+from x84 import msgbulk
+from x84.dbinit import init_databases
+from x84.bbs.msgbase import (get_msg, get_thread, list_msgs, list_privmsgs,
+                             search, set_subscription, list_subscribed,
+                             count_unread)
+
+
+@pytest.fixture
+def msgbase(datapath):
+    """ Message base of the temporary data folder, as the engine begins. """
+    init_databases()
+    return datapath
+
+
+def record(idx, tags=(u'public',), parent=None, recipient=None,
+           author=u'alice', subject=u'subject'):
+    """ Return message record, as exported. """
+    return {u'idx': idx, u'author': author, u'recipient': recipient,
+            u'parent': parent, u'subject': subject, u'tags': list(tags),
+            u'ctime': u'2015-01-01 00:00:00',
+            u'stime': u'2015-01-01 00:00:00', u'body': u'body'}
+
+
+def test_import(msgbase):
+    """ Messages imported are indexed as those saved. """
+    set_subscription(u'bob', [u'fun*'])
+    set_subscription(u'carol', [u'fun*'])
+    # replies are related to parents imported before or after them.
+    indices = msgbulk.import_msgs([
+        record(7, parent=9, subject=u'Apples'),
+        record(8, tags=(u'public', u'funny'), author=u'bob'),
+        record(9, tags=(u'public', u'funny')),
+        record(10, tags=(), recipient=u'bob'),
+        record(11, tags=(u'private',)),
+    ], batch_size=2)
+    assert len(indices) == 4
+    reply, funny, parent, private = indices
+    assert get_msg(reply).parent == parent
+    assert get_msg(parent).children == set([reply])
+    assert [header['idx'] for header in get_thread(reply)] == [parent, reply]
+    assert list_msgs([u'public']) == set([reply, funny, parent])
+    assert list_privmsgs(u'bob') == set([private])
+    assert search(u'apples') == [reply]
+
+    # public messages of tag patterns subscribed are unread, but for their
+    # author, as are private messages of their recipient.
+    assert list_subscribed([u'fun*']) == set([funny, parent])
+    assert count_unread(u'bob', [u'fun*']) == {u'fun*': 1, u'': 1}
+    assert count_unread(u'carol', [u'fun*']) == {u'fun*': 2, u'': 0}
+
+
+def test_export_import(msgbase, tmpdir):
+    """ Messages exported are imported, of JSON lines or mbox folders. """
+    msgbulk.import_msgs([record(1, tags=(u'public', u'funny')),
+                         record(2, parent=1)])
+    filepaths = [os.path.join(str(tmpdir), filename)
+                 for filename in ('msgs.jsonl.gz', 'msgs.mbox')]
+    for filepath in filepaths:
+        assert msgbulk.export_msgs(filepath) == 2
+    for filepath in filepaths:
+        msgs = list(msgbulk.read_mbox(filepath) if msgbulk.is_mbox(filepath)
+                    else msgbulk.read_jsonl(filepath))
+        assert [(msg[u'tags'], msg[u'subject']) for msg in msgs] == [
+            ([u'funny', u'public'], u'subject'), ([u'public'], u'subject')]
+        first, reply = msgbulk.import_msgs(msgs)
+        assert get_msg(reply).parent == first
@@ -0,0 +1,91 @@
+""" Tests of message base maintenance of x/84, :mod:`x84.msgmaint`. """
+# std imports
+import datetime
+import gzip
+import json
+import os
+
+# 3rd party
+import pytest
+
+# local
+from x84 import msgmaint
+from x84.dbinit import init_databases
+from x84.bbs.dbproxy import DBProxy
+from x84.bbs.msgbase import (Msg, MSGDB, get_msg, get_thread, list_msgs,
+                             search)
+
+
+@pytest.fixture
+def msgbase(datapath):
+    """ Message base of the temporary data folder, as the engine begins. """
+    init_databases()
+    return datapath
+
+
+def post(tags, days_ago=0, parent=None):
+    """ Save and return new public message, sent ``days_ago``. """
+    msg = Msg(subject=u'subject', body=u'body')
+    msg.author, msg.tags, msg.parent = u'alice', set(tags), parent
+    msg.save(send_net=False, ctime=datetime.datetime.now() -
+             datetime.timedelta(days=days_ago))
+    return msg
+
+
+def test_get_retention(msgbase):
+    """ Retention policies are days by tag, invalid policies ignored. """
+    import x84.bbs.ini
+    x84.bbs.ini.CFG.set('msg', 'retention', 'x84net:90, public:365, bad')
+    assert msgmaint.get_retention() == {u'x84net': 90, u'public': 365}
+
+
+def test_get_expired(msgbase):
+    """ Messages are expired by the longest policy, of all of its tags. """
+    expired = post([u'public'], days_ago=10)
+    post([u'public'], days_ago=2)
+    post([u'public', u'x84net'], days_ago=10)
+    post([u'public', u'other'], days_ago=10)
+    assert msgmaint.get_expired({u'public': 5, u'x84net': 30}) == [
+        expired.idx]
+    assert msgmaint.get_expired({}) == []
+
+
+def test_archive_msgs(msgbase, tmpdir):
+    """ Messages are archived as one JSON object per line. """
+    first, second = post([u'public']), post([u'public'])
+    archive_path = os.path.join(str(tmpdir), 'archive')
+    filepath = msgmaint.archive_msgs([second.idx, first.idx], archive_path)
+    archive = gzip.open(filepath, 'rb')
+    try:
+        lines = [json.loads(line) for line in archive]
+    finally:
+        archive.close()
+    assert [line[u'idx'] for line in lines] == [first.idx, second.idx]
+    assert lines[0][u'tags'] == [u'public']
+
+
+def test_purge_indices(msgbase):
+    """ Messages no longer found are removed from all message indices. """
+    root = post([u'public'])
+    reply = post([u'public'], parent=root.idx)
+    del DBProxy(MSGDB)['%d' % (reply.idx,)]
+    assert msgmaint.purge_indices() > 0
+    assert list_msgs([u'public']) == set([root.idx])
+    assert search(u'subject') == [root.idx]
+    assert [header['idx'] for header in get_thread(root.idx)] == [root.idx]
+    assert get_msg(root.idx).children == set()
+    assert msgmaint.purge_indices() == 0
+
+
+def test_do_maintenance(msgbase, tmpdir):
+    """ Expired messages are archived and deleted. """
+    import x84.bbs.ini
+    archive_path = os.path.join(str(tmpdir), 'archive')
+    x84.bbs.ini.CFG.set('msg', 'retention', 'public:5')
+    x84.bbs.ini.CFG.set('msg', 'archive_path', archive_path)
+    expired, retained = post([u'public'], days_ago=10), post([u'public'])
+    msgmaint.do_maintenance()
+    assert list_msgs() == set([retained.idx])
+    with pytest.raises(KeyError):
+        get_msg(expired.idx)
+    assert len(os.listdir(archive_path)) == 1
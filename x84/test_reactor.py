@@ -0,0 +1,68 @@
+""" Tests of I/O readiness reactors of x/84, :mod:`x84.reactor`. """
+# std imports
+import threading
+import select
+import time
+import os
+
+# 3rd party
+import pytest
+
+# local
+from x84 import reactor
+
+REACTORS = [reactor.SelectReactor]
+if hasattr(select, 'poll'):
+    REACTORS.append(reactor.PollReactor)
+if hasattr(select, 'epoll'):
+    REACTORS.append(reactor.EpollReactor)
+
+
+@pytest.fixture(params=REACTORS)
+def instance(request):
+    """ Each reactor available, closed when finished. """
+    instance = request.param()
+    yield instance
+    instance.close()
+
+
+@pytest.fixture
+def pipe():
+    """ File descriptors ``(read, write)`` of a pipe. """
+    read_fd, write_fd = os.pipe()
+    yield read_fd, write_fd
+    os.close(read_fd)
+    os.close(write_fd)
+
+
+def test_register(instance, pipe):
+    """ Registered file descriptors are returned as they are readable. """
+    read_fd, write_fd = pipe
+    instance.register(read_fd)
+    instance.register(read_fd)
+    instance.register(None)
+    assert len(instance) == 1 and read_fd in instance
+    assert instance.poll(0) == []
+    os.write(write_fd, b'x')
+    assert instance.poll(0) == [read_fd]
+
+    instance.unregister(read_fd)
+    instance.unregister(read_fd)
+    assert len(instance) == 0
+    assert instance.poll(0) == []
+
+
+def test_wakeup(instance):
+    """ A blocking poll is interrupted by another thread, as no fds. """
+    timer = threading.Timer(0.05, instance.wakeup)
+    timer.start()
+    stime = time.time()
+    assert instance.poll(5) == []
+    assert time.time() - stime < 5
+    timer.join()
+
+    # a wakeup of a full pipe is not an error, and is drained by one poll.
+    for _ in range(100000):
+        instance.wakeup()
+    assert instance.poll(0) == []
+    assert instance.poll(0) == []
@@ -0,0 +1,47 @@
+""" Tests of session registration of x/84, :mod:`x84.terminal`. """
+# 3rd party
+import pytest
+
+# local
+from x84 import terminal
+
+
+class FakeTerminal(object):
+
+    """ Session of :func:`x84.terminal.allocate_node`. """
+
+    def __init__(self):
+        self.nodes = set()
+
+
+@pytest.fixture(autouse=True)
+def nodes(monkeypatch):
+    """ Node numbers allocated by each test. """
+    monkeypatch.setattr(terminal, 'NODES', dict())
+
+
+def test_allocate_node():
+    """ The lowest node number not in use is allocated. """
+    first, second, third = FakeTerminal(), FakeTerminal(), FakeTerminal()
+    assert [terminal.allocate_node(tty)
+            for tty in (first, second, third)] == [1, 2, 3]
+    assert second.nodes == set([(u'node', 2)])
+
+    terminal.release_node(second, u'node', 2)
+    terminal.release_node(second, u'node', 2)
+    terminal.release_node(first, u'node', 1)
+    assert second.nodes == set()
+    assert [terminal.allocate_node(FakeTerminal())
+            for _ in range(3)] == [1, 2, 4]
+
+
+def test_allocate_node_maximum():
+    """ Node numbers of each name are allocated up to ``maximum``. """
+    tty = FakeTerminal()
+    assert [terminal.allocate_node(tty, u'door', maximum=2)
+            for _ in range(3)] == [1, 2, None]
+    assert terminal.allocate_node(tty) == 1
+
+    terminal.release_node(tty, u'door', 2)
+    assert terminal.allocate_node(FakeTerminal(), u'door', maximum=1) is None
+    assert terminal.allocate_node(FakeTerminal(), u'door', maximum=2) == 2
@@ -184,12 +184,19 @@ def serve_messages_for(board_id, request_data, db_source):
 
         If ``idx`` is None, all messages are returned.
         """
-        for msg_id in db_tags.get(request_data['network'], []):
-            if idx is None:
-                yield db_messages[idx]
-            elif (int(msg_id) > int(idx) and
-                  not message_owned_by(msg_id, board_id)):
-                yield db_messages[msg_id]
+        msg_ids = sorted(
+            msg_id for msg_id in
+            db_tags.index_members([request_data['network']])
+            if idx is None or (int(msg_id) > int(idx) and
+                               not message_owned_by(msg_id, board_id)))
+        # messages are retrieved in bulk, one batch at a time.
+        for pos in range(0, len(msg_ids), BATCH_MSGS):
+            keys = ['%d' % (msg_id,)
+                    for msg_id in msg_ids[pos:pos + BATCH_MSGS]]
+            messages = db_messages.get_many(keys)
+            for key in keys:
+                if key in messages:
+                    yield messages[key]
 
     last_seen = request_data.get('last', None)
     pending_messages = msgs_after(last_seen)